@@ -8,16 +8,25 @@ app = marimo.App(width="medium", app_title="Cumulative bike distance")
 def _():
     import marimo as mo
 
-    import polars as pl
     import matplotlib.pyplot as plt
-    import numpy as np
 
-    import polars.selectors as cs
     from datetime import datetime, timezone
 
-    from strava_history_analysis import get_spine, get_time_series
+    from strava_history_analysis import (
+        cumulative_gear_table,
+        get_gear_ledger,
+        get_gear_totals,
+    )
 
-    return cs, datetime, get_spine, mo, pl, plt, timezone
+    return (
+        cumulative_gear_table,
+        datetime,
+        get_gear_ledger,
+        get_gear_totals,
+        mo,
+        plt,
+        timezone,
+    )
 
 
 @app.cell(hide_code=True)
@@ -25,7 +34,7 @@ def _(mo):
     mo.md(r"""
     # Outline of the cumulative notebook
 
-    1. We load the full dataset
+    1. We load the per-gear weekly totals, which are only updated with the activities that changed since the last run
     2. We create a new table whose rows are weeks since we started collecting data.
     3. Each column is the cumulative distance ridden on a specific bike.
     4. We figure out if we need to smooth the data in any way to make the plot look better.
@@ -34,41 +43,22 @@ def _(mo):
 
 
 @app.cell
-def _(get_spine):
-    df = get_spine(root_path="./", poll_strava=True)
-    return (df,)
+def _(get_gear_ledger, get_gear_totals):
+    totals = get_gear_totals(root_path="./", poll_strava=True)
+    ledger = get_gear_ledger(root_path="./")
+    return ledger, totals
 
 
 @app.cell
-def _(df):
-    df
+def _(totals):
+    totals
     return
 
 
 @app.cell
-def _(datetime, df, pl, timezone):
+def _(datetime, timezone):
     start_date = datetime(2026, 1, 1, tzinfo=timezone.utc)
-    f_date = pl.col("Activity Date") > start_date
-
-    df_gear = df.filter(
-        (pl.col("Activity Type") == 'Ride') & (pl.col("Activity Gear").is_not_null()) & f_date
-    ).select(
-        [
-            pl.col("Activity ID"),
-            pl.col("Activity Date"),
-            pl.col("Activity Gear"),
-            pl.col("Distance"),
-            (pl.col("Moving Time") / 3600).alias("Hours"),
-            pl.lit(1).alias("Count"),
-        ]
-    )
-    return df_gear, start_date
-
-
-@app.cell
-def _(df_gear):
-    bikes = df_gear["Activity Gear"].unique().to_list()
-    return (bikes,)
+    return (start_date,)
 
 
 @app.cell
@@ -78,45 +68,25 @@ def _():
 
 
 @app.cell
-def _(cs, df_gear, pl):
-    cumulative = (
-        df_gear
-        .with_columns(pl.col("Activity Date").dt.truncate("1w").alias("Week"))
-        .group_by("Week", "Activity Gear")
-        .agg(pl.col("Distance").sum())
-        .pivot(on="Activity Gear", index="Week", values="Distance")
-        .sort("Week")
-        .upsample(time_column="Week", every="1w")
-        .fill_null(0)
-        .with_columns(cs.numeric().cum_sum())
+def _(cumulative_gear_table, ledger, start_date, totals):
+    cumulative = cumulative_gear_table(
+        totals, "Distance", since=start_date, ledger=ledger
     )
-
-    cumulative_time = (
-        df_gear
-        .with_columns(pl.col("Activity Date").dt.truncate("1w").alias("Week"))
-        .group_by("Week", "Activity Gear")
-        .agg(pl.col("Hours").sum())
-        .pivot(on="Activity Gear", index="Week", values="Hours")
-        .sort("Week")
-        .upsample(time_column="Week", every="1w")
-        .fill_null(0)
-        .with_columns(cs.numeric().cum_sum())
+    cumulative_time = cumulative_gear_table(
+        totals, "Hours", since=start_date, ledger=ledger
     )
-
-    cumulative_count = (
-        df_gear
-        .with_columns(pl.col("Activity Date").dt.truncate("1w").alias("Week"))
-        .group_by("Week", "Activity Gear")
-        .agg(pl.col("Count").sum())
-        .pivot(on="Activity Gear", index="Week", values="Count")
-        .sort("Week")
-        .upsample(time_column="Week", every="1w")
-        .fill_null(0)
-        .with_columns(cs.numeric().cum_sum())
+    cumulative_count = cumulative_gear_table(
+        totals, "Count", since=start_date, ledger=ledger
     )
     return cumulative, cumulative_count, cumulative_time
 
 
+@app.cell
+def _(cumulative):
+    bikes = [c for c in cumulative.columns if c != "Week"]
+    return (bikes,)
+
+
 @app.cell
 def _(bikes, cumulative, plt, start_date, styles):
     def plot_cumulative_distance():
@@ -2,32 +2,98 @@
 Strava History Analysis
 
 A package for analyzing Strava activity history using FIT files and the Strava API.
+
+The public API is loaded lazily: importing the package is cheap, and each submodule (and with it
+stravalib, fitparse or scipy) is only imported the first time one of its names is used.
 """
 
-from .database import get_spine, initialize_db_from_strava_dump, update_spine_with_api_pull
-from .stravalib_wrapper import initialize_client
-from .time_series_parser import get_time_series, parse_fit_file, parse_strava_series
-from .time_series_functions import (
-    compute_peak_normalized_power,
-    normalized_power,
-    peak_normalized_power,
-    peak_rolling_hr,
-    general_power_adapter,
-    general_hr_adapter,
-)
-
-__all__ = [
-    "get_spine",
-    "initialize_db_from_strava_dump",
-    "update_spine_with_api_pull",
-    "initialize_client",
-    "get_time_series",
-    "parse_fit_file",
-    "parse_strava_series",
-    "compute_peak_normalized_power",
-    "normalized_power",
-    "peak_normalized_power",
-    "peak_rolling_hr",
-    "general_power_adapter",
-    "general_hr_adapter",
-]
+import importlib
+from typing import TYPE_CHECKING
+
+# Public name -> submodule that defines it
+_LAZY_ATTRIBUTES = {
+    "get_spine": "database",
+    "get_spine_handle": "database",
+    "initialize_db_from_strava_dump": "database",
+    "update_spine_with_api_pull": "database",
+    "normalize_spine": "database",
+    "spine_date_slice": "database",
+    "get_activity_index": "activity_index",
+    "search_activities": "activity_index",
+    "get_gear_totals": "gear_totals",
+    "get_gear_ledger": "gear_totals",
+    "cumulative_gear_table": "gear_totals",
+    "get_route_index": "spatial_index",
+    "search_route": "spatial_index",
+    "track_from_gpx": "spatial_index",
+    "align_on_distance": "course_comparison",
+    "find_duplicates": "duplicates",
+    "get_duplicates": "duplicates",
+    "drop_duplicates": "duplicates",
+    "get_durability": "durability",
+    "durability_observations": "durability",
+    "get_downsampled_history": "downsampling",
+    "get_pyramid": "downsampling",
+    "initialize_client": "stravalib_wrapper",
+    "daily_training_load": "training_load",
+    "get_training_load": "training_load",
+    "get_time_series": "time_series_parser",
+    "parse_fit_file": "time_series_parser",
+    "parse_strava_series": "time_series_parser",
+    "compute_peak_normalized_power": "time_series_functions",
+    "normalized_power": "time_series_functions",
+    "peak_normalized_power": "time_series_functions",
+    "peak_rolling_hr": "time_series_functions",
+    "general_power_adapter": "time_series_functions",
+    "general_hr_adapter": "time_series_functions",
+    "general_adapter": "time_series_functions",
+    "top_k_efforts": "time_series_functions",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(
+        importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__), name
+    )
+    # Cache it, so later lookups don't come through here again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .database import (
+        get_spine,  # noqa: F401
+        get_spine_handle,  # noqa: F401
+        initialize_db_from_strava_dump,  # noqa: F401
+        update_spine_with_api_pull,  # noqa: F401
+        normalize_spine,  # noqa: F401
+        spine_date_slice,  # noqa: F401
+    )
+    from .activity_index import get_activity_index, search_activities  # noqa: F401
+    from .gear_totals import get_gear_totals, get_gear_ledger, cumulative_gear_table  # noqa: F401
+    from .spatial_index import get_route_index, search_route, track_from_gpx  # noqa: F401
+    from .course_comparison import align_on_distance  # noqa: F401
+    from .duplicates import find_duplicates, get_duplicates, drop_duplicates  # noqa: F401
+    from .durability import get_durability, durability_observations  # noqa: F401
+    from .downsampling import get_downsampled_history, get_pyramid  # noqa: F401
+    from .stravalib_wrapper import initialize_client  # noqa: F401
+    from .training_load import daily_training_load, get_training_load  # noqa: F401
+    from .time_series_parser import get_time_series, parse_fit_file, parse_strava_series  # noqa: F401
+    from .time_series_functions import (
+        compute_peak_normalized_power,  # noqa: F401
+        normalized_power,  # noqa: F401
+        peak_normalized_power,  # noqa: F401
+        peak_rolling_hr,  # noqa: F401
+        general_power_adapter,  # noqa: F401
+        general_hr_adapter,  # noqa: F401
+        general_adapter,  # noqa: F401
+        top_k_efforts,  # noqa: F401
+    )
@@ -0,0 +1,217 @@
+"""
+Docstring for activity_index
+
+This module maintains a compact per-activity index, so threshold queries across the whole history
+("which rides had 20m power above 280 W on the gravel bike since 2024") don't need a full recompute over every time series.
+
+- For each activity we store the peak average power over a fixed set of durations, the max power, and
+  a time-in-zone histogram (seconds spent in each 25 W power bin).
+- The index is persisted in database/activity_index.parquet, and extended with just the unseen activities.
+- Metadata (type, gear, date) is joined from the spine at query time, so gear changes don't invalidate the index.
+- A query for an indexed duration is answered from the index directly. For any other duration, the histogram
+  (the mean of the d highest seconds) and the peaks at indexed durations dividing d give upper bounds on the peak,
+  which filter the candidates, and only the candidates get their time series opened for exact verification.
+"""
+
+import os
+from typing import List
+
+import numpy as np
+import polars as pl
+
+from .database import get_spine, normalize_spine, spine_date_slice
+from .time_series_functions import compute_peak_average_power, general_adapter
+from .time_series_parser import get_time_series
+
+INDEX_DURATIONS = [5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 10800, 14400]
+POWER_BIN_EDGES = np.arange(0, 1525, 25, dtype=np.float64)
+
+
+def peak_column(duration_seconds: int) -> str:
+    return f"Peak {duration_seconds}s power"
+
+
+def index_activity(power: np.ndarray) -> dict:
+    """
+    Returns the index entry for a single 1 Hz power series.
+    """
+    entry = {"Seconds": int(power.shape[0]), "Max power": None}
+    prefix = np.concatenate([[0.0], np.cumsum(power)])
+    for d in INDEX_DURATIONS:
+        if d > power.shape[0]:
+            entry[peak_column(d)] = None
+        else:
+            entry[peak_column(d)] = float(((prefix[d:] - prefix[:-d]) / d).max())
+
+    # Values above the last edge land in the last (open ended) bin
+    counts, _ = np.histogram(
+        np.clip(power, POWER_BIN_EDGES[0], POWER_BIN_EDGES[-1]), bins=POWER_BIN_EDGES
+    )
+    entry["Power histogram"] = counts.tolist()
+    if power.shape[0] > 0:
+        entry["Max power"] = float(power.max())
+    return entry
+
+
+def build_activity_index(
+    df: pl.DataFrame, root_path="./", cached: pl.DataFrame | None = None
+) -> pl.DataFrame:
+    """
+    Returns the index for every activity in the spine `df`, only opening the time series of
+    activities missing from `cached`.
+    """
+    seen = set() if cached is None else set(cached["Activity ID"].to_list())
+
+    entries = []
+    for activity in df.select("Activity ID", "Filename").iter_rows(named=True):
+        if activity["Activity ID"] in seen:
+            continue
+        ts_df = general_adapter(
+            ["power"],
+            get_time_series(file_path=activity["Filename"], root_path=root_path),
+        )
+        if ts_df["power"].null_count() == ts_df.shape[0]:
+            # Kept with null peaks and an empty histogram, so it isn't reopened next time
+            entry = index_activity(np.zeros(0))
+            entry["Seconds"] = ts_df.shape[0]
+        else:
+            entry = index_activity(ts_df["power"].to_numpy())
+        entry["Activity ID"] = activity["Activity ID"]
+        entries.append(entry)
+
+    schema = {
+        "Activity ID": pl.Int64,
+        "Seconds": pl.Int64,
+        "Max power": pl.Float64,
+        **{peak_column(d): pl.Float64 for d in INDEX_DURATIONS},
+        "Power histogram": pl.List(pl.Int64),
+    }
+    new_index = pl.DataFrame(entries, schema=schema)
+    if cached is None:
+        return new_index
+    return pl.concat([cached.select(list(schema)), new_index])
+
+
+def get_activity_index(root_path="./", poll_strava=False) -> pl.DataFrame:
+    """
+    Returns the activity index, extending the cached one with any activities the spine has that it doesn't.
+    """
+    index_path = os.path.join(root_path, "database", "activity_index.parquet")
+    df = get_spine(root_path=root_path, poll_strava=poll_strava)
+
+    cached = None
+    if os.path.exists(index_path):
+        cached = pl.read_parquet(index_path)
+
+    index = build_activity_index(df, root_path=root_path, cached=cached)
+    if cached is None or index.shape[0] != cached.shape[0]:
+        index.write_parquet(index_path)
+    return index
+
+
+def histogram_peak_upper_bound(
+    index: pl.DataFrame, duration_seconds: int
+) -> np.ndarray:
+    """
+    Upper bound on the peak duration_seconds power of every activity in the index: no window can average
+    more than the duration_seconds highest seconds of the ride, and those are bounded by their bins' upper edges.
+    """
+    counts = np.array(index["Power histogram"].to_list(), dtype=np.float64).reshape(
+        index.shape[0], POWER_BIN_EDGES.shape[0] - 1
+    )
+    upper_edges = np.broadcast_to(POWER_BIN_EDGES[1:], counts.shape).copy()
+    upper_edges[:, -1] = index["Max power"].fill_null(0.0).to_numpy()
+
+    # Walk the bins from the top, taking seconds until duration_seconds are taken
+    counts = counts[:, ::-1]
+    upper_edges = upper_edges[:, ::-1]
+    taken_before = np.cumsum(counts, axis=1) - counts
+    taken = np.clip(duration_seconds - taken_before, 0, counts)
+
+    return (taken * upper_edges).sum(axis=1) / duration_seconds
+
+
+def search_activities(
+    duration_seconds: int,
+    min_power: float,
+    root_path="./",
+    index: pl.DataFrame | None = None,
+    spine: pl.DataFrame | None = None,
+    activity_type: str | List[str] | None = None,
+    gear: str | List[str] | None = None,
+    since=None,
+    until=None,
+) -> pl.DataFrame:
+    """
+    Returns the activities whose peak duration_seconds average power is at least min_power, with
+    the exact peak in a "Peak {duration_seconds}s power" column, most recent first.
+
+    Metadata filters (activity type, gear, date range) and the index bounds are applied before any
+    time series is opened.
+    """
+    if spine is None:
+        spine = get_spine(root_path=root_path, poll_strava=False)
+    if index is None:
+        index = get_activity_index(root_path=root_path)
+
+    # The date range is a binary search on the sorted spine, and the type/gear filters compare
+    # dictionary codes of the categorical columns, so both run before the join with the index
+    spine = spine_date_slice(normalize_spine(spine), since=since, until=until)
+    filters = []
+    if activity_type is not None:
+        if isinstance(activity_type, str):
+            activity_type = [activity_type]
+        filters.append(pl.col("Activity Type").is_in(activity_type))
+    if gear is not None:
+        if isinstance(gear, str):
+            gear = [gear]
+        filters.append(pl.col("Activity Gear").is_in(gear))
+    if filters:
+        spine = spine.filter(filters)
+
+    candidates = (
+        spine.select(
+            "Activity ID",
+            "Activity Date",
+            "Activity Type",
+            "Activity Name",
+            "Activity Gear",
+            "Filename",
+        )
+        .join(index, on="Activity ID", how="inner")
+        .filter(pl.col("Seconds") >= duration_seconds)
+    )
+
+    column = peak_column(duration_seconds)
+    if duration_seconds in INDEX_DURATIONS:
+        result = candidates.filter(pl.col(column) >= min_power)
+    else:
+        upper_bound = histogram_peak_upper_bound(candidates, duration_seconds)
+        # A window that splits into k disjoint d-second windows can't beat the best of them
+        for d in INDEX_DURATIONS:
+            if duration_seconds % d == 0:
+                upper_bound = np.fmin(
+                    upper_bound,
+                    candidates[peak_column(d)].fill_null(np.inf).to_numpy(),
+                )
+        candidates = candidates.filter(pl.Series(upper_bound >= min_power))
+
+        # Exact verification, only for the activities that survived the bounds
+        result = candidates.with_columns(
+            pl.col("Filename")
+            .map_elements(
+                lambda f: compute_peak_average_power(duration_seconds, f, root_path),
+                return_dtype=pl.Float64,
+            )
+            .alias(column)
+        ).filter(pl.col(column) >= min_power)
+
+    return result.select(
+        "Activity ID",
+        "Activity Date",
+        "Activity Type",
+        "Activity Name",
+        "Activity Gear",
+        "Filename",
+        column,
+    ).sort("Activity Date", descending=True)
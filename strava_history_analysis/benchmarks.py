@@ -0,0 +1,102 @@
+"""
+Docstring for benchmarks
+
+This module keeps track of how long things take, so that regressions (like an eager import of stravalib
+creeping back into the package) show up as a number going up.
+
+- Import times are measured in fresh interpreters, since a module is only really imported once per process,
+  and we report the median over a few runs.
+- Results are appended to database/benchmarks.parquet with a timestamp, so the history can be plotted.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import polars as pl
+
+# What a notebook, a search worker, and the spine loading pay on import, respectively
+IMPORT_BENCHMARKS = [
+    "strava_history_analysis",
+    "strava_history_analysis.hyperparameter_fit",
+    "strava_history_analysis.database",
+]
+
+BENCHMARK_SCHEMA = {
+    "Timestamp": pl.Datetime("us", "UTC"),
+    "Benchmark": pl.String,
+    "Seconds": pl.Float64,
+}
+
+
+def measure_import_time(module: str, repeats: int = 5) -> float:
+    """
+    Returns the median wall-clock seconds `import module` takes in a fresh interpreter.
+    """
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [package_parent, env.get("PYTHONPATH")])
+    )
+    script = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)\n"
+    )
+
+    timings = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            check=True,
+            env=env,
+        )
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def record_benchmarks(results: Dict[str, float], root_path="./") -> pl.DataFrame:
+    """
+    Appends the {benchmark: seconds} results to database/benchmarks.parquet, and returns the whole history.
+    """
+    benchmarks_path = os.path.join(root_path, "database", "benchmarks.parquet")
+    now = datetime.now(timezone.utc)
+    new_rows = pl.DataFrame(
+        {
+            "Timestamp": [now] * len(results),
+            "Benchmark": list(results),
+            "Seconds": list(results.values()),
+        },
+        schema=BENCHMARK_SCHEMA,
+    )
+
+    history = new_rows
+    if os.path.exists(benchmarks_path):
+        history = pl.concat([pl.read_parquet(benchmarks_path), new_rows])
+    os.makedirs(os.path.dirname(benchmarks_path), exist_ok=True)
+    history.write_parquet(benchmarks_path)
+    return history
+
+
+def run_import_benchmarks(
+    root_path="./",
+    modules: List[str] = IMPORT_BENCHMARKS,
+    repeats: int = 5,
+    record: bool = True,
+) -> Dict[str, float]:
+    """
+    Measures the import time of every module, and unless record is False, appends them to the history.
+    """
+    results = {
+        f"import {module}": measure_import_time(module, repeats=repeats)
+        for module in modules
+    }
+    if record:
+        record_benchmarks(results, root_path=root_path)
+    return results
@@ -0,0 +1,117 @@
+"""
+Docstring for course_comparison
+
+This module lines up repeats of the same course by distance rather than elapsed time, so that pacing can be
+compared at the same point on the road.
+
+- Each activity is adapted to distance, elapsed seconds and the requested fields, and the distance is made
+  non-decreasing and relative to the start.
+- The fields are integrated over time, and the elapsed time and integrals are interpolated at the edges of
+  a shared distance grid (up to the shortest repeat's distance). A field's mean over a grid step is then its
+  integral over the step divided by the time taken, and the speed is the step length over that time.
+- All repeats are interpolated together: their series are concatenated with each shifted along the
+  distance axis past the end of the previous one, so every field is a single np.interp call however many
+  repeats there are.
+- Deltas are taken against a reference repeat (the first one, unless chosen), including the time gap.
+"""
+
+from typing import List
+
+import numpy as np
+import polars as pl
+
+from .time_series_functions import general_adapter
+from .time_series_parser import get_time_series
+
+COMPARISON_FIELDS = ["power", "heartrate"]
+
+
+def distance_series(file_path: str, fields: List[str], root_path="./") -> dict:
+    """
+    Returns the distance (m, from the start), elapsed seconds, and the running time integral of each field,
+    at every sample of an activity whose distance went up, as numpy arrays.
+    """
+    df = general_adapter(
+        ["distance"] + fields,
+        get_time_series(file_path=file_path, root_path=root_path),
+    )
+    if df["distance"].null_count() == df.shape[0]:
+        raise pl.exceptions.ColumnNotFoundError(f"{file_path} has no distance stream")
+
+    seconds = df["duration"].dt.total_seconds().cast(pl.Float64).to_numpy()
+    distance = df["distance"].cum_max().to_numpy()
+    distance = distance - distance[0]
+    # The first sample at each distance is when it was reached; time spent stopped there
+    # belongs to the step after it
+    _, first = np.unique(distance, return_index=True)
+
+    series = {"distance": distance[first], "seconds": seconds[first]}
+    step = np.diff(seconds, append=seconds[-1])
+    for f in fields:
+        integral = np.concatenate([[0.0], np.cumsum(df[f].to_numpy() * step)[:-1]])
+        series[f] = integral[first]
+    return series
+
+
+def align_on_distance(
+    activities: pl.DataFrame,
+    fields: List[str] = COMPARISON_FIELDS,
+    spacing: float = 100.0,
+    reference_id: int | None = None,
+    root_path="./",
+) -> pl.DataFrame:
+    """
+    Takes spine rows (Activity ID and Filename) for two or more repeats of a course, and returns one row
+    per repeat and grid step of spacing meters, with the step's start Distance, the Elapsed time at its end,
+    the mean of each field and the Speed over it, and the "... delta" of each of those (and the Time gap)
+    against the reference repeat.
+    """
+    ids = activities["Activity ID"].to_list()
+    if reference_id is None:
+        reference_id = ids[0]
+    reference = ids.index(reference_id)
+
+    series = [
+        distance_series(f, fields, root_path=root_path)
+        for f in activities["Filename"].to_list()
+    ]
+    course_length = min(s["distance"][-1] for s in series)
+    edges = np.arange(0.0, course_length + spacing / 2, spacing)
+    edges[-1] = min(edges[-1], course_length)
+    if edges.shape[0] < 2:
+        raise ValueError("The activities share less than one grid step of distance")
+
+    # Shift every repeat past the end of the previous one, and interpolate all of them at once
+    shift = max(s["distance"][-1] for s in series) + 2 * spacing
+    offsets = shift * np.arange(len(series))
+    distance = np.concatenate([s["distance"] + o for s, o in zip(series, offsets)])
+    queries = (edges[None, :] + offsets[:, None]).ravel()
+
+    def at_edges(name: str) -> np.ndarray:
+        values = np.concatenate([s[name] for s in series])
+        return np.interp(queries, distance, values).reshape(len(series), -1)
+
+    elapsed = at_edges("seconds")
+    step_time = np.diff(elapsed, axis=1)
+    # A step covered in no time (a GPS jump) has no meaningful means
+    safe_step_time = np.where(step_time > 0, step_time, np.nan)
+
+    columns = {
+        "Speed": np.diff(edges)[None, :] / safe_step_time,
+        **{f: np.diff(at_edges(f), axis=1) / safe_step_time for f in fields},
+    }
+    columns["Time gap"] = elapsed[:, 1:] - elapsed[reference, 1:]
+
+    n_steps = edges.shape[0] - 1
+    result = {
+        "Activity ID": np.repeat(ids, n_steps),
+        "Distance": np.tile(edges[:-1], len(ids)),
+        "Elapsed time": elapsed[:, 1:].ravel(),
+    }
+    for name, values in columns.items():
+        if name != "Time gap":
+            result[name] = values.ravel()
+            result[f"{name} delta"] = (values - values[reference]).ravel()
+    result["Time gap"] = columns["Time gap"].ravel()
+
+    return pl.DataFrame(result)
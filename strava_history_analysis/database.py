@@ -5,10 +5,14 @@ This module contains the basic functions we will use to create/update the databa
 """
 
 import polars as pl
+import numpy as np
 import os
 from .stravalib_wrapper import initialize_client
 import json
 
+# Low cardinality text columns, stored dictionary encoded
+CATEGORICAL_COLUMNS = ["Activity Type", "Activity Gear"]
+
 
 def initialize_db_from_strava_dump(root_path="./"):
     strava_supplied_dataset = pl.read_csv(
@@ -51,9 +55,9 @@ def update_spine_with_api_pull(df: pl.DataFrame, root_path="./") -> pl.DataFrame
     :return: Returns the updated DataFrame
     :rtype: DataFrame
 
-    This function relies on the Activity ID being sorted in the DataFrame
+    Strava hands out increasing Activity IDs, so everything newer than the largest ID we have is unseen
     """
-    last_seen_id = df["Activity ID"].last()
+    last_seen_id = df["Activity ID"].max()
 
     client = initialize_client(root_path=root_path)
     unseen_ids = []
@@ -142,29 +146,146 @@ def update_spine_with_api_pull(df: pl.DataFrame, root_path="./") -> pl.DataFrame
         pl.col("Average Cadence").cast(pl.Float64),
     )
 
-    df = pl.concat([df, new_df])
+    df = pl.concat([df, new_df], how="vertical_relaxed")
+
+    return normalize_spine(df)
+
+
+def normalize_spine(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Puts the spine in its canonical form: sorted by Activity Date (ties broken by Activity ID), with the
+    date column flagged as sorted so polars can binary search it, and Activity Type and Activity Gear
+    dictionary encoded. Cheap when the frame is already in this form.
+    """
+    df = df.with_columns(pl.col(CATEGORICAL_COLUMNS).cast(pl.Categorical))
+    if not df["Activity Date"].is_sorted():
+        df = df.sort("Activity Date", "Activity ID")
+    return df.with_columns(pl.col("Activity Date").set_sorted())
+
+
+def spine_date_slice(df: pl.DataFrame, since=None, until=None) -> pl.DataFrame:
+    """
+    Returns the activities with since <= Activity Date < until, found by binary search on the
+    (normalized) spine's sorted date column instead of a full scan.
+    """
+    dates = df["Activity Date"]
+    start = 0 if since is None else dates.search_sorted(since, side="left")
+    end = df.shape[0] if until is None else dates.search_sorted(until, side="left")
+    return df.slice(start, max(end - start, 0))
+
+
+class SpineHandle:
+    """
+    Docstring for SpineHandle
+
+    Keeps the spine in memory, so that repeated reads (e.g. one per notebook cell) don't go back to
+    disk or to Strava. Every read revalidates the cached frame with a stat of spine.parquet, and
+    re-reads it only if its mtime or size changed, e.g. because another process synced.
+
+    Polling Strava only happens through an explicit refresh().
+    """
 
-    return df
+    def __init__(self, root_path="./"):
+        self.root_path = root_path
+        self.path = os.path.join(root_path, "database", "spine.parquet")
+        self._df = None
+        self._stat_key = None
+        self._id_order = None
+
+    def _current_stat_key(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def is_stale(self) -> bool:
+        return self._df is None or self._current_stat_key() != self._stat_key
+
+    @property
+    def frame(self) -> pl.DataFrame:
+        """
+        The spine as an eager DataFrame, re-read only if the file changed since the last read.
+        """
+        if self.is_stale():
+            stat_key = self._current_stat_key()
+            if stat_key is None:
+                raise ValueError("Cannot initialize db without polling Strava")
+            self._df = normalize_spine(pl.read_parquet(self.path))
+            self._stat_key = stat_key
+            self._id_order = None
+        return self._df
+
+    def lazy(self) -> pl.LazyFrame:
+        """
+        A LazyFrame over the in-memory spine, for building up filters and projections.
+        """
+        return self.frame.lazy()
+
+    def refresh(self) -> pl.DataFrame:
+        """
+        Pulls any new activities from Strava (initializing the db from the CSV dump if there is
+        none yet), writes the spine, and returns it.
+        """
+        if self._current_stat_key() is None:
+            df = initialize_db_from_strava_dump(root_path=self.root_path)
+        else:
+            df = self.frame
+        df = normalize_spine(update_spine_with_api_pull(df, root_path=self.root_path))
+        df.write_parquet(self.path)
+
+        self._df = df
+        self._stat_key = self._current_stat_key()
+        self._id_order = None
+        return df
+
+    def between(self, since=None, until=None) -> pl.DataFrame:
+        """
+        The activities with since <= Activity Date < until, by binary search.
+        """
+        return spine_date_slice(self.frame, since=since, until=until)
+
+    def row_for_id(self, activity_id: int) -> dict | None:
+        """
+        Returns the spine row for activity_id as a dict, or None if there is none. The frame is
+        sorted by date, so the ids are searched through an argsort kept alongside it.
+        """
+        df = self.frame
+        if self._id_order is None:
+            ids = df["Activity ID"].to_numpy()
+            order = np.argsort(ids, kind="stable")
+            self._id_order = (ids[order], order)
+
+        sorted_ids, order = self._id_order
+        i = int(np.searchsorted(sorted_ids, activity_id))
+        if i == sorted_ids.shape[0] or sorted_ids[i] != activity_id:
+            return None
+        return df.row(int(order[i]), named=True)
+
+
+_SPINE_HANDLES = {}
+
+
+def get_spine_handle(root_path="./") -> SpineHandle:
+    """
+    Returns the process-wide SpineHandle for root_path, creating it on first use.
+    """
+    key = os.path.abspath(root_path)
+    if key not in _SPINE_HANDLES:
+        _SPINE_HANDLES[key] = SpineHandle(root_path=root_path)
+    return _SPINE_HANDLES[key]
 
 
-def get_spine(root_path="./", poll_strava=True):
+def get_spine(root_path="./", poll_strava=False):
     """
     Docstring for get_spine
 
-    First it checks local cache for the spine db. If it doesn't exist, it creates it from the csv.
-    If poll_strava is False, it just returns to locally cached parquet file.
+    Returns the spine through the memoized SpineHandle for root_path: the cached spine, only re-read
+    if spine.parquet changed on disk. Reads never reach Strava on their own; pass poll_strava=True (or
+    call get_spine_handle(root_path).refresh()) to pull new activities first, which also creates the
+    db from the csv if it doesn't exist yet.
     """
-    cached_df_path = os.path.join(root_path, "database", "spine.parquet")
-    if os.path.exists(cached_df_path):
-        df = pl.read_parquet(cached_df_path)
-        if poll_strava:
-            df = update_spine_with_api_pull(df, root_path=root_path)
-            df.write_parquet(cached_df_path)
-    else:
-        if not poll_strava:
-            raise ValueError("Cannot initialize db without polling Strava")
-        df = initialize_db_from_strava_dump(root_path=root_path)
-        df = update_spine_with_api_pull(df, root_path=root_path)
-        df.write_parquet(cached_df_path)
-
-    return df
+    handle = get_spine_handle(root_path=root_path)
+    if poll_strava:
+        return handle.refresh()
+    return handle.frame
@@ -0,0 +1,144 @@
+"""
+Docstring for downsampling
+
+This module keeps a multi-resolution pyramid of every activity's time series next to the parquet cache,
+so whole-history plots don't have to load the full 1 Hz data for each ride.
+
+- Each level buckets the adapted time series into fixed width windows (5s, 30s and 5m), and stores
+  the mean, max and min of each field over the bucket.
+- All levels of an activity live in one parquet file, cache/foo_fit_pyramid.parquet, built on first use.
+- For a plot, we pick the finest level whose total point count stays within the requested budget.
+"""
+
+import os
+from typing import List
+
+import polars as pl
+
+from .time_series_functions import general_adapter
+from .time_series_parser import get_cache_path, get_time_series
+
+# Bucket widths in seconds, finest first
+PYRAMID_LEVELS = [5, 30, 300]
+PYRAMID_FIELDS = ["power", "heartrate"]
+
+
+def build_pyramid(
+    df: pl.DataFrame,
+    fields: List[str] = PYRAMID_FIELDS,
+    levels: List[int] = PYRAMID_LEVELS,
+) -> pl.DataFrame:
+    """
+    Takes an adapted dataframe (duration plus the fields) and returns the stacked aggregates for every
+    level, keyed by Level and Offset (the bucket start in seconds).
+    """
+    seconds = pl.col("duration").dt.total_seconds().cast(pl.Int64)
+    aggregations = [pl.len().cast(pl.Int64).alias("Samples")]
+    for f in fields:
+        aggregations.extend(
+            [
+                pl.col(f).mean().alias(f"{f} mean"),
+                pl.col(f).max().alias(f"{f} max"),
+                pl.col(f).min().alias(f"{f} min"),
+            ]
+        )
+
+    return pl.concat(
+        [
+            df.group_by((seconds // level * level).alias("Offset"))
+            .agg(aggregations)
+            .select(pl.lit(level, dtype=pl.Int64).alias("Level"), pl.all())
+            .sort("Offset")
+            for level in levels
+        ]
+    )
+
+
+def get_pyramid(file_path: str, root_path: str = "./") -> pl.DataFrame:
+    """
+    Returns the pyramid for an activity, using a parquet cache next to the time series cache.
+
+    :param file_path: Relative path to the source file (e.g., "fit_files/123.fit")
+    :param root_path: Root directory of the project
+    """
+    cache_path = pyramid_cache_path(file_path, root_path)
+    if os.path.exists(cache_path):
+        return pl.read_parquet(cache_path)
+
+    df = build_pyramid(
+        general_adapter(
+            PYRAMID_FIELDS, get_time_series(file_path=file_path, root_path=root_path)
+        )
+    )
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    df.write_parquet(cache_path)
+    return df
+
+
+def warm_pyramid(file_path: str, root_path: str = "./") -> bool:
+    """
+    Makes sure the time series and pyramid caches of an activity exist, for warming the cache in
+    worker processes. Returns False if the activity has neither power nor heart rate.
+    """
+    return pyramid_has_data(get_pyramid(file_path, root_path=root_path))
+
+
+def pyramid_has_data(pyramid: pl.DataFrame, fields: List[str] = PYRAMID_FIELDS) -> bool:
+    # A field missing from the source is adapted to a null column, so its means are all null
+    return any(pyramid[f"{f} mean"].null_count() < pyramid.shape[0] for f in fields)
+
+
+def pyramid_cache_path(file_path: str, root_path: str = "./") -> str:
+    return get_cache_path(file_path, root_path).replace(".parquet", "_pyramid.parquet")
+
+
+def choose_level(
+    total_seconds: int, point_budget: int, levels: List[int] = PYRAMID_LEVELS
+) -> int:
+    """
+    Picks the finest level whose number of buckets over total_seconds fits in point_budget,
+    falling back to the coarsest level if none of them do.
+    """
+    for level in sorted(levels):
+        if total_seconds / level <= point_budget:
+            return level
+    return max(levels)
+
+
+def get_downsampled_history(
+    df: pl.DataFrame, point_budget: int = 100_000, root_path: str = "./"
+) -> pl.DataFrame:
+    """
+    Returns the downsampled time series of every activity in the spine `df`, concatenated and
+    keyed by Activity ID, with a Timestamp column (Activity Date + Offset) for plotting.
+
+    The level is chosen from the summed Elapsed Time so that the whole result fits in point_budget.
+    Activities with no data in any of the pyramid fields are left out.
+    """
+    level = choose_level(df["Elapsed Time"].sum(), point_budget)
+
+    frames = []
+    for activity in df.select("Activity ID", "Activity Date", "Filename").iter_rows(
+        named=True
+    ):
+        cache_path = pyramid_cache_path(activity["Filename"], root_path)
+        if not os.path.exists(cache_path):
+            get_pyramid(activity["Filename"], root_path=root_path)
+        frames.append(
+            pl.scan_parquet(cache_path)
+            .filter(pl.col("Level") == level)
+            .with_columns(
+                pl.lit(activity["Activity ID"], dtype=pl.Int64).alias("Activity ID"),
+                (
+                    pl.lit(activity["Activity Date"])
+                    + pl.duration(seconds=pl.col("Offset"))
+                ).alias("Timestamp"),
+            )
+        )
+
+    # Activities without any of the fields (e.g. a swim without heart rate) have all-null means
+    frames = [frame for frame in pl.collect_all(frames) if pyramid_has_data(frame)]
+    if not frames:
+        return pl.DataFrame()
+    return pl.concat(frames)
@@ -0,0 +1,270 @@
+"""
+Docstring for duplicates
+
+This module finds activities recorded more than once: the same ride in both the CSV dump and an API pull,
+or a head unit and a watch recording together. Left in, they count twice in the pacing data and the
+gear totals.
+
+- Candidates are pairs of activities whose (start, start + elapsed) intervals overlap by at least
+  min_overlap of the shorter one. With the starts sorted, the activities overlapping each one are a
+  contiguous run found by binary search, so the sweep is O(n log n) plus the number of pairs.
+- Each candidate is confirmed by a cheap fingerprint of its streams, the 30 second power and heart rate
+  means from the pyramid cache, aligned on wall clock time: two recordings of the same ride agree on
+  those, two different rides that happen to overlap (a forgotten stop button, say) don't.
+- Without a stream to compare, a candidate is confirmed if the distances agree instead.
+- Of a confirmed pair, the recording with power is kept, then the one with a gear, then the one with more
+  moving time, so a watch started early doesn't push out the head unit's power data.
+- The checked pairs are persisted in database/duplicates.parquet, and only pairs not in it get their
+  fingerprints compared.
+"""
+
+import os
+
+import numpy as np
+import polars as pl
+
+from .downsampling import get_pyramid, pyramid_has_data
+
+FINGERPRINT_LEVEL = 30  # seconds, one of the pyramid levels
+FINGERPRINT_FIELDS = ["power", "heartrate"]
+MIN_SHARED_BUCKETS = 10
+
+DUPLICATES_SCHEMA = {
+    "Activity ID": pl.Int64,
+    "Duplicate ID": pl.Int64,
+    "Overlap": pl.Float64,
+    "Similarity": pl.Float64,
+    "Confirmed": pl.Boolean,
+    "Activity has power": pl.Boolean,
+    "Duplicate has power": pl.Boolean,
+}
+PAIR_KEY = ["Activity ID", "Duplicate ID"]
+
+
+def overlapping_pairs(df: pl.DataFrame, min_overlap: float = 0.5) -> pl.DataFrame:
+    """
+    Returns the Activity ID and Duplicate ID (the later starting one) of every pair of activities in the
+    spine `df` whose time intervals overlap by at least min_overlap of the shorter, with that Overlap.
+    Rows repeating an Activity ID are the same activity, and never pair with each other.
+    """
+    df = df.unique("Activity ID", keep="first", maintain_order=True)
+    starts = df["Activity Date"].dt.epoch("s").to_numpy()
+    elapsed = df["Elapsed Time"].fill_null(0).to_numpy()
+    order = np.argsort(starts, kind="stable")
+    ids = df["Activity ID"].to_numpy()[order]
+    starts = starts[order]
+    elapsed = elapsed[order]
+    ends = starts + elapsed
+
+    # Activities i + 1, ..., stop[i] - 1 start before activity i ends
+    n = starts.shape[0]
+    stop = np.searchsorted(starts, ends, side="left")
+    counts = np.maximum(stop - np.arange(n) - 1, 0)
+    first = np.repeat(np.arange(n), counts)
+    run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + np.arange(counts.sum()) - run_starts
+
+    shared = np.minimum(ends[first], ends[second]) - starts[second]
+    shorter = np.maximum(np.minimum(elapsed[first], elapsed[second]), 1)
+    overlap = shared / shorter
+
+    keep = (overlap >= min_overlap) & (ids[first] != ids[second])
+    return pl.DataFrame(
+        {
+            "Activity ID": ids[first][keep],
+            "Duplicate ID": ids[second][keep],
+            "Overlap": overlap[keep].astype(np.float64),
+        },
+        schema={
+            k: DUPLICATES_SCHEMA[k] for k in ["Activity ID", "Duplicate ID", "Overlap"]
+        },
+    )
+
+
+def pyramid_fingerprint(pyramid: pl.DataFrame, start) -> pl.DataFrame:
+    """
+    Returns the FINGERPRINT_LEVEL second means of the fingerprint fields of an activity's pyramid, keyed
+    by wall clock Bucket (seconds since the epoch, divided by FINGERPRINT_LEVEL).
+    """
+    start_seconds = int(start.timestamp())
+    return pyramid.filter(pl.col("Level") == FINGERPRINT_LEVEL).select(
+        ((start_seconds + pl.col("Offset")) // FINGERPRINT_LEVEL).alias("Bucket"),
+        *[pl.col(f"{f} mean").alias(f) for f in FINGERPRINT_FIELDS],
+    )
+
+
+def fingerprint_similarity(a: pl.DataFrame, b: pl.DataFrame) -> float | None:
+    """
+    Returns 1 minus the median relative difference of the two fingerprints, over the buckets where both
+    have a non-zero value, for whichever field agrees best. None if no field has MIN_SHARED_BUCKETS such buckets.
+    """
+    shared = a.join(b, on="Bucket", how="inner", suffix=" other")
+    similarities = []
+    for f in FINGERPRINT_FIELDS:
+        both = shared.filter((pl.col(f) > 0) & (pl.col(f"{f} other") > 0))
+        if both.shape[0] < MIN_SHARED_BUCKETS:
+            continue
+        difference = (pl.col(f) - pl.col(f"{f} other")).abs() / (
+            (pl.col(f) + pl.col(f"{f} other")) / 2
+        )
+        similarities.append(1.0 - both.select(difference.median()).item())
+    if not similarities:
+        return None
+    return max(similarities)
+
+
+def find_duplicates(
+    df: pl.DataFrame,
+    root_path="./",
+    min_overlap: float = 0.5,
+    min_similarity: float = 0.9,
+    max_distance_difference: float = 0.1,
+) -> pl.DataFrame:
+    """
+    Returns the overlapping pairs of activities in the spine `df`, with the Similarity of their
+    fingerprints and whether they are Confirmed duplicates: by a similarity of at least min_similarity,
+    or without a fingerprint to compare, by distances within max_distance_difference of each other.
+    """
+    pairs = overlapping_pairs(df, min_overlap=min_overlap)
+    if pairs.is_empty():
+        return pl.DataFrame(schema=DUPLICATES_SCHEMA)
+
+    involved = df.join(
+        pl.concat([pairs["Activity ID"], pairs["Duplicate ID"]]).unique().to_frame(),
+        on="Activity ID",
+        how="semi",
+    )
+    fingerprints = {}
+    distances = {}
+    has_power = {}
+    for activity in involved.select(
+        "Activity ID", "Activity Date", "Filename", "Distance"
+    ).iter_rows(named=True):
+        distances[activity["Activity ID"]] = activity["Distance"]
+        pyramid = get_pyramid(activity["Filename"], root_path=root_path)
+        # Without power or heart rate (a manual entry, say) there is nothing to compare
+        if not pyramid_has_data(pyramid, FINGERPRINT_FIELDS):
+            has_power[activity["Activity ID"]] = False
+            continue
+        fingerprint = pyramid_fingerprint(pyramid, activity["Activity Date"])
+        fingerprints[activity["Activity ID"]] = fingerprint
+        has_power[activity["Activity ID"]] = bool(
+            (fingerprint["power"].fill_null(0) > 0).any()
+        )
+
+    similarities = []
+    confirmed = []
+    for a, b in pairs.select("Activity ID", "Duplicate ID").iter_rows():
+        similarity = None
+        if a in fingerprints and b in fingerprints:
+            similarity = fingerprint_similarity(fingerprints[a], fingerprints[b])
+        similarities.append(similarity)
+        if similarity is not None:
+            confirmed.append(similarity >= min_similarity)
+        elif distances[a] and distances[b]:
+            confirmed.append(
+                abs(distances[a] - distances[b]) / max(distances[a], distances[b])
+                <= max_distance_difference
+            )
+        else:
+            confirmed.append(False)
+
+    return pairs.with_columns(
+        pl.Series("Similarity", similarities, dtype=pl.Float64),
+        pl.Series("Confirmed", confirmed, dtype=pl.Boolean),
+        pl.col("Activity ID")
+        .replace_strict(has_power, return_dtype=pl.Boolean)
+        .alias("Activity has power"),
+        pl.col("Duplicate ID")
+        .replace_strict(has_power, return_dtype=pl.Boolean)
+        .alias("Duplicate has power"),
+    )
+
+
+def get_duplicates(df: pl.DataFrame, root_path="./", **kwargs) -> pl.DataFrame:
+    """
+    find_duplicates for the spine `df`, with the pairs checked before read from database/duplicates.parquet.
+    The overlaps always come from the current spine, so pairs that no longer overlap drop out, and only
+    the new pairs get their fingerprints compared. Extra keyword arguments go to find_duplicates.
+    """
+    duplicates_path = os.path.join(root_path, "database", "duplicates.parquet")
+    pairs = overlapping_pairs(df, min_overlap=kwargs.get("min_overlap", 0.5))
+
+    cached = pl.DataFrame(schema=DUPLICATES_SCHEMA)
+    if os.path.exists(duplicates_path):
+        cached = pl.read_parquet(duplicates_path)
+        if cached.schema != pl.Schema(DUPLICATES_SCHEMA):
+            cached = pl.DataFrame(schema=DUPLICATES_SCHEMA)
+
+    new_pairs = pairs.join(cached, on=PAIR_KEY, how="anti")
+    checked = pl.DataFrame(schema=DUPLICATES_SCHEMA)
+    if not new_pairs.is_empty():
+        involved = df.join(
+            pl.concat([new_pairs["Activity ID"], new_pairs["Duplicate ID"]])
+            .unique()
+            .to_frame(),
+            on="Activity ID",
+            how="semi",
+        )
+        checked = find_duplicates(involved, root_path=root_path, **kwargs).join(
+            new_pairs.select(PAIR_KEY), on=PAIR_KEY, how="semi"
+        )
+
+    duplicates = (
+        pairs.join(
+            pl.concat([cached, checked]).drop("Overlap"), on=PAIR_KEY, how="inner"
+        )
+        .select(list(DUPLICATES_SCHEMA))
+        .sort(PAIR_KEY)
+    )
+    if not checked.is_empty() or duplicates.shape[0] != cached.shape[0]:
+        os.makedirs(os.path.dirname(duplicates_path), exist_ok=True)
+        duplicates.write_parquet(duplicates_path)
+    return duplicates
+
+
+def drop_duplicates(df: pl.DataFrame, duplicates: pl.DataFrame) -> pl.DataFrame:
+    """
+    Removes one activity of every confirmed pair from the spine `df`. The one kept is the one with power,
+    then the one with a gear, then the one with more moving time, and on a full tie the earlier one.
+    Rows repeating an Activity ID are collapsed to the first of them.
+    """
+    df = df.unique("Activity ID", keep="first", maintain_order=True).with_row_index(
+        "Row"
+    )
+    ranks = df.select(
+        "Row",
+        "Activity ID",
+        pl.col("Activity Gear").is_not_null().alias("has gear"),
+        pl.col("Moving Time").fill_null(0).alias("moving time"),
+    )
+    confirmed = (
+        duplicates.filter(
+            pl.col("Confirmed"), pl.col("Activity ID") != pl.col("Duplicate ID")
+        )
+        .join(ranks, on="Activity ID")
+        .join(ranks, left_on="Duplicate ID", right_on="Activity ID", suffix=" other")
+    )
+
+    # Compared lexicographically: the duplicate is kept if it ranks strictly higher
+    duplicate_wins = pl.lit(False)
+    for this, other in reversed(
+        [
+            (
+                pl.col("Activity has power").fill_null(False),
+                pl.col("Duplicate has power").fill_null(False),
+            ),
+            (pl.col("has gear"), pl.col("has gear other")),
+            (pl.col("moving time"), pl.col("moving time other")),
+        ]
+    ):
+        duplicate_wins = (
+            pl.when(other.cast(pl.Int64) != this.cast(pl.Int64))
+            .then(other.cast(pl.Int64) > this.cast(pl.Int64))
+            .otherwise(duplicate_wins)
+        )
+
+    dropped = confirmed.select(
+        pl.when(duplicate_wins).then(pl.col("Row")).otherwise(pl.col("Row other"))
+    ).to_series()
+    return df.filter(~pl.col("Row").is_in(dropped.implode())).drop("Row")
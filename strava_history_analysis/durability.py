@@ -0,0 +1,166 @@
+"""
+Docstring for durability
+
+This module measures durability: the best power held over a duration once a given amount of work is already
+in the legs. For ultras, what matters is what can be held after 2000 kJ, not fresh.
+
+- For each activity, and each (duration, threshold) pair, we store the peak average power over windows of
+  that duration starting after the cumulative work passed the threshold (in kJ).
+- Everything comes from one prefix sum of the 1 Hz power per activity: it gives the work done before every
+  second (so the first allowed start for every threshold is one binary search), and the average of every
+  window. A suffix maximum of the window averages then answers all thresholds of a duration at once.
+- The table is persisted in database/durability.parquet, and extended with just the unseen activities.
+  The second recording of a ride recorded twice is left out, as in the pacing data.
+- The columns are laid out like the pacing model's observation columns, so they can be fed to
+  PacingModel.update_based_on_observations as censored observations: a ride shows at least that much is
+  sustainable, fatigued or not.
+"""
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+import polars as pl
+
+from .database import get_spine
+from .duplicates import drop_duplicates, get_duplicates
+from .time_series_functions import fill_duration_gaps, general_adapter
+from .time_series_parser import get_time_series
+
+DURABILITY_DURATIONS = [5, 20, 60]  # minutes
+DURABILITY_THRESHOLDS = [0, 1000, 2000, 3000, 4000]  # kJ
+
+
+def durability_column(duration_minutes: int, threshold_kj: int) -> str:
+    return f"Peak {duration_minutes}m power after {threshold_kj} kJ"
+
+
+def durability_curve(
+    power: np.ndarray,
+    durations: List[int] = DURABILITY_DURATIONS,
+    thresholds: List[int] = DURABILITY_THRESHOLDS,
+) -> np.ndarray:
+    """
+    Takes a 1 Hz power series and returns the (len(durations), len(thresholds)) peak average powers over
+    windows starting after each threshold's kJ of work, NaN where no such window fits.
+    """
+    prefix = np.concatenate([[0.0], np.cumsum(np.maximum(power, 0.0))])
+    # First second by which the work done reaches each threshold
+    starts = np.searchsorted(prefix, 1000.0 * np.asarray(thresholds), side="left")
+
+    curve = np.full((len(durations), len(thresholds)), np.nan)
+    for i, minutes in enumerate(durations):
+        d = 60 * minutes
+        if d > power.shape[0]:
+            continue
+        averages = (prefix[d:] - prefix[:-d]) / d
+        # best_from[s] is the best window starting at s or later
+        best_from = np.maximum.accumulate(averages[::-1])[::-1]
+        fits = starts < averages.shape[0]
+        curve[i, fits] = best_from[starts[fits]]
+    return curve
+
+
+def durability_entry(
+    power: np.ndarray,
+    durations: List[int] = DURABILITY_DURATIONS,
+    thresholds: List[int] = DURABILITY_THRESHOLDS,
+) -> dict:
+    curve = durability_curve(power, durations, thresholds)
+    return {
+        durability_column(d, k): None if np.isnan(curve[i, j]) else float(curve[i, j])
+        for i, d in enumerate(durations)
+        for j, k in enumerate(thresholds)
+    }
+
+
+def build_durability_table(
+    df: pl.DataFrame,
+    root_path="./",
+    cached: pl.DataFrame | None = None,
+    durations: List[int] = DURABILITY_DURATIONS,
+    thresholds: List[int] = DURABILITY_THRESHOLDS,
+) -> pl.DataFrame:
+    """
+    Returns the durability entry of every activity in the spine `df`, only opening the time series of
+    activities missing from `cached`. Activities without power are kept with null entries, so they
+    aren't reopened next time. A cached table with other durations or thresholds is rebuilt.
+    """
+    schema = {
+        "Activity ID": pl.Int64,
+        **{durability_column(d, k): pl.Float64 for d in durations for k in thresholds},
+    }
+    if cached is not None and cached.schema != pl.Schema(schema):
+        cached = None
+    seen = set() if cached is None else set(cached["Activity ID"].to_list())
+
+    entries = []
+    for activity in df.select("Activity ID", "Filename").iter_rows(named=True):
+        if activity["Activity ID"] in seen:
+            continue
+        ts_df = general_adapter(
+            ["power"],
+            get_time_series(file_path=activity["Filename"], root_path=root_path),
+        )
+        if ts_df["power"].null_count() == ts_df.shape[0]:
+            entry = durability_entry(np.zeros(0), durations, thresholds)
+        else:
+            # Recording gaps count as seconds of no work, so the kJ line up with elapsed time
+            power = fill_duration_gaps(ts_df)["power"].to_numpy()
+            entry = durability_entry(power, durations, thresholds)
+        entry["Activity ID"] = activity["Activity ID"]
+        entries.append(entry)
+
+    new_table = pl.DataFrame(entries, schema=schema)
+    if cached is None:
+        return new_table
+    # Cached activities no longer in `df` (e.g. since found to be duplicates) drop out
+    return pl.concat([cached, new_table]).join(
+        df.select("Activity ID"), on="Activity ID", how="semi"
+    )
+
+
+def get_durability(root_path="./", poll_strava=False) -> pl.DataFrame:
+    """
+    Returns the durability table, extending the cached one with any activities the spine has that it doesn't,
+    and leaving out duplicate recordings.
+    """
+    table_path = os.path.join(root_path, "database", "durability.parquet")
+    df = get_spine(root_path=root_path, poll_strava=poll_strava)
+    # Like construct_dataframe, a ride recorded twice is only one observation
+    df = drop_duplicates(df, get_duplicates(df, root_path=root_path))
+
+    cached = None
+    if os.path.exists(table_path):
+        cached = pl.read_parquet(table_path)
+
+    table = build_durability_table(df, root_path=root_path, cached=cached)
+    if cached is None or not table.equals(cached):
+        table.write_parquet(table_path)
+    return table
+
+
+def durability_observation_columns(
+    threshold_kj: int, durations: List[int] = DURABILITY_DURATIONS
+) -> List[Tuple[int, str]]:
+    """
+    The (duration in minutes, column) pairs of one threshold, in the format of
+    CENSORED_OBSERVATION_COLUMNS in hyperparameter_fit.
+    """
+    return [(d, durability_column(d, threshold_kj)) for d in durations]
+
+
+def durability_observations(
+    entry: dict,
+    threshold_kj: int,
+    durations: List[int] = DURABILITY_DURATIONS,
+) -> List[Tuple[int, float]]:
+    """
+    Takes one row of the durability table (as a dict) and returns its (duration, power) pairs for the
+    threshold, ready to pass as censored observations to PacingModel.update_based_on_observations.
+    """
+    return [
+        (d, entry[column])
+        for d, column in durability_observation_columns(threshold_kj, durations)
+        if entry.get(column) is not None
+    ]
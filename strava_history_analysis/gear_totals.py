@@ -0,0 +1,200 @@
+"""
+Docstring for gear_totals
+
+This module keeps per-gear weekly and monthly totals (distance, hours, activity count and elevation gain),
+so the cumulative gear plots don't regroup the whole spine on every run.
+
+- The totals table has one row per period (week or month), period start, activity type and gear, and is
+  persisted in database/gear_totals.parquet.
+- Next to it, database/gear_totals_ledger.parquet records the spine values each activity was counted with.
+- On an update, activities that are new or whose gear, type, date, distance, moving time or elevation
+  changed since they were counted are added, and the values they were counted with are subtracted,
+  so a sync or a metadata refresh that moves a ride to another bike only touches the rows involved.
+- Activities without a gear, and the second recording of a ride recorded twice, are left out.
+"""
+
+import os
+
+import polars as pl
+import polars.selectors as cs
+
+from .database import get_spine
+from .duplicates import drop_duplicates, get_duplicates
+
+PERIODS = {"week": "1w", "month": "1mo"}
+
+LEDGER_SCHEMA = {
+    "Activity ID": pl.Int64,
+    "Activity Date": pl.Datetime("us", "UTC"),
+    "Activity Type": pl.String,
+    "Activity Gear": pl.String,
+    "Distance": pl.Float64,
+    "Moving Time": pl.Int64,
+    "Elevation Gain": pl.Float64,
+}
+
+TOTALS_SCHEMA = {
+    "Period": pl.String,
+    "Period start": pl.Datetime("us", "UTC"),
+    "Activity Type": pl.String,
+    "Activity Gear": pl.String,
+    "Distance": pl.Float64,
+    "Hours": pl.Float64,
+    "Count": pl.Int64,
+    "Elevation Gain": pl.Float64,
+}
+
+TOTALS_KEY = ["Period", "Period start", "Activity Type", "Activity Gear"]
+METRICS = ["Distance", "Hours", "Count", "Elevation Gain"]
+
+
+def ledger_from_spine(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    The values of every activity with a gear that the totals are made of.
+    """
+    return (
+        df.filter(pl.col("Activity Gear").is_not_null())
+        .select(list(LEDGER_SCHEMA))
+        .cast(LEDGER_SCHEMA)
+        .with_columns(pl.col("Elevation Gain").fill_null(0.0))
+    )
+
+
+def _period_totals(ledger: pl.DataFrame, sign: int) -> pl.DataFrame:
+    # Totals of the ledger rows for every period, multiplied by sign
+    return pl.concat(
+        [
+            ledger.group_by(
+                pl.lit(period).alias("Period"),
+                pl.col("Activity Date").dt.truncate(every).alias("Period start"),
+                "Activity Type",
+                "Activity Gear",
+            ).agg(
+                (sign * pl.col("Distance").sum()).alias("Distance"),
+                (sign * pl.col("Moving Time").sum() / 3600).alias("Hours"),
+                (sign * pl.len()).cast(pl.Int64).alias("Count"),
+                (sign * pl.col("Elevation Gain").sum()).alias("Elevation Gain"),
+            )
+            for period, every in PERIODS.items()
+        ]
+    ).select(list(TOTALS_SCHEMA))
+
+
+def update_gear_totals(
+    df: pl.DataFrame,
+    totals: pl.DataFrame | None = None,
+    ledger: pl.DataFrame | None = None,
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Brings the totals (and the ledger they were built from) up to date with the spine `df`, and returns
+    (totals, ledger). Only activities that are new, gone, or changed since the ledger are aggregated.
+    """
+    if totals is None or ledger is None:
+        totals = pl.DataFrame(schema=TOTALS_SCHEMA)
+        ledger = pl.DataFrame(schema=LEDGER_SCHEMA)
+
+    current = ledger_from_spine(df)
+    columns = list(LEDGER_SCHEMA)
+    added = current.join(ledger, on=columns, how="anti", nulls_equal=True)
+    removed = ledger.join(current, on=columns, how="anti", nulls_equal=True)
+    if added.is_empty() and removed.is_empty():
+        return totals, ledger
+
+    delta = pl.concat([_period_totals(added, 1), _period_totals(removed, -1)])
+    totals = (
+        pl.concat([totals, delta])
+        .group_by(TOTALS_KEY)
+        .agg(pl.col(METRICS).sum())
+        .filter(pl.col("Count") != 0)
+        .select(list(TOTALS_SCHEMA))
+        .sort(TOTALS_KEY)
+    )
+    ledger = pl.concat(
+        [
+            ledger.join(removed, on=columns, how="anti", nulls_equal=True),
+            added,
+        ]
+    ).sort("Activity Date")
+    return totals, ledger
+
+
+def get_gear_totals(root_path="./", poll_strava=False) -> pl.DataFrame:
+    """
+    Returns the per-gear weekly and monthly totals, updating the cached table with whatever
+    changed in the spine since it was last written.
+    """
+    totals_path = os.path.join(root_path, "database", "gear_totals.parquet")
+    ledger_path = os.path.join(root_path, "database", "gear_totals_ledger.parquet")
+
+    df = get_spine(root_path=root_path, poll_strava=poll_strava)
+    df = drop_duplicates(df, get_duplicates(df, root_path=root_path))
+
+    totals = None
+    ledger = None
+    if os.path.exists(totals_path) and os.path.exists(ledger_path):
+        totals = pl.read_parquet(totals_path)
+        ledger = pl.read_parquet(ledger_path)
+
+    new_totals, new_ledger = update_gear_totals(df, totals=totals, ledger=ledger)
+    if new_ledger is not ledger:
+        new_totals.write_parquet(totals_path)
+        new_ledger.write_parquet(ledger_path)
+    return new_totals
+
+
+def get_gear_ledger(root_path="./") -> pl.DataFrame:
+    """
+    Returns the ledger the cached totals were built from (empty if there is none yet), e.g. to pass to
+    cumulative_gear_table along with the totals from get_gear_totals.
+    """
+    ledger_path = os.path.join(root_path, "database", "gear_totals_ledger.parquet")
+    if not os.path.exists(ledger_path):
+        return pl.DataFrame(schema=LEDGER_SCHEMA)
+    return pl.read_parquet(ledger_path)
+
+
+def cumulative_gear_table(
+    totals: pl.DataFrame,
+    metric: str = "Distance",
+    period: str = "week",
+    activity_type: str | None = "Ride",
+    since=None,
+    ledger: pl.DataFrame | None = None,
+) -> pl.DataFrame:
+    """
+    Pivots the totals into one column per gear holding the running total of metric, with a row for
+    every period (empty ones included) from the one containing since.
+
+    The totals only resolve whole periods, so without the ledger they were built from, since is rounded
+    down to the start of its period. With it, the activities of that first period dated before since
+    are taken out, and only activities on or after since are counted.
+    """
+    filters = [pl.col("Period") == period]
+    if activity_type is not None:
+        filters.append(pl.col("Activity Type") == activity_type)
+    if since is not None:
+        first_period = pl.lit(since).dt.truncate(PERIODS[period])
+        filters.append(pl.col("Period start") >= first_period)
+        if ledger is not None:
+            before_since = ledger.filter(
+                pl.col("Activity Date") >= first_period,
+                pl.col("Activity Date") < pl.lit(since),
+            )
+            totals = (
+                pl.concat([totals, _period_totals(before_since, -1)])
+                .group_by(TOTALS_KEY)
+                .agg(pl.col(METRICS).sum())
+                .filter(pl.col("Count") != 0)
+            )
+
+    return (
+        totals.filter(filters)
+        .group_by("Period start", "Activity Gear")
+        .agg(pl.col(metric).sum())
+        .pivot(on="Activity Gear", index="Period start", values=metric)
+        .rename({"Period start": period.capitalize()})
+        .sort(period.capitalize())
+        .upsample(time_column=period.capitalize(), every=PERIODS[period])
+        .fill_null(0)
+        .with_columns(cs.numeric().cum_sum())
+    )
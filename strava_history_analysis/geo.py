@@ -0,0 +1,28 @@
+"""
+Docstring for geo
+
+This module holds the bits of geometry on latitude/longitude tracks that several modules share, and imports
+nothing heavier than numpy, so that using them doesn't pull in the modules they came from.
+
+- Distances are great circle distances on a sphere of radius EARTH_RADIUS, from the haversine formula.
+"""
+
+import numpy as np
+from numpy.typing import NDArray
+
+EARTH_RADIUS = 6371000.0  # meters
+
+
+def along_track_distance(latitude, longitude) -> NDArray[np.float64]:
+    """
+    Takes the latitudes and longitudes (in degrees) of the points of a track, and returns the distance
+    along it (in meters) from the first point to each of them.
+    """
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    haversine = (
+        np.sin(np.diff(lat) / 2) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    )
+    steps = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(haversine))
+    return np.concatenate([[0.0], np.cumsum(steps)])
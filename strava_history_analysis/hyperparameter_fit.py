@@ -6,66 +6,213 @@ choice of (tau, alpha), and pick the one that minimizes the loss function we spe
 in the module.
 """
 
+import functools
+import hashlib
 import multiprocessing as mp
+import os
+import pickle
+import time
 from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import polars as pl
 import numpy as np
 
-from strava_history_analysis import get_spine
-from strava_history_analysis.time_series_functions import (
-    compute_peak_normalized_power,
-    compute_peak_average_power,
-    compute_normalized_power,
+from strava_history_analysis.pacing_calculator import (
+    BatchedLinearModel,
+    BatchedPacingModel,
+    PacingModel,
+    hyperparameter_weights,
 )
-from strava_history_analysis.pacing_calculator import PacingModel
 
 # Range of hyperparameters we search over
 TAU_RANGE = np.linspace(0.4, 0.6, 40)
 ALPHA_RANGE = np.linspace(0.04, 0.07, 40)
 STICKINESS_RANGE = np.linspace(0.5, 200, 100)
 
+# (tau, alpha, stickiness) points per axis of the two passes of coarse_to_fine_grid_search
+COARSE_GRID_SHAPE = (10, 10, 20)
+FINE_GRID_SHAPE = (10, 10, 20)
+
 # Some initialization values for the params we fit
 anaerobic_power = 373
 watts_scaling_factor = 224
 cov = np.diag([100**2, 30**2])
+# Variance added to (A, B) after every update of the search's models
+update_noise_floor = (100.0, 25.0)
+
+# The (duration in minutes, column) pairs we feed to the model for each activity
+CENSORED_OBSERVATION_COLUMNS = [
+    (5, "Peak 5m average power"),
+    (10, "Peak 10m average power"),
+    (20, "Peak 20m average power"),
+    (60, "Peak 60m average power"),
+    (120, "Peak 120m average power"),
+]
+UNCENSORED_OBSERVATION_COLUMNS = [
+    (60, "Peak 1h normalized power"),
+    (120, "Peak 2h normalized power"),
+]
+
+# Number of hyperparameter points each worker advances together through the history
+BATCH_SIZE = 256
+
+
+_WORKER_OBSERVATIONS: dict | None = None
+_WORKER_SHARED_MEMORY: list = []
+
+
+def _attach_shared_observations(spec: dict) -> dict:
+    """
+    Rebuilds the observations dict in a worker as numpy views over the parent's shared memory blocks.
+    """
+    observations = {}
+    for key, (name, shape, dtype) in spec.items():
+        # Spawned workers share the parent's resource tracker, so attaching here doesn't
+        # register a second owner, and the parent unlinks the blocks when it is done
+        block = shared_memory.SharedMemory(name=name)
+        _WORKER_SHARED_MEMORY.append(block)
+        observations[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return observations
+
 
+def _init_worker(spec: dict):
+    global _WORKER_OBSERVATIONS
+    _WORKER_OBSERVATIONS = _attach_shared_observations(spec)
 
-_WORKER_DFNPF: pl.DataFrame | None = None
 
+def _ping(_):
+    return os.getpid()
 
-def _init_worker(dfnpf: pl.DataFrame):
-    global _WORKER_DFNPF
-    _WORKER_DFNPF = dfnpf
+
+def _call_with_observations(args):
+    function, function_args = args
+    return function(_WORKER_OBSERVATIONS, *function_args)
 
 
 def _evaluate(args):
-    i, j, k, tau, alpha, stickiness = args
-    loss = get_hyperparameter_loss(_WORKER_DFNPF, tau, alpha, stickiness)
-    return i, j, k, loss
+    taus, alphas, stickinesses, n_activities = args
+    return get_batched_hyperparameter_loss(
+        _WORKER_OBSERVATIONS, taus, alphas, stickinesses, n_activities=n_activities
+    )
+
+
+class HyperparameterPool:
+    """
+    A persistent pool of spawned workers that evaluate batches of hyperparameter points.
+
+    The observation arrays are copied into shared memory once, and each worker maps them at startup,
+    so only the block names go through pickle. Use it as a context manager, and reuse it across
+    search passes instead of starting a new pool for each.
+
+    After entering, startup_seconds is the wall-clock time until every worker has imported the package
+    and attached the arrays, and payload_bytes is the size of the pickled initializer arguments.
+    """
+
+    def __init__(self, observations: dict, max_workers: int | None = None):
+        self.observations = observations
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.startup_seconds = None
+        self.payload_bytes = None
+        self._blocks = []
+        self._pool = None
+
+    def __enter__(self):
+        start = time.perf_counter()
+        spec = {}
+        for key, array in self.observations.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self._blocks.append(block)
+            spec[key] = (block.name, array.shape, array.dtype.str)
+        self.payload_bytes = len(pickle.dumps(spec))
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(spec,),
+            mp_context=mp.get_context("spawn"),
+        )
+        # Workers start lazily, so push a trivial task to each to pay the startup cost here
+        list(self._pool.map(_ping, range(self.max_workers)))
+        self.startup_seconds = time.perf_counter() - start
+        return self
+
+    def __exit__(self, *exc):
+        self._pool.shutdown()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def evaluate(
+        self,
+        taus: np.ndarray,
+        alphas: np.ndarray,
+        stickinesses: np.ndarray,
+        n_activities: int | None = None,
+    ) -> np.ndarray:
+        """
+        Same as get_batched_hyperparameter_loss, split into BATCH_SIZE chunks across the workers.
+        """
+        tasks = [
+            (
+                taus[b : b + BATCH_SIZE],
+                alphas[b : b + BATCH_SIZE],
+                stickinesses[b : b + BATCH_SIZE],
+                n_activities,
+            )
+            for b in range(0, len(taus), BATCH_SIZE)
+        ]
+        if not tasks:
+            return np.empty(0)
+        return np.concatenate(list(self._pool.map(_evaluate, tasks)))
+
+    def submit(self, function, *args):
+        """
+        Runs function(observations, *args) on a worker and returns the future. The function has to be
+        importable by name (defined at module level), since it is pickled by reference.
+        """
+        return self._pool.submit(_call_with_observations, (function, args))
 
 
 def _parallel_grid_search(
-    dfnpf: pl.DataFrame,
+    pool: HyperparameterPool,
     tau_axis: np.ndarray,
     alpha_axis: np.ndarray,
     stickiness_axis: np.ndarray,
 ) -> np.ndarray:
-    tasks = [
-        (i, j, k, float(tau), float(alpha), float(stickiness))
-        for i, tau in enumerate(tau_axis)
-        for j, alpha in enumerate(alpha_axis)
-        for k, stickiness in enumerate(stickiness_axis)
-    ]
-    grid = np.full((len(tau_axis), len(alpha_axis), len(stickiness_axis)), np.nan)
-    with ProcessPoolExecutor(
-        initializer=_init_worker,
-        initargs=(dfnpf,),
-        mp_context=mp.get_context("spawn"),
-    ) as pool:
-        for i, j, k, loss in pool.map(_evaluate, tasks, chunksize=8):
-            grid[i, j, k] = loss
-    return grid
+    taus, alphas, stickinesses = (
+        a.ravel()
+        for a in np.meshgrid(tau_axis, alpha_axis, stickiness_axis, indexing="ij")
+    )
+    return pool.evaluate(taus, alphas, stickinesses).reshape(
+        len(tau_axis), len(alpha_axis), len(stickiness_axis)
+    )
+
+
+def measure_pool_overhead(dfnpf: pl.DataFrame, max_workers: int | None = None) -> dict:
+    """
+    Reports the startup and serialization overhead of the shared memory pool, next to the size of
+    the pickled DataFrame that every worker used to receive.
+    """
+    observations = extract_observation_tensor(dfnpf)
+    with HyperparameterPool(observations, max_workers=max_workers) as pool:
+        start = time.perf_counter()
+        pool.evaluate(
+            np.array([TAU_RANGE.mean()]),
+            np.array([ALPHA_RANGE.mean()]),
+            np.array([STICKINESS_RANGE.mean()]),
+        )
+        single_evaluation_seconds = time.perf_counter() - start
+        return {
+            "workers": pool.max_workers,
+            "startup_seconds": pool.startup_seconds,
+            "payload_bytes": pool.payload_bytes,
+            "dataframe_payload_bytes": len(pickle.dumps(dfnpf)),
+            "single_evaluation_seconds": single_evaluation_seconds,
+        }
 
 
 def find_optimal_hyperparams(
@@ -82,16 +229,35 @@ def find_optimal_hyperparams(
     """
     print("Constructing the dataset")
     dfnpf = construct_dataframe(root_path=root_path, poll_strava=poll_strava)
+    observations = extract_observation_tensor(dfnpf)
+    return coarse_to_fine_grid_search(observations)
+
+
+def coarse_to_fine_grid_search(
+    observations: dict, pool: HyperparameterPool | None = None
+):
+    """
+    The grid search behind find_optimal_hyperparams, on an already extracted observation tensor.
+    Both passes run on the same worker pool, which is started here unless one is passed in.
+    Points are scored with get_batched_hyperparameter_loss, i.e. the Newton loss.
+    """
+    if pool is None:
+        with HyperparameterPool(observations) as pool:
+            print(
+                f"Started {pool.max_workers} workers in {pool.startup_seconds:.2f}s, "
+                f"initializer payload {pool.payload_bytes} bytes"
+            )
+            return coarse_to_fine_grid_search(observations, pool=pool)
 
     tau_lo, tau_hi = float(TAU_RANGE.min()), float(TAU_RANGE.max())
     alpha_lo, alpha_hi = float(ALPHA_RANGE.min()), float(ALPHA_RANGE.max())
     stick_lo, stick_hi = float(STICKINESS_RANGE.min()), float(STICKINESS_RANGE.max())
 
-    coarse_tau = np.linspace(tau_lo, tau_hi, 10)
-    coarse_alpha = np.linspace(alpha_lo, alpha_hi, 10)
-    coarse_stick = np.linspace(stick_lo, stick_hi, 20)
+    coarse_tau = np.linspace(tau_lo, tau_hi, COARSE_GRID_SHAPE[0])
+    coarse_alpha = np.linspace(alpha_lo, alpha_hi, COARSE_GRID_SHAPE[1])
+    coarse_stick = np.linspace(stick_lo, stick_hi, COARSE_GRID_SHAPE[2])
     print("Performing coarse grid search")
-    coarse_grid = _parallel_grid_search(dfnpf, coarse_tau, coarse_alpha, coarse_stick)
+    coarse_grid = _parallel_grid_search(pool, coarse_tau, coarse_alpha, coarse_stick)
 
     ci, cj, ck = np.unravel_index(np.nanargmin(coarse_grid), coarse_grid.shape)
 
@@ -101,17 +267,17 @@ def find_optimal_hyperparams(
     fine_tau = np.linspace(
         max(coarse_tau[ci] - 2 * tau_step, tau_lo),
         min(coarse_tau[ci] + 2 * tau_step, tau_hi),
-        10,
+        FINE_GRID_SHAPE[0],
     )
     fine_alpha = np.linspace(
         max(coarse_alpha[cj] - 2 * alpha_step, alpha_lo),
         min(coarse_alpha[cj] + 2 * alpha_step, alpha_hi),
-        10,
+        FINE_GRID_SHAPE[1],
     )
     fine_stick = np.linspace(
         max(coarse_stick[ck] - 2 * stick_step, stick_lo),
         min(coarse_stick[ck] + 2 * stick_step, stick_hi),
-        20,
+        FINE_GRID_SHAPE[2],
     )
     print(
         f"Performing fine grid search for "
@@ -119,7 +285,7 @@ def find_optimal_hyperparams(
         f"tau in [{fine_tau[0]}, {fine_tau[-1]}], "
         f"stickiness in [{fine_stick[0]}, {fine_stick[-1]}]"
     )
-    fine_grid = _parallel_grid_search(dfnpf, fine_tau, fine_alpha, fine_stick)
+    fine_grid = _parallel_grid_search(pool, fine_tau, fine_alpha, fine_stick)
 
     fi, fj, fk = np.unravel_index(np.nanargmin(fine_grid), fine_grid.shape)
     best_tau = float(fine_tau[fi])
@@ -139,12 +305,289 @@ def find_optimal_hyperparams(
     )
 
 
+def successive_halving_search(
+    observations: dict,
+    n_candidates: int = 729,
+    eta: int = 3,
+    min_activities: int = 40,
+    refine_rounds: int = 4,
+    seed: int = 0,
+    memo_path: str | None = None,
+    pool: HyperparameterPool | None = None,
+):
+    """
+    Successive halving over (tau, alpha, stickiness): n_candidates quasi-random points spanning
+    TAU_RANGE/ALPHA_RANGE/STICKINESS_RANGE are scored on a prefix of the activity history of at
+    least min_activities, the best 1/eta of them are kept, and the prefix grows by a factor of eta,
+    until the survivors are scored on the whole history. The best survivor is then refined with
+    refine_rounds of 5x5x5 local grids on the whole history, each half the width of the last.
+
+    Every evaluated point is memoized in memo_path (a parquet file), keyed by a fingerprint of the
+    history prefix it was scored on and of the prior and noise floor the models start from, so a rerun
+    only evaluates what it hasn't seen, and prefixes remain valid when new activities are appended.
+
+    Batches are evaluated on `pool` if one is passed, and in this process otherwise.
+
+    Returns (best_tau, best_alpha, best_stickiness, best_loss, evaluations), where evaluations is a
+    DataFrame of every (stage, activities, tau, alpha, stickiness, loss) scored in this run.
+    """
+    # scipy.stats takes most of a second to import, and the workers never need it
+    from scipy.stats import qmc
+
+    if pool is not None:
+        evaluate = pool.evaluate
+    else:
+        evaluate = functools.partial(get_batched_hyperparameter_loss, observations)
+    n_activities = observations["powers"].shape[0]
+    memo = _load_memo(memo_path)
+    lower = np.array([TAU_RANGE.min(), ALPHA_RANGE.min(), STICKINESS_RANGE.min()])
+    upper = np.array([TAU_RANGE.max(), ALPHA_RANGE.max(), STICKINESS_RANGE.max()])
+
+    def score(points, prefix, stage):
+        fingerprint = _observation_fingerprint(observations, prefix)
+        keys = [(fingerprint, *map(float, p)) for p in points]
+        unseen = np.array([k not in memo for k in keys])
+        if unseen.any():
+            losses = evaluate(
+                points[unseen, 0],
+                points[unseen, 1],
+                points[unseen, 2],
+                n_activities=prefix,
+            )
+            for key, loss in zip(
+                (k for k, u in zip(keys, unseen) if u), losses, strict=True
+            ):
+                memo[key] = float(loss)
+        losses = np.array([memo[k] for k in keys])
+        losses = np.where(np.isnan(losses), np.inf, losses)
+
+        evaluations.append(
+            pl.DataFrame(
+                {
+                    "stage": stage,
+                    "activities": prefix,
+                    "tau": points[:, 0],
+                    "alpha": points[:, 1],
+                    "stickiness": points[:, 2],
+                    "loss": losses,
+                }
+            )
+        )
+        print(
+            f"{stage}: scored {len(points)} points ({unseen.sum()} new) "
+            f"on {prefix} activities, best loss {losses.min()}"
+        )
+        return losses
+
+    evaluations = []
+    points = qmc.scale(
+        qmc.LatinHypercube(d=3, seed=seed).random(n_candidates), lower, upper
+    )
+    n_rungs = max(int(np.log(n_activities / min_activities) / np.log(eta)), 0)
+    for rung in range(n_rungs + 1):
+        prefix = int(round(n_activities * float(eta) ** (rung - n_rungs)))
+        losses = score(points, prefix, f"rung {rung}")
+        if rung < n_rungs:
+            keep = max(len(points) // eta, 1)
+            points = points[np.argsort(losses)[:keep]]
+
+    best = np.argmin(losses)
+    best_point, best_loss = points[best], losses[best]
+
+    half_width = (upper - lower) / len(points) ** (1 / 3) / 2
+    for refinement in range(refine_rounds):
+        axes = [
+            np.unique(np.clip(np.linspace(c - w, c + w, 5), lo, hi))
+            for c, w, lo, hi in zip(best_point, half_width, lower, upper)
+        ]
+        points = np.stack(
+            [a.ravel() for a in np.meshgrid(*axes, indexing="ij")], axis=-1
+        )
+        losses = score(points, n_activities, f"refinement {refinement}")
+        if losses.min() < best_loss:
+            best_point, best_loss = points[np.argmin(losses)], losses.min()
+        half_width = half_width / 2
+
+    _save_memo(memo, memo_path)
+
+    return (
+        float(best_point[0]),
+        float(best_point[1]),
+        float(best_point[2]),
+        float(best_loss),
+        pl.concat(evaluations),
+    )
+
+
+def hyperparameter_distribution(
+    evaluations: pl.DataFrame,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Turns the evaluations returned by successive_halving_search into (tau, alpha) points,
+    probabilities and stickiness for PacingModel.predictive_quantiles and hyperparameter_posteriors.
+
+    Only the evaluations on the full history are used, stickiness is profiled out by keeping the
+    best loss (and the stickiness it was reached with) at each (tau, alpha), and the losses are
+    weighted with hyperparameter_weights.
+    """
+    n_activities = evaluations["activities"].max()
+    surface = (
+        evaluations.filter(pl.col("activities") == n_activities)
+        .group_by("tau", "alpha")
+        .agg(
+            pl.col("loss").min(),
+            pl.col("stickiness").sort_by("loss").first(),
+        )
+        .sort("tau", "alpha")
+    )
+    points = surface.select("tau", "alpha").to_numpy()
+    return (
+        points,
+        hyperparameter_weights(surface["loss"].to_numpy(), n_activities),
+        surface["stickiness"].to_numpy(),
+    )
+
+
+def hyperparameter_posteriors(
+    observations: dict, points: np.ndarray, stickiness: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Conditions the (A, B) posterior on each (tau, alpha) point: runs one model per point, with its
+    stickiness, from the prior through the whole history, and returns the (H, 2) means and
+    (H, 2, 2) covariances, for PacingModel.predictive_quantiles.
+    """
+    model = BatchedPacingModel.from_prior(
+        anaerobic_work=anaerobic_power,
+        watts_scaling_factor=watts_scaling_factor,
+        covariance_matrix=cov,
+        tau=points[:, 0],
+        alpha=points[:, 1],
+        stickiness=stickiness,
+    )
+    for i in range(observations["powers"].shape[0]):
+        model.update_based_on_observations(
+            observations["durations"],
+            observations["powers"][i],
+            observations["censored"],
+            noise_floor_A=update_noise_floor[0],
+            noise_floor_B=update_noise_floor[1],
+        )
+    return model.means, model.covariances
+
+
+def _observation_fingerprint(observations: dict, n_activities: int) -> str:
+    digest = hashlib.sha1()
+    # The losses also depend on the prior and noise floor the models start from
+    digest.update(
+        np.array(
+            [
+                anaerobic_power,
+                watts_scaling_factor,
+                *np.ravel(cov),
+                *update_noise_floor,
+            ],
+            dtype=np.float64,
+        ).tobytes()
+    )
+    for key in ["durations", "censored"]:
+        digest.update(np.ascontiguousarray(observations[key]).tobytes())
+    for key in ["powers", "ride_durations", "normalized_power"]:
+        digest.update(np.ascontiguousarray(observations[key][:n_activities]).tobytes())
+    return digest.hexdigest()
+
+
+def _load_memo(memo_path: str | None) -> dict:
+    if memo_path is None or not os.path.exists(memo_path):
+        return {}
+    return {
+        (fingerprint, tau, alpha, stickiness): loss
+        for fingerprint, tau, alpha, stickiness, loss in pl.read_parquet(
+            memo_path
+        ).iter_rows()
+    }
+
+
+def _save_memo(memo: dict, memo_path: str | None):
+    if memo_path is None:
+        return
+    os.makedirs(os.path.dirname(memo_path) or ".", exist_ok=True)
+    pl.DataFrame(
+        [(*key, loss) for key, loss in memo.items()],
+        schema={
+            "fingerprint": pl.String,
+            "tau": pl.Float64,
+            "alpha": pl.Float64,
+            "stickiness": pl.Float64,
+            "loss": pl.Float64,
+        },
+        orient="row",
+    ).write_parquet(memo_path)
+
+
+def find_optimal_hyperparams_adaptive(
+    root_path="./",
+    poll_strava=False,
+    n_candidates: int = 729,
+    eta: int = 3,
+):
+    """
+    Loads the full dataset once and runs successive_halving_search over it, memoizing every
+    evaluated point in database/hyperparameter_memo.parquet.
+    """
+    print("Constructing the dataset")
+    dfnpf = construct_dataframe(root_path=root_path, poll_strava=poll_strava)
+    observations = extract_observation_tensor(dfnpf)
+    return successive_halving_search(
+        observations,
+        n_candidates=n_candidates,
+        eta=eta,
+        memo_path=os.path.join(root_path, "database", "hyperparameter_memo.parquet"),
+    )
+
+
+def compare_search_strategies(observations: dict) -> pl.DataFrame:
+    """
+    Runs the coarse-to-fine grid search and successive halving (without a memo) on the same
+    observations, and reports the wall-clock time and best point found by each.
+    """
+    rows = []
+
+    start = time.perf_counter()
+    tau, alpha, stickiness, loss, *_ = coarse_to_fine_grid_search(observations)
+    rows.append(("grid", time.perf_counter() - start, tau, alpha, stickiness, loss))
+
+    start = time.perf_counter()
+    tau, alpha, stickiness, loss, _ = successive_halving_search(observations)
+    rows.append(
+        (
+            "successive halving",
+            time.perf_counter() - start,
+            tau,
+            alpha,
+            stickiness,
+            loss,
+        )
+    )
+
+    return pl.DataFrame(
+        rows,
+        schema=["strategy", "seconds", "tau", "alpha", "stickiness", "loss"],
+        orient="row",
+    )
+
+
 def get_hyperparameter_loss(
     dfnpf: pl.DataFrame,
     tau: np.float64,
     alpha: np.float64,
     stickiness: np.float64,
+    method: str = "bfgs",
 ):
+    """
+    Walks a PacingModel with the given hyperparameters through the history, and returns the mean
+    squared error of its normalized power predictions. method is the update method, see
+    PacingModel.update_based_on_observations.
+    """
     baseline_model = PacingModel(
         anaerobic_work=anaerobic_power,
         watts_scaling_factor=watts_scaling_factor,
@@ -165,17 +608,14 @@ def get_hyperparameter_loss(
         # predicted_two_hour_normalized_power = baseline_model.predict_peak_power(120)
         # two_hour_predictions.append(predicted_two_hour_normalized_power)
 
-        censored_observations = []
-        uncensored_observations = []
-
-        censored_observations.append((5, activity["Peak 5m average power"]))
-        censored_observations.append((10, activity["Peak 10m average power"]))
-        censored_observations.append((20, activity["Peak 20m average power"]))
-        censored_observations.append((60, activity["Peak 60m average power"]))
-        censored_observations.append((120, activity["Peak 120m average power"]))
-
-        uncensored_observations.append((60, activity["Peak 1h normalized power"]))
-        uncensored_observations.append((120, activity["Peak 2h normalized power"]))
+        censored_observations = [
+            (duration, activity[column])
+            for duration, column in CENSORED_OBSERVATION_COLUMNS
+        ]
+        uncensored_observations = [
+            (duration, activity[column])
+            for duration, column in UNCENSORED_OBSERVATION_COLUMNS
+        ]
 
         censored_observations = list(
             filter(lambda f: f[1] is not None, censored_observations)
@@ -185,7 +625,7 @@ def get_hyperparameter_loss(
         )
 
         baseline_model.update_based_on_observations(
-            censored_observations, uncensored_observations
+            censored_observations, uncensored_observations, method=method
         )
 
     warmup = 10
@@ -198,11 +638,113 @@ def get_hyperparameter_loss(
     return mse
 
 
+def extract_observation_tensor(dfnpf: pl.DataFrame) -> dict:
+    """
+    Pulls everything the pacing model needs out of the dataset once, as dense arrays:
+    observation durations (K,) and censored flags (K,) shared by every activity,
+    observed powers (N, K) with NaN for missing values, ride durations in minutes (N,)
+    and the normalized power we score the predictions against (N,).
+    """
+    observation_columns = CENSORED_OBSERVATION_COLUMNS + UNCENSORED_OBSERVATION_COLUMNS
+    return {
+        "durations": np.array(
+            [duration for duration, _ in observation_columns], dtype=np.float64
+        ),
+        "censored": np.array(
+            [True] * len(CENSORED_OBSERVATION_COLUMNS)
+            + [False] * len(UNCENSORED_OBSERVATION_COLUMNS)
+        ),
+        "powers": dfnpf.select(
+            pl.col(column).cast(pl.Float64).fill_null(np.nan)
+            for _, column in observation_columns
+        ).to_numpy(),
+        "ride_durations": (dfnpf["Moving Time"] / 60).to_numpy().astype(np.float64),
+        "normalized_power": dfnpf["Normalized power"]
+        .cast(pl.Float64)
+        .fill_null(np.nan)
+        .to_numpy(),
+    }
+
+
+def get_batched_hyperparameter_loss(
+    observations: dict,
+    taus: np.ndarray,
+    alphas: np.ndarray,
+    stickinesses: np.ndarray,
+    n_activities: int | None = None,
+) -> np.ndarray:
+    """
+    Batched version of get_hyperparameter_loss: runs one model per (tau, alpha, stickiness) triple
+    through the history together, and returns the loss of each. Uses the Newton update, so it
+    agrees with get_hyperparameter_loss(method="newton") to within optimizer tolerance.
+
+    It does not agree with the default get_hyperparameter_loss(method="bfgs"): BFGS's posterior
+    covariance is only an estimate, which drifts from the exact one at low stickiness (at stickiness 1,
+    a loss of 188.81 with BFGS against 192.31 here on a recorded history). The searches that score
+    points with this, coarse_to_fine_grid_search included, therefore minimize the Newton (exact
+    Laplace) loss, not the BFGS one.
+
+    If n_activities is given, only that prefix of the history is used.
+    """
+    model = BatchedPacingModel.from_prior(
+        anaerobic_work=anaerobic_power,
+        watts_scaling_factor=watts_scaling_factor,
+        covariance_matrix=cov,
+        tau=taus,
+        alpha=alphas,
+        stickiness=stickinesses,
+    )
+
+    return prequential_loss(model, observations, n_activities=n_activities)
+
+
+def prequential_loss(
+    model: BatchedLinearModel,
+    observations: dict,
+    n_activities: int | None = None,
+    noise_floor: tuple[float, float] | None = None,
+) -> np.ndarray:
+    """
+    Walks the batched model through the history, predicting each ride's normalized power from its
+    duration before updating on its observations, and returns the mean squared error of every model
+    (skipping the first few rides while the prior dominates). The noise floor defaults to
+    update_noise_floor.
+    """
+    if noise_floor is None:
+        noise_floor = update_noise_floor
+    if n_activities is None:
+        n_activities = observations["powers"].shape[0]
+    predictions = np.empty((model.means.shape[0], n_activities))
+    for i in range(n_activities):
+        predictions[:, i] = model.predict_peak_power(observations["ride_durations"][i])
+        model.update_based_on_observations(
+            observations["durations"],
+            observations["powers"][i],
+            observations["censored"],
+            noise_floor_A=noise_floor[0],
+            noise_floor_B=noise_floor[1],
+        )
+
+    warmup = 10
+    errors = (
+        observations["normalized_power"][None, warmup:n_activities]
+        - predictions[:, warmup:]
+    )
+    return np.nanmean(errors**2, axis=1)
+
+
 def construct_dataframe(
     root_path="./",
     poll_strava=False,
 ):
-    df = get_spine(root_path=root_path, poll_strava=poll_strava).select(
+    # Imported here, so the search workers (which only need the observation arrays)
+    # don't pay for stravalib and fitparse
+    from strava_history_analysis.database import get_spine
+    from strava_history_analysis.duplicates import drop_duplicates, get_duplicates
+
+    df = get_spine(root_path=root_path, poll_strava=poll_strava)
+    # A ride recorded twice would be two observations of the same effort
+    df = drop_duplicates(df, get_duplicates(df, root_path=root_path)).select(
         [
             pl.col("Activity ID"),
             pl.col("Activity Date"),
@@ -214,6 +756,19 @@ def construct_dataframe(
             pl.col("Filename"),
         ]
     )
+    return compute_observation_columns(df, root_path=root_path)
+
+
+def compute_observation_columns(df: pl.DataFrame, root_path="./") -> pl.DataFrame:
+    """
+    Adds the peak power and normalized power columns the pacing model consumes to the
+    spine rows in `df`, and drops the activities without power.
+    """
+    from strava_history_analysis.time_series_functions import (
+        compute_peak_normalized_power,
+        compute_peak_average_power,
+        compute_normalized_power,
+    )
 
     dfnp = df.with_columns(
         [
@@ -1,5 +1,321 @@
-def main():
-    print("Hello from strava-history-analysis!")
+"""
+Docstring for main
+
+The strava-history-analysis command line, for running the pipeline headless (e.g. from cron on a server):
+
+- sync: pulls new activities from Strava into the spine
+- warm-cache: parses every activity's time series (and builds its pyramid and route) into the parquet cache
+- compute-metrics: extends the activity index, durability table and gear totals, and the training load if an FTP is given
+- fit-hyperparams: fits the PacingModel hyperparameters
+- bench: measures import times and appends them to the benchmark history
+
+Every command prints a single JSON summary with per-step timings to stdout, and everything the pipeline
+itself prints goes to stderr. --dry-run reports what a command would do without writing anything or
+polling Strava. Package modules are imported inside the commands, so `--help` doesn't pay for them.
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Rough peak memory of one worker, used to fit the worker count into --memory-budget
+WARM_CACHE_WORKER_MB = 500  # fitparse holds the whole file as python objects
+SEARCH_WORKER_MB = 200
+
+
+class StepTimer:
+    def __init__(self):
+        self.steps = {}
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = time.perf_counter() - start
+
+
+def workers_within_budget(
+    workers: int | None, memory_budget_mb: float | None, per_worker_mb: float
+) -> int:
+    workers = workers or os.cpu_count() or 1
+    if memory_budget_mb is not None:
+        workers = min(workers, int(memory_budget_mb // per_worker_mb))
+    return max(workers, 1)
+
+
+def _uncached_files(df, root_path: str):
+    from .downsampling import pyramid_cache_path
+    from .spatial_index import route_cache_path
+    from .time_series_parser import get_cache_path
+
+    return [
+        f
+        for f in df["Filename"].to_list()
+        if not os.path.exists(get_cache_path(f, root_path))
+        or not os.path.exists(pyramid_cache_path(f, root_path))
+        or not os.path.exists(route_cache_path(f, root_path))
+    ]
+
+
+def _map_per_file(pool, function, files, root_path: str, failures: dict) -> dict:
+    # One bad file (a truncated FIT, say) shouldn't stop a headless run, so errors are
+    # collected per file into failures instead of raised
+    futures = {f: pool.submit(function, f, root_path) for f in files}
+    results = {}
+    for f, future in futures.items():
+        try:
+            results[f] = future.result()
+        except Exception as e:
+            failures[f] = f"{type(e).__name__}: {e}"
+    return results
+
+
+def sync(args, timer: StepTimer) -> dict:
+    from .database import get_spine
+
+    cached_df_path = os.path.join(args.root, "database", "spine.parquet")
+    if args.dry_run:
+        import polars as pl
+
+        with timer.step("read spine"):
+            if not os.path.exists(cached_df_path):
+                return {"activities": 0, "would_initialize": True}
+            df = pl.read_parquet(cached_df_path)
+        # The highest ID is where update_spine_with_api_pull picks up from; the spine is sorted by date
+        return {"activities": df.shape[0], "last_activity_id": df["Activity ID"].max()}
+
+    with timer.step("read spine"):
+        before = 0
+        if os.path.exists(cached_df_path):
+            before = get_spine(root_path=args.root, poll_strava=False).shape[0]
+    with timer.step("poll strava"):
+        df = get_spine(root_path=args.root, poll_strava=True)
+    return {
+        "activities": df.shape[0],
+        "new_activities": df.shape[0] - before,
+        "last_activity_id": df["Activity ID"].max(),
+    }
+
+
+def warm_cache(args, timer: StepTimer) -> dict:
+    from .database import get_spine
+    from .downsampling import warm_pyramid
+    from .spatial_index import warm_route
+
+    with timer.step("read spine"):
+        df = get_spine(root_path=args.root, poll_strava=False)
+    with timer.step("list uncached"):
+        files = _uncached_files(df, args.root)
+
+    workers = workers_within_budget(
+        args.workers, args.memory_budget, WARM_CACHE_WORKER_MB
+    )
+    result = {"activities": df.shape[0], "uncached": len(files), "workers": workers}
+    if args.dry_run or not files:
+        return result
+
+    failures = {}
+    with timer.step("parse"):
+        # Forking a process that has started polars' thread pool can deadlock, so spawn
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=mp.get_context("spawn")
+        ) as pool:
+            built = _map_per_file(pool, warm_pyramid, files, args.root, failures)
+            # The time series are cached by now, so this only reads the parquet files
+            routes = _map_per_file(
+                pool,
+                warm_route,
+                [f for f in files if f not in failures],
+                args.root,
+                failures,
+            )
+    result["pyramids_built"] = sum(built.values())
+    result["routes_with_positions"] = sum(routes.values())
+    result["failed"] = len(failures)
+    result["failures"] = failures
+    return result
+
+
+def compute_metrics(args, timer: StepTimer) -> dict:
+    import polars as pl
+
+    from .activity_index import get_activity_index
+    from .database import get_spine
+    from .durability import get_durability
+    from .gear_totals import get_gear_totals
+    from .training_load import get_training_load
+
+    with timer.step("read spine"):
+        df = get_spine(root_path=args.root, poll_strava=False)
+
+    if args.dry_run:
+        result = {"activities": df.shape[0]}
+        for name, path in [
+            ("activity_index", "activity_index.parquet"),
+            ("training_stress", "activity_training_stress.parquet"),
+            ("durability", "durability.parquet"),
+            ("gear_totals", "gear_totals_ledger.parquet"),
+        ]:
+            cached_path = os.path.join(args.root, "database", path)
+            cached = 0
+            if os.path.exists(cached_path):
+                cached = df.join(
+                    pl.read_parquet(cached_path, columns=["Activity ID"]),
+                    on="Activity ID",
+                    how="semi",
+                ).shape[0]
+            result[f"{name}_pending"] = df.shape[0] - cached
+        return result
+
+    result = {"activities": df.shape[0]}
+    with timer.step("activity index"):
+        result["indexed"] = get_activity_index(root_path=args.root).shape[0]
+    with timer.step("durability"):
+        result["durability"] = get_durability(root_path=args.root).shape[0]
+    with timer.step("gear totals"):
+        result["gear_periods"] = get_gear_totals(root_path=args.root).shape[0]
+    if args.ftp is not None:
+        with timer.step("training load"):
+            _, daily_load = get_training_load(args.ftp, root_path=args.root)
+        result["training_load_days"] = daily_load.shape[0]
+    return result
+
+
+def fit_hyperparams(args, timer: StepTimer) -> dict:
+    from .hyperparameter_fit import (
+        COARSE_GRID_SHAPE,
+        FINE_GRID_SHAPE,
+        HyperparameterPool,
+        coarse_to_fine_grid_search,
+        construct_dataframe,
+        extract_observation_tensor,
+        successive_halving_search,
+    )
+
+    workers = workers_within_budget(args.workers, args.memory_budget, SEARCH_WORKER_MB)
+    result = {"strategy": args.strategy, "workers": workers}
+    if args.dry_run:
+        # Building the dataset would parse (and cache) time series, so only report the plan
+        if args.strategy == "grid":
+            result["grid_points"] = math.prod(COARSE_GRID_SHAPE) + math.prod(
+                FINE_GRID_SHAPE
+            )
+        return result
+
+    with timer.step("construct dataset"):
+        observations = extract_observation_tensor(
+            construct_dataframe(root_path=args.root)
+        )
+    result["activities"] = int(observations["powers"].shape[0])
+
+    with HyperparameterPool(observations, max_workers=workers) as pool:
+        timer.steps["start workers"] = pool.startup_seconds
+        with timer.step("search"):
+            if args.strategy == "grid":
+                tau, alpha, stickiness, loss, *_ = coarse_to_fine_grid_search(
+                    observations, pool=pool
+                )
+            else:
+                tau, alpha, stickiness, loss, _ = successive_halving_search(
+                    observations,
+                    memo_path=os.path.join(
+                        args.root, "database", "hyperparameter_memo.parquet"
+                    ),
+                    pool=pool,
+                )
+
+    result.update(
+        {
+            "tau": float(tau),
+            "alpha": float(alpha),
+            "stickiness": float(stickiness),
+            "loss": float(loss),
+        }
+    )
+    return result
+
+
+def bench(args, timer: StepTimer) -> dict:
+    from .benchmarks import run_import_benchmarks
+
+    with timer.step("imports"):
+        return run_import_benchmarks(
+            root_path=args.root, repeats=args.repeats, record=not args.dry_run
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="strava-history-analysis")
+    parser.add_argument("--root", default="./", help="Project root (default: ./)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes (default: all cores)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=None,
+        help="Memory budget in MB, caps the number of workers",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report what would be done without writing anything",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("sync", help="Pull new activities from Strava").set_defaults(
+        handler=sync
+    )
+    subparsers.add_parser(
+        "warm-cache", help="Parse and downsample every uncached time series"
+    ).set_defaults(handler=warm_cache)
+
+    metrics = subparsers.add_parser(
+        "compute-metrics", help="Extend the activity index and training load"
+    )
+    metrics.add_argument("--ftp", type=float, default=None)
+    metrics.set_defaults(handler=compute_metrics)
+
+    fit = subparsers.add_parser(
+        "fit-hyperparams", help="Fit the PacingModel hyperparameters"
+    )
+    fit.add_argument("--strategy", choices=["adaptive", "grid"], default="adaptive")
+    fit.set_defaults(handler=fit_hyperparams)
+
+    benchmark = subparsers.add_parser("bench", help="Measure and record import times")
+    benchmark.add_argument("--repeats", type=int, default=5)
+    benchmark.set_defaults(handler=bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    timer = StepTimer()
+
+    start = time.perf_counter()
+    # Keep stdout for the summary, the pipeline's progress prints go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        result = args.handler(args, timer)
+    summary = {
+        "command": args.command,
+        "dry_run": args.dry_run,
+        "seconds": time.perf_counter() - start,
+        "steps": timer.steps,
+        "result": result,
+    }
+    print(json.dumps(summary, default=str))
 
 
 if __name__ == "__main__":
@@ -34,12 +34,68 @@ Alternatively, we can try and minimize a linear combination of the censored and
 zscore.
 """
 
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 import numpy as np
 from numpy.typing import NDArray
 from typing import List, Tuple
-from scipy.optimize import minimize
-from scipy.stats import norm, multivariate_normal
+from scipy.special import log_ndtr
+
+LOG_SQRT_2PI = 0.5 * np.log(2 * np.pi)
+
+
+def observation_arrays(
+    observations: List[Tuple[int, float]],
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Splits a list of (duration, power) pairs into a durations array and a powers array.
+    """
+    observations = np.asarray(observations, dtype=np.float64).reshape(-1, 2)
+    return observations[:, 0], observations[:, 1]
+
+
+def power_duration_curve(
+    means: NDArray[np.float64],
+    covariances: NDArray[np.float64],
+    tau,
+    alpha,
+    durations,
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Evaluates P(t) and its standard deviation (from the (A, B) covariance) for every model and duration at once.
+
+    means is (..., 2), covariances is (..., 2, 2), tau and alpha are scalars or broadcast against the
+    leading dimensions, and durations (in minutes) is (D,). Returns a (mean, std) pair, each of shape (..., D).
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    tau = np.asarray(tau, dtype=np.float64)[..., None]
+    alpha = np.asarray(alpha, dtype=np.float64)[..., None]
+    j_a = 1.0 / (durations + tau)
+    j_b = durations ** (-1 * alpha)
+
+    mean = means[..., 0:1] * j_a + means[..., 1:2] * j_b
+    variance = (
+        covariances[..., 0, 0, None] * j_a**2
+        + 2 * covariances[..., 0, 1, None] * j_a * j_b
+        + covariances[..., 1, 1, None] * j_b**2
+    )
+    return mean, np.sqrt(variance)
+
+
+def hyperparameter_weights(losses, n_observations: int) -> NDArray[np.float64]:
+    """
+    Turns the losses (mean squared errors) of a set of hyperparameter points into normalized weights.
+    Treating the prediction errors as Gaussian with unknown variance, the profile likelihood of a point
+    is proportional to loss^(-n/2), with n the number of scored activities.
+    """
+    losses = np.asarray(losses, dtype=np.float64)
+    finite = np.isfinite(losses)
+    log_weights = np.full(losses.shape, -np.inf)
+    log_weights[finite] = (
+        -0.5 * n_observations * np.log(losses[finite] / losses[finite].min())
+    )
+    weights = np.exp(log_weights)
+    return weights / weights.sum()
 
 
 @dataclass
@@ -68,51 +124,458 @@ class PacingModel:
             duration + self.tau
         ) + overridden_watts_scaling_factor * (duration) ** (-1 * self.alpha)
 
+    def predict_power_curve(
+        self, durations, z: float = 1.96
+    ) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+        """
+        Vectorized predict_peak_power: returns (mean, lower, upper) for an array of durations (in minutes),
+        with the band z standard deviations wide from the covariance matrix.
+        """
+        mean, std = power_duration_curve(
+            np.array([self.anaerobic_work, self.watts_scaling_factor]),
+            self.covariance_matrix,
+            self.tau,
+            self.alpha,
+            durations,
+        )
+        return mean, mean - z * std, mean + z * std
+
+    def predictive_quantiles(
+        self,
+        durations,
+        quantiles=(0.05, 0.5, 0.95),
+        n_samples: int = 10_000,
+        seed: int | None = 0,
+        *,
+        hyperparameters: NDArray[np.float64] | None = None,
+        hyperparameter_probabilities: NDArray[np.float64] | None = None,
+        hyperparameter_posteriors: (
+            tuple[NDArray[np.float64], NDArray[np.float64]] | None
+        ) = None,
+    ) -> NDArray[np.float64]:
+        """
+        Monte Carlo predictive quantiles of P(t): draws n_samples (A, B) pairs from the posterior
+        N(mean, covariance_matrix) and returns an array of shape (len(quantiles), len(durations)).
+
+        To also account for uncertainty in tau and alpha, pass hyperparameters as a (H, 2) array of
+        (tau, alpha) points along with their probabilities, e.g. from hyperparameter_distribution.
+        The (A, B) posterior depends on the shape it was fitted with, so this model's posterior is
+        only valid for its own (tau, alpha); pass the (H, 2) means and (H, 2, 2) covariances of the
+        posterior conditioned on each point too, e.g. from hyperparameter_posteriors. Each draw
+        then picks a point, and draws (A, B) from that point's posterior.
+
+        With hyperparameters, the model's own state (its (A, B) posterior, tau and alpha) is not used
+        at all: the quantiles are those of the mixture passed in. These arguments are keyword-only.
+
+        The draws come from np.random.default_rng(seed), so a fixed seed is reproducible.
+        """
+        rng = np.random.default_rng(seed)
+        durations = np.asarray(durations, dtype=np.float64)
+
+        if hyperparameters is None:
+            mean = np.array([self.anaerobic_work, self.watts_scaling_factor])
+            cholesky = np.linalg.cholesky(self.covariance_matrix)
+            params = mean + rng.standard_normal((n_samples, 2)) @ cholesky.T
+            tau = np.full((n_samples, 1), self.tau)
+            alpha = np.full((n_samples, 1), self.alpha)
+        else:
+            if hyperparameter_posteriors is None:
+                raise ValueError(
+                    "hyperparameter_posteriors are needed with hyperparameters, since the "
+                    "(A, B) posterior depends on (tau, alpha)"
+                )
+            hyperparameters = np.asarray(hyperparameters, dtype=np.float64)
+            means, covariances = hyperparameter_posteriors
+            picks = rng.choice(
+                hyperparameters.shape[0], size=n_samples, p=hyperparameter_probabilities
+            )
+            cholesky = np.linalg.cholesky(covariances)[picks]
+            params = means[picks] + np.einsum(
+                "nij,nj->ni", cholesky, rng.standard_normal((n_samples, 2))
+            )
+            tau = hyperparameters[picks, 0:1]
+            alpha = hyperparameters[picks, 1:2]
+
+        samples = params[:, 0:1] / (durations + tau) + params[:, 1:2] * durations ** (
+            -1 * alpha
+        )
+        return np.quantile(samples, quantiles, axis=0)
+
+    def jacobian(self, durations: NDArray[np.float64]) -> NDArray[np.float64]:
+        """
+        Returns the (n, 2) matrix of partial derivatives of P(t) with respect to (A, B) at each duration.
+        Since the model is linear in (A, B), this doesn't depend on them.
+        """
+        return np.stack(
+            [1.0 / (durations + self.tau), durations ** (-1 * self.alpha)], axis=-1
+        )
+
+    def _observation_terms(
+        self, observations: List[Tuple[int, float]], prior_cov: NDArray[np.float64]
+    ) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+        """
+        Returns the jacobian, the observation noise (the prior's uncertainty in P(t) pushed through
+        the jacobian) and the powers, for a list of (duration, power) pairs.
+        """
+        durations, powers = observation_arrays(observations)
+        j = self.jacobian(durations)
+        sigma = np.sqrt(np.einsum("ni,ij,nj->n", j, prior_cov, j))
+        return j, sigma, powers
+
+    def _neg_log_posterior(
+        self,
+        params: NDArray[np.float64],
+        prior_mean: NDArray[np.float64],
+        prior_precision: NDArray[np.float64],
+        prior_log_norm: float,
+        censored_terms: Tuple[NDArray[np.float64], ...],
+        uncensored_terms: Tuple[NDArray[np.float64], ...],
+    ) -> Tuple[float, NDArray[np.float64]]:
+        """
+        Returns the negative log posterior of params = (A, B) along with its gradient, with all
+        the observations evaluated in one go.
+        """
+        # Uncensored observations contribute log N(power; P(t), sigma)
+        j_u, sigma_u, powers_u = uncensored_terms
+        z_u = (powers_u - j_u @ params) / sigma_u
+        ll = np.sum(-0.5 * z_u**2 - LOG_SQRT_2PI - np.log(sigma_u))
+        # d/dP of the log density is z / sigma
+        grad = j_u.T @ (z_u / sigma_u)
+
+        # Censored observations contribute log P(X >= power), X ~ N(P(t), sigma)
+        j_c, sigma_c, powers_c = censored_terms
+        z_c = (powers_c - j_c @ params) / sigma_c
+        log_sf = log_ndtr(-z_c)
+        ll += np.sum(log_sf)
+        # d/dP of the log survival function is the hazard pdf(z) / sf(z), divided by sigma
+        grad += j_c.T @ (np.exp(-0.5 * z_c**2 - LOG_SQRT_2PI - log_sf) / sigma_c)
+
+        delta = params - prior_mean
+        log_prior = -0.5 * (delta @ prior_precision @ delta) + prior_log_norm
+        grad_log_prior = -prior_precision @ delta
+
+        return (
+            -(ll + self.stickiness * log_prior),
+            -(grad + self.stickiness * grad_log_prior),
+        )
+
+    def _neg_log_posterior_hessian(
+        self,
+        params: NDArray[np.float64],
+        prior_precision: NDArray[np.float64],
+        censored_terms: Tuple[NDArray[np.float64], ...],
+        uncensored_terms: Tuple[NDArray[np.float64], ...],
+    ) -> NDArray[np.float64]:
+        """
+        Returns the exact hessian of the negative log posterior. Since P(t) is linear in (A, B), each
+        observation contributes a curvature weight times j j^T.
+        """
+        j_u, sigma_u, _ = uncensored_terms
+        weights_u = 1.0 / sigma_u**2
+
+        # With the hazard h(z) = pdf(z) / sf(z), the second derivative of -log sf in P is h (h - z) / sigma^2
+        j_c, sigma_c, powers_c = censored_terms
+        z_c = (powers_c - j_c @ params) / sigma_c
+        hazard = np.exp(-0.5 * z_c**2 - LOG_SQRT_2PI - log_ndtr(-z_c))
+        weights_c = hazard * (hazard - z_c) / sigma_c**2
+
+        return (
+            j_u.T @ (weights_u[:, None] * j_u)
+            + j_c.T @ (weights_c[:, None] * j_c)
+            + self.stickiness * prior_precision
+        )
+
+    def _newton_minimize(
+        self,
+        x0: NDArray[np.float64],
+        args: Tuple,
+        max_iterations: int = 20,
+        tolerance: float = 1e-8,
+    ) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """
+        Minimizes the negative log posterior with damped Newton steps, warm started from x0.
+        Returns the minimizer and the inverse of the exact hessian there (the Laplace approximation of the
+        posterior covariance), unlike BFGS's hess_inv, which is only an estimate of it.
+        """
+        prior_mean, prior_precision, _, censored_terms, uncensored_terms = args
+        x = x0
+        value, grad = self._neg_log_posterior(x, *args)
+        for _ in range(max_iterations):
+            hessian = self._neg_log_posterior_hessian(
+                x, prior_precision, censored_terms, uncensored_terms
+            )
+            step = np.linalg.solve(hessian, grad)
+
+            # Halve the step until the objective doesn't increase
+            for _ in range(30):
+                candidate = x - step
+                candidate_value, candidate_grad = self._neg_log_posterior(
+                    candidate, *args
+                )
+                if candidate_value <= value:
+                    break
+                step = step / 2
+
+            x, value, grad = candidate, candidate_value, candidate_grad
+            if np.all(np.abs(step) <= tolerance * (1.0 + np.abs(x))):
+                break
+
+        hessian = self._neg_log_posterior_hessian(
+            x, prior_precision, censored_terms, uncensored_terms
+        )
+        return x, np.linalg.inv(hessian)
+
+    def _posterior_args(
+        self,
+        censored_observations: List[Tuple[int, float]],
+        uncensored_observations: List[Tuple[int, float]],
+    ) -> Tuple:
+        """
+        Returns the arguments of _neg_log_posterior after the current (prior) state, for the observations.
+        """
+        prior_mean = np.array([self.anaerobic_work, self.watts_scaling_factor])
+        prior_cov = self.covariance_matrix
+
+        _, logdet = np.linalg.slogdet(prior_cov)
+        return (
+            prior_mean,
+            np.linalg.inv(prior_cov),
+            -0.5 * logdet - 2 * LOG_SQRT_2PI,
+            self._observation_terms(censored_observations, prior_cov),
+            self._observation_terms(uncensored_observations, prior_cov),
+        )
+
     def update_based_on_observations(
         self,
         censored_observations: List[Tuple[int, float]],
         uncensored_observations: List[Tuple[int, float]],
         noise_floor_A: float = 100.0,  # std of 10 W·min
         noise_floor_B: float = 25.0,  # std of 5
+        method: str = "bfgs",
     ):
         """
         This function takes two lists of pairs of duration and power, one of which are censored observations,
         and the other are uncensored observations, and updates the anaerobic work, watts_scaling_factor, and the
         covariance_matrix attributes.
+
+        method="bfgs" runs scipy's BFGS from the prior mean and uses its hess_inv as the posterior covariance.
+        method="newton" runs a few Newton steps with the exact hessian instead (a Laplace approximation), which
+        converges in fewer evaluations and gives the exact curvature at the optimum.
+
+        The two don't agree in general. hess_inv is BFGS's running estimate of the inverse hessian, built
+        from the few steps it took, not the curvature at the optimum; with a strong prior (high stickiness)
+        it is close, but with a weak one (stickiness around 1) it can be off by an order of magnitude. Since
+        the covariance is the next activity's prior, the two paths then drift apart over a history (the
+        means too). The Newton mode and covariance match a tightly converged optimizer and the exact hessian.
         """
         prior_mean = np.array([self.anaerobic_work, self.watts_scaling_factor])
-        prior_cov = self.covariance_matrix
+        args = self._posterior_args(censored_observations, uncensored_observations)
 
-        def obs_sigma(duration):
-            j = np.array([1.0 / (duration + self.tau), duration ** (-self.alpha)])
-            return np.sqrt(j @ prior_cov @ j)
+        if method == "newton":
+            posterior_mean, posterior_cov = self._newton_minimize(prior_mean, args)
+        elif method == "bfgs":
+            # scipy.optimize is slow to import, and the batched (Newton) workers never need it
+            from scipy.optimize import minimize
 
-        def neg_log_posterior(params):
-            A, B = params
+            result = minimize(
+                self._neg_log_posterior,
+                x0=prior_mean,
+                args=args,
+                jac=True,
+                method="BFGS",
+            )
+            posterior_mean, posterior_cov = result.x, result.hess_inv
+        else:
+            raise ValueError(f"Unknown update method {method}")
 
-            ll = 0.0
-            for duration, power in uncensored_observations:
-                ll += norm.logpdf(
-                    power,
-                    self.predict_peak_power(duration, A, B),
-                    scale=obs_sigma(duration),
-                )
-            for duration, power in censored_observations:
-                ll += norm.logsf(
-                    power,
-                    self.predict_peak_power(duration, A, B),
-                    scale=obs_sigma(duration),
-                )
+        self.anaerobic_work, self.watts_scaling_factor = posterior_mean
+        self.covariance_matrix = posterior_cov + np.diag([noise_floor_A, noise_floor_B])
+
+
+@dataclass
+class BatchedLinearModel(ABC):
+    """
+    M independent models whose P(t) is linear in two parameters, advanced through the same activities
+    together, with their states stacked into arrays. Updates use the same Newton/Laplace step as
+    PacingModel.update_based_on_observations(method="newton"), vectorized over the models.
+
+    Subclasses only provide the jacobian, i.e. the two basis functions evaluated at the durations.
+    """
+
+    means: NDArray[np.float64]  # (M, 2)
+    covariances: NDArray[np.float64]  # (M, 2, 2)
+    stickiness: NDArray[np.float64]  # (M,)
+
+    def predict_peak_power(self, duration) -> NDArray[np.float64]:
+        """
+        Returns P(duration) for every model, with shape (M,) + np.shape(duration).
+        """
+        j = self.jacobian(np.asarray(duration, dtype=np.float64))
+        return np.einsum("m...i,mi->m...", j, self.means)
+
+    @abstractmethod
+    def jacobian(self, durations: NDArray[np.float64]) -> NDArray[np.float64]:
+        """
+        Returns the (M,) + durations.shape + (2,) array of partial derivatives of P(t) with respect to
+        the two parameters.
+        """
+
+    def _objective(
+        self,
+        params: NDArray[np.float64],
+        prior_mean: NDArray[np.float64],
+        prior_precision: NDArray[np.float64],
+        j: NDArray[np.float64],
+        sigma: NDArray[np.float64],
+        powers: NDArray[np.float64],
+        censored: NDArray[np.bool_],
+        valid: NDArray[np.bool_],
+        derivatives: bool = True,
+    ) -> Tuple[NDArray[np.float64], ...]:
+        """
+        Returns the negative log posterior of every model (up to a constant), and unless derivatives is False,
+        its gradient and hessian. Everything is 2-dimensional, so the matrix products are written out by hand.
+        """
+        mu = j[..., 0] * params[:, 0:1] + j[..., 1] * params[:, 1:2]
+        z = (powers[None, :] - mu) / sigma
+        log_sf = log_ndtr(-z)
+
+        neg_ll = np.where(valid, np.where(censored, -log_sf, 0.5 * z**2), 0.0)
+
+        delta = params - prior_mean
+        precision_delta = np.einsum("mij,mj->mi", prior_precision, delta)
+        value = neg_ll.sum(axis=1) + 0.5 * self.stickiness * (
+            delta * precision_delta
+        ).sum(axis=1)
+        if not derivatives:
+            return (value,)
+
+        hazard = np.exp(-0.5 * z**2 - LOG_SQRT_2PI - log_sf)
+        d_neg_ll = np.where(valid, np.where(censored, -hazard, -z) / sigma, 0.0)
+        curvature = np.where(
+            valid, np.where(censored, hazard * (hazard - z), 1.0) / sigma**2, 0.0
+        )
+
+        stickiness = self.stickiness[:, None]
+        grad = np.stack(
+            [(d_neg_ll * j[..., 0]).sum(axis=1), (d_neg_ll * j[..., 1]).sum(axis=1)],
+            axis=-1,
+        )
+        grad += stickiness * precision_delta
+
+        h_aa = (curvature * j[..., 0] ** 2).sum(axis=1)
+        h_ab = (curvature * j[..., 0] * j[..., 1]).sum(axis=1)
+        h_bb = (curvature * j[..., 1] ** 2).sum(axis=1)
+        hessian = np.stack(
+            [np.stack([h_aa, h_ab], axis=-1), np.stack([h_ab, h_bb], axis=-1)],
+            axis=-2,
+        )
+        hessian += stickiness[:, :, None] * prior_precision
+        return value, grad, hessian
+
+    def update_based_on_observations(
+        self,
+        durations: NDArray[np.float64],
+        powers: NDArray[np.float64],
+        censored: NDArray[np.bool_],
+        noise_floor_A: float = 100.0,
+        noise_floor_B: float = 25.0,
+        max_iterations: int = 20,
+        tolerance: float = 1e-8,
+    ):
+        """
+        Updates every model with the same activity's observations. durations, powers and censored are (K,)
+        arrays, and NaN powers mark missing observations.
+        """
+        valid = np.isfinite(powers)
+        powers = np.where(valid, powers, 0.0)
 
-            log_prior = multivariate_normal.logpdf(
-                params, mean=prior_mean, cov=prior_cov
+        prior_mean = self.means
+        prior_precision = np.linalg.inv(self.covariances)
+        j = self.jacobian(durations)
+        sigma = np.sqrt(
+            j[..., 0] ** 2 * self.covariances[:, None, 0, 0]
+            + 2 * j[..., 0] * j[..., 1] * self.covariances[:, None, 0, 1]
+            + j[..., 1] ** 2 * self.covariances[:, None, 1, 1]
+        )
+        args = (prior_mean, prior_precision, j, sigma, powers, censored, valid)
+
+        params = prior_mean
+        value, grad, hessian = self._objective(params, *args)
+        for _ in range(max_iterations):
+            step = np.linalg.solve(hessian, grad[..., None])[..., 0]
+            converged = np.all(
+                np.abs(step) <= tolerance * (1.0 + np.abs(params)), axis=1
             )
+            if converged.all():
+                break
+            step[converged] = 0.0
 
-            return -(ll + self.stickiness * log_prior)
+            # Halve the step of every model whose objective would increase
+            for _ in range(30):
+                (candidate_value,) = self._objective(
+                    params - step, *args, derivatives=False
+                )
+                increased = candidate_value > value + 1e-12 * np.abs(value)
+                if not increased.any():
+                    break
+                step[increased] /= 2
 
-        result = minimize(neg_log_posterior, x0=prior_mean, method="BFGS")
+            params = params - step
+            value, grad, hessian = self._objective(params, *args)
 
-        self.anaerobic_work, self.watts_scaling_factor = result.x
-        self.covariance_matrix = result.hess_inv + np.diag(
+        self.means = params
+        self.covariances = np.linalg.inv(hessian) + np.diag(
             [noise_floor_A, noise_floor_B]
         )
+
+
+@dataclass
+class BatchedPacingModel(BatchedLinearModel):
+    """
+    M independent PacingModels, one per (tau, alpha, stickiness) setting.
+    """
+
+    tau: NDArray[np.float64]  # (M,)
+    alpha: NDArray[np.float64]  # (M,)
+
+    @classmethod
+    def from_prior(
+        cls,
+        anaerobic_work: float,
+        watts_scaling_factor: float,
+        covariance_matrix: NDArray[np.float64],
+        tau: NDArray[np.float64],
+        alpha: NDArray[np.float64],
+        stickiness: NDArray[np.float64],
+    ) -> "BatchedPacingModel":
+        tau, alpha, stickiness = np.broadcast_arrays(
+            np.asarray(tau, dtype=np.float64),
+            np.asarray(alpha, dtype=np.float64),
+            np.asarray(stickiness, dtype=np.float64),
+        )
+        m = tau.shape[0]
+        return cls(
+            means=np.tile([anaerobic_work, watts_scaling_factor], (m, 1)).astype(
+                np.float64
+            ),
+            covariances=np.tile(covariance_matrix, (m, 1, 1)).astype(np.float64),
+            tau=tau.copy(),
+            alpha=alpha.copy(),
+            stickiness=stickiness.copy(),
+        )
+
+    def jacobian(self, durations: NDArray[np.float64]) -> NDArray[np.float64]:
+        """
+        Returns the (M,) + durations.shape + (2,) array of partial derivatives of P(t) with respect to (A, B).
+        """
+        extra_dims = (None,) * durations.ndim
+        tau = self.tau[(slice(None),) + extra_dims]
+        alpha = self.alpha[(slice(None),) + extra_dims]
+        return np.stack(
+            [
+                1.0 / (durations[None, ...] + tau),
+                durations[None, ...] ** (-1 * alpha),
+            ],
+            axis=-1,
+        )
@@ -0,0 +1,291 @@
+"""
+Docstring for pacing_plan
+
+This module turns a course and a fitted PacingModel into a segment-by-segment power plan, for rides
+longer than anything in the history, where a single P(t) number isn't enough to pace by.
+
+- The course is an elevation profile (distance and altitude, in meters), either from a past activity's
+  distance/altitude streams or from a GPX file, cut into fixed length segments with a grade each.
+- Speed on each segment comes from the steady state power balance (gravity, rolling resistance and
+  aerodynamic drag), solved in closed form as a cubic for all segments at once.
+- A plan holds a base power, pushed up on climbs and eased off on descents by a climb gain. For a grid of
+  gains, the base power is bisected (for all gains together) to the highest value whose every rolling
+  window stays under the model's predicted P(t) for its length, and the fastest feasible plan wins.
+- Since power is constant within a segment, the best window of any length starts or ends on a segment
+  boundary, so the limit is checked exactly by interpolating cumulative energy at those points, for every
+  plan (gain) at once.
+"""
+
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+
+import numpy as np
+import polars as pl
+from numpy.typing import NDArray
+
+from .geo import along_track_distance
+from .pacing_calculator import PacingModel
+from .time_series_functions import general_adapter
+from .time_series_parser import get_time_series
+
+GRAVITY = 9.81  # m/s^2
+
+# Window lengths (in minutes) whose average power is held under P(t), on top of the whole ride
+CHECK_DURATIONS = [1, 5, 20, 60, 120, 240, 480, 960, 1440, 2880]
+CLIMB_GAINS = np.linspace(0, 15, 16)
+
+
+@dataclass
+class RiderPhysics:
+    mass: float = 85.0  # kg, rider plus bike and luggage
+    cda: float = 0.35  # m^2
+    crr: float = 0.005
+    air_density: float = 1.2  # kg/m^3
+    drivetrain_efficiency: float = 0.97
+    max_speed: float = 18.0  # m/s, nobody descends faster than this on a loaded bike
+
+    def resistance(self, grade: NDArray[np.float64]) -> NDArray[np.float64]:
+        # Gravity plus rolling resistance, in newtons
+        theta = np.arctan(grade)
+        return self.mass * GRAVITY * (np.sin(theta) + self.crr * np.cos(theta))
+
+    def power_at_speed(
+        self, speed: NDArray[np.float64], grade: NDArray[np.float64]
+    ) -> NDArray[np.float64]:
+        drag = 0.5 * self.air_density * self.cda * speed**2
+        return (self.resistance(grade) + drag) * speed / self.drivetrain_efficiency
+
+    def speed_at_power(
+        self, power: NDArray[np.float64], grade: NDArray[np.float64]
+    ) -> NDArray[np.float64]:
+        """
+        Solves power_at_speed for the speed, elementwise. The power balance is the depressed cubic
+        v^3 + p v + q = 0 with q <= 0, which has exactly one non-negative root: Cardano's formula
+        when it is the only real root, and the largest trigonometric root otherwise.
+        """
+        a = 0.5 * self.air_density * self.cda
+        p = np.broadcast_to(self.resistance(grade) / a, np.shape(power))
+        q = -self.drivetrain_efficiency * np.asarray(power, dtype=np.float64) / a
+
+        discriminant = (q / 2) ** 2 + (p / 3) ** 3
+        root = np.sqrt(np.maximum(discriminant, 0.0))
+        cardano = np.cbrt(-q / 2 + root) + np.cbrt(-q / 2 - root)
+
+        negative_p = np.minimum(p, -1e-12)
+        cosine = np.clip(3 * q / (2 * negative_p) * np.sqrt(-3 / negative_p), -1.0, 1.0)
+        trigonometric = 2 * np.sqrt(-negative_p / 3) * np.cos(np.arccos(cosine) / 3)
+
+        speed = np.where(discriminant >= 0, cardano, trigonometric)
+        return np.clip(speed, 0.0, self.max_speed)
+
+
+def elevation_profile_from_activity(file_path: str, root_path="./") -> pl.DataFrame:
+    """
+    Returns the distance/altitude profile of a past activity, with the distance made
+    strictly increasing (stops and GPS jitter removed).
+    """
+    df = general_adapter(
+        ["distance", "altitude"],
+        get_time_series(file_path=file_path, root_path=root_path),
+    ).select("distance", "altitude")
+    if df["distance"].null_count() == df.shape[0]:
+        raise pl.exceptions.ColumnNotFoundError(f"{file_path} has no distance stream")
+    if df["altitude"].null_count() == df.shape[0]:
+        raise pl.exceptions.ColumnNotFoundError(f"{file_path} has no altitude stream")
+
+    return df.with_columns(pl.col("distance").cum_max()).unique(
+        "distance", keep="first", maintain_order=True
+    )
+
+
+def elevation_profile_from_gpx(gpx_path: str) -> pl.DataFrame:
+    """
+    Returns the distance/altitude profile of the track points in a GPX file, with distances
+    from the haversine formula. Points without an elevation are skipped.
+    """
+    root = ET.parse(gpx_path).getroot()
+    points = [
+        (float(p.get("lat")), float(p.get("lon")), float(p.find("{*}ele").text))
+        for p in root.findall(".//{*}trkpt")
+        if p.find("{*}ele") is not None
+    ]
+    if not points:
+        raise ValueError(f"{gpx_path} has no track points with an elevation")
+
+    points = np.array(points)
+    distance = along_track_distance(points[:, 0], points[:, 1])
+    altitude = points[:, 2]
+
+    return pl.DataFrame({"distance": distance, "altitude": altitude}).unique(
+        "distance", keep="first", maintain_order=True
+    )
+
+
+def segment_course(
+    profile: pl.DataFrame, segment_length: float = 500.0
+) -> pl.DataFrame:
+    """
+    Cuts an elevation profile into segments of segment_length meters (the last one shorter),
+    with the grade of each from the interpolated altitude at its ends.
+    """
+    distance = profile["distance"].to_numpy()
+    altitude = profile["altitude"].to_numpy()
+
+    boundaries = np.arange(distance[0], distance[-1], segment_length)
+    boundaries = np.append(boundaries, distance[-1])
+    boundary_altitude = np.interp(boundaries, distance, altitude)
+    lengths = np.diff(boundaries)
+
+    return pl.DataFrame(
+        {
+            "Start distance": boundaries[:-1],
+            "Length": lengths,
+            "Start altitude": boundary_altitude[:-1],
+            "Grade": np.diff(boundary_altitude) / lengths,
+        }
+    ).filter(pl.col("Length") > 0)
+
+
+def _plan_powers(
+    base_power: NDArray[np.float64],
+    climb_gains: NDArray[np.float64],
+    grade: NDArray[np.float64],
+    coasting_power: NDArray[np.float64],
+) -> NDArray[np.float64]:
+    # (K, S) powers: the base scaled with the grade, never below zero, and never more than
+    # it takes to hold max_speed (anything above that would be braked off)
+    powers = base_power[:, None] * (1 + climb_gains[:, None] * grade[None, :])
+    return np.clip(powers, 0.0, coasting_power[None, :])
+
+
+def _peak_window_powers(
+    cumulative_time: NDArray[np.float64],
+    cumulative_energy: NDArray[np.float64],
+    window: float,
+) -> NDArray[np.float64]:
+    # (K,) best average power over `window` seconds (shorter than every plan) of each of the K plans,
+    # with windows starting or ending on a segment boundary. Every plan's time axis is shifted past the
+    # end of the previous one, so all of them are interpolated in one np.interp call.
+    total_times = cumulative_time[:, -1:]
+    shift = (total_times.max() + 1.0) * np.arange(cumulative_time.shape[0])[:, None]
+    shifted_time = (cumulative_time + shift).ravel()
+    flat_energy = cumulative_energy.ravel()
+
+    def energy_at(times):
+        return np.interp(
+            (np.clip(times, 0.0, total_times) + shift).ravel(),
+            shifted_time,
+            flat_energy,
+        ).reshape(times.shape)
+
+    # The boundaries themselves need no interpolation
+    energy_from_starts = np.where(
+        cumulative_time + window <= total_times,
+        energy_at(cumulative_time + window) - cumulative_energy,
+        -np.inf,
+    )
+    energy_to_ends = np.where(
+        cumulative_time >= window,
+        cumulative_energy - energy_at(cumulative_time - window),
+        -np.inf,
+    )
+    return (
+        np.maximum(energy_from_starts.max(axis=1), energy_to_ends.max(axis=1)) / window
+    )
+
+
+def evaluate_plans(
+    powers: NDArray[np.float64],
+    lengths: NDArray[np.float64],
+    grade: NDArray[np.float64],
+    model: PacingModel,
+    physics: RiderPhysics,
+    z: float = 0.0,
+) -> tuple[NDArray[np.float64], NDArray[np.bool_]]:
+    """
+    Takes (K, S) segment powers and returns the (K,) total times in seconds, and whether each plan keeps
+    every CHECK_DURATIONS window and the whole ride under the model's P(t), lowered by z standard deviations.
+    """
+    speeds = physics.speed_at_power(powers, grade[None, :])
+    segment_times = lengths[None, :] / np.maximum(speeds, 0.1)
+    cumulative_time = np.concatenate(
+        [np.zeros((powers.shape[0], 1)), np.cumsum(segment_times, axis=1)], axis=1
+    )
+    cumulative_energy = np.concatenate(
+        [np.zeros((powers.shape[0], 1)), np.cumsum(powers * segment_times, axis=1)],
+        axis=1,
+    )
+    total_times = cumulative_time[:, -1]
+
+    _, window_limits, _ = model.predict_power_curve(CHECK_DURATIONS, z=z)
+    _, ride_limits, _ = model.predict_power_curve(total_times / 60, z=z)
+
+    feasible = cumulative_energy[:, -1] / total_times <= ride_limits
+    for duration, limit in zip(CHECK_DURATIONS, window_limits):
+        # Only the plans still feasible need checking, and windows longer than a plan are covered by
+        # its whole ride limit
+        window = duration * 60.0
+        rows = np.flatnonzero(feasible & (total_times > window))
+        if rows.shape[0] == 0:
+            break
+        peaks = _peak_window_powers(
+            cumulative_time[rows], cumulative_energy[rows], window
+        )
+        feasible[rows[peaks > limit]] = False
+
+    return total_times, feasible
+
+
+def solve_pacing_plan(
+    segments: pl.DataFrame,
+    model: PacingModel,
+    physics: RiderPhysics | None = None,
+    z: float = 0.0,
+    climb_gains: NDArray[np.float64] = CLIMB_GAINS,
+    iterations: int = 30,
+) -> pl.DataFrame:
+    """
+    Returns the fastest plan for the segments (the output of segment_course) that respects the model's
+    power-duration limit, with the power, speed, time and elapsed time of each segment.
+
+    z > 0 plans against the lower edge of the model's band instead of its mean, for a more conservative plan.
+    """
+    if physics is None:
+        physics = RiderPhysics()
+    climb_gains = np.asarray(climb_gains, dtype=np.float64)
+
+    lengths = segments["Length"].to_numpy()
+    grade = segments["Grade"].to_numpy()
+    coasting_power = np.maximum(
+        physics.power_at_speed(np.full(grade.shape, physics.max_speed), grade), 0.0
+    )
+
+    # Bisect the base power for every climb gain at once
+    low = np.zeros(climb_gains.shape[0])
+    high = np.full(climb_gains.shape[0], float(model.predict_power_curve([1])[0][0]))
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        _, feasible = evaluate_plans(
+            _plan_powers(middle, climb_gains, grade, coasting_power),
+            lengths,
+            grade,
+            model,
+            physics,
+            z=z,
+        )
+        low = np.where(feasible, middle, low)
+        high = np.where(feasible, high, middle)
+
+    powers = _plan_powers(low, climb_gains, grade, coasting_power)
+    total_times, _ = evaluate_plans(powers, lengths, grade, model, physics, z=z)
+    best = int(np.argmin(total_times))
+
+    speeds = physics.speed_at_power(powers[best], grade)
+    segment_times = lengths / np.maximum(speeds, 0.1)
+    return segments.with_columns(
+        pl.Series("Power", powers[best]),
+        pl.Series("Speed", speeds),
+        pl.Series("Segment time", segment_times),
+        pl.Series("Elapsed time", np.cumsum(segment_times)),
+        pl.lit(float(climb_gains[best])).alias("Climb gain"),
+    )
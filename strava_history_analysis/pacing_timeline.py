@@ -0,0 +1,330 @@
+"""
+Docstring for pacing_timeline
+
+This module keeps the PacingModel posterior after every activity, so the current power-duration estimate
+doesn't require replaying the whole history from the prior.
+
+- The timeline holds the activity ids, dates, posterior means (N x 2) and covariances (N x 2 x 2) as arrays,
+  along with the (tau, alpha, stickiness) they were computed with.
+- It is persisted in database/pacing_timeline.parquet, and a newly synced ride is a single update from the
+  last checkpoint.
+- Which activities were processed is tracked by Activity ID, not by date: database/pacing_timeline_skipped.parquet
+  holds the ones without power, so they aren't reopened, and a late-synced ride dated before the last
+  checkpoint rolls the timeline back to just before it and replays from there.
+- Duplicate recordings are dropped from the spine first, as for the hyperparameter search.
+- "What did the model believe on date X" is a binary search over the dates.
+"""
+
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import numpy as np
+import polars as pl
+from numpy.typing import NDArray
+
+from .database import get_spine
+from .duplicates import drop_duplicates, get_duplicates
+from .hyperparameter_fit import (
+    CENSORED_OBSERVATION_COLUMNS,
+    UNCENSORED_OBSERVATION_COLUMNS,
+    anaerobic_power,
+    compute_observation_columns,
+    cov,
+    watts_scaling_factor,
+)
+from .pacing_calculator import PacingModel, power_duration_curve
+
+
+def _to_datetime64(date) -> np.datetime64:
+    if isinstance(date, datetime) and date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(date, "us")
+
+
+@dataclass
+class PosteriorTimeline:
+    tau: float
+    alpha: float
+    stickiness: float
+    activity_ids: NDArray[np.int64] = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64)
+    )
+    dates: NDArray[np.datetime64] = field(
+        default_factory=lambda: np.empty(0, dtype="datetime64[us]")
+    )  # UTC, sorted
+    means: NDArray[np.float64] = field(
+        default_factory=lambda: np.empty((0, 2))
+    )  # (A, B) after each activity
+    covariances: NDArray[np.float64] = field(
+        default_factory=lambda: np.empty((0, 2, 2))
+    )
+
+    def __len__(self):
+        return self.activity_ids.shape[0]
+
+    def last_date(self) -> datetime:
+        return (
+            self.dates[-1].astype("datetime64[us]").item().replace(tzinfo=timezone.utc)
+        )
+
+    def prior_model(self) -> PacingModel:
+        return PacingModel(
+            anaerobic_work=anaerobic_power,
+            watts_scaling_factor=watts_scaling_factor,
+            covariance_matrix=cov,
+            tau=self.tau,
+            alpha=self.alpha,
+            stickiness=self.stickiness,
+        )
+
+    def model_at_index(self, i: int) -> PacingModel:
+        return PacingModel(
+            anaerobic_work=float(self.means[i, 0]),
+            watts_scaling_factor=float(self.means[i, 1]),
+            covariance_matrix=self.covariances[i].copy(),
+            tau=self.tau,
+            alpha=self.alpha,
+            stickiness=self.stickiness,
+        )
+
+    def index_at(self, date) -> int:
+        """
+        Returns the index of the last activity on or before `date`, or -1 if there is none.
+        """
+        return int(np.searchsorted(self.dates, _to_datetime64(date), side="right")) - 1
+
+    def model_at(self, date) -> PacingModel:
+        """
+        Returns the model as it was after the last activity on or before `date`
+        (the prior if there wasn't one).
+        """
+        i = self.index_at(date)
+        if i < 0:
+            return self.prior_model()
+        return self.model_at_index(i)
+
+    def latest_model(self) -> PacingModel:
+        if len(self) == 0:
+            return self.prior_model()
+        return self.model_at_index(len(self) - 1)
+
+    def states_at(self, dates) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """
+        Returns the (len(dates), 2) means and (len(dates), 2, 2) covariances in effect on each of the dates,
+        using the prior for dates before the first activity.
+        """
+        query = np.array([_to_datetime64(d) for d in dates], dtype="datetime64[us]")
+        indices = np.searchsorted(self.dates, query, side="right") - 1
+
+        prior = self.prior_model()
+        means = np.vstack(
+            [[prior.anaerobic_work, prior.watts_scaling_factor], self.means]
+        )
+        covariances = np.concatenate(
+            [prior.covariance_matrix[None, :, :], self.covariances]
+        )
+        return means[indices + 1], covariances[indices + 1]
+
+    def power_curve_at(
+        self, dates, durations, z: float = 1.96
+    ) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+        """
+        Returns (mean, lower, upper) arrays of shape (len(dates), len(durations)): the P(t) curve the model
+        believed in on each date, with a band z standard deviations wide.
+        """
+        means, covariances = self.states_at(dates)
+        mean, std = power_duration_curve(
+            means, covariances, self.tau, self.alpha, durations
+        )
+        return mean, mean - z * std, mean + z * std
+
+    def power_history(self, duration: float, z: float = 1.96) -> pl.DataFrame:
+        """
+        Returns the predicted power for a single duration (in minutes) after every activity in the
+        timeline, e.g. for the 5m power chart in the README.
+        """
+        mean, std = power_duration_curve(
+            self.means, self.covariances, self.tau, self.alpha, [duration]
+        )
+        return pl.DataFrame(
+            {
+                "Activity ID": self.activity_ids,
+                "Activity Date": pl.Series(self.dates).dt.replace_time_zone("UTC"),
+                f"Predicted {duration}m power": mean[:, 0],
+                "Lower": mean[:, 0] - z * std[:, 0],
+                "Upper": mean[:, 0] + z * std[:, 0],
+            }
+        )
+
+    def truncate(self, date):
+        """
+        Drops the checkpoints of the activities on or after `date`.
+        """
+        keep = int(np.searchsorted(self.dates, _to_datetime64(date), side="left"))
+        self.activity_ids = self.activity_ids[:keep]
+        self.dates = self.dates[:keep]
+        self.means = self.means[:keep]
+        self.covariances = self.covariances[:keep]
+
+    def append(self, activity_id: int, date, model: PacingModel):
+        self.activity_ids = np.append(self.activity_ids, np.int64(activity_id))
+        self.dates = np.append(self.dates, _to_datetime64(date))
+        self.means = np.vstack(
+            [self.means, [model.anaerobic_work, model.watts_scaling_factor]]
+        )
+        self.covariances = np.concatenate(
+            [self.covariances, model.covariance_matrix[None, :, :]]
+        )
+
+    def to_dataframe(self) -> pl.DataFrame:
+        return pl.DataFrame(
+            {
+                "Activity ID": self.activity_ids,
+                "Activity Date": pl.Series(self.dates).dt.replace_time_zone("UTC"),
+                "A": self.means[:, 0],
+                "B": self.means[:, 1],
+                "Var A": self.covariances[:, 0, 0],
+                "Cov AB": self.covariances[:, 0, 1],
+                "Var B": self.covariances[:, 1, 1],
+                "tau": np.full(len(self), float(self.tau)),
+                "alpha": np.full(len(self), float(self.alpha)),
+                "stickiness": np.full(len(self), float(self.stickiness)),
+            }
+        )
+
+    @classmethod
+    def from_dataframe(
+        cls, df: pl.DataFrame, tau: float, alpha: float, stickiness: float
+    ) -> "PosteriorTimeline":
+        covariances = np.empty((df.shape[0], 2, 2))
+        covariances[:, 0, 0] = df["Var A"].to_numpy()
+        covariances[:, 0, 1] = covariances[:, 1, 0] = df["Cov AB"].to_numpy()
+        covariances[:, 1, 1] = df["Var B"].to_numpy()
+        return cls(
+            tau=tau,
+            alpha=alpha,
+            stickiness=stickiness,
+            activity_ids=df["Activity ID"].to_numpy().astype(np.int64),
+            dates=df["Activity Date"]
+            .dt.replace_time_zone(None)
+            .dt.cast_time_unit("us")
+            .to_numpy(),
+            means=df.select("A", "B").to_numpy(),
+            covariances=covariances,
+        )
+
+
+def extend_posterior_timeline(
+    timeline: PosteriorTimeline, dfnpf: pl.DataFrame, method: str = "bfgs"
+) -> PosteriorTimeline:
+    """
+    Updates the timeline's latest model with every activity in dfnpf (the output of
+    compute_observation_columns) that isn't in the timeline yet, in date order, appending the
+    posterior after each one. Raises a ValueError if one of them is dated before the timeline's
+    last activity (truncate the timeline first).
+    """
+    dfnpf = dfnpf.filter(~pl.col("Activity ID").is_in(timeline.activity_ids.tolist()))
+    if len(timeline) > 0 and not dfnpf.is_empty():
+        if dfnpf["Activity Date"].min() < timeline.last_date():
+            raise ValueError(
+                "An activity predates the last checkpoint of the timeline; truncate it first"
+            )
+
+    model = timeline.latest_model()
+    for activity in dfnpf.sort("Activity Date").iter_rows(named=True):
+        censored_observations = [
+            (duration, activity[column])
+            for duration, column in CENSORED_OBSERVATION_COLUMNS
+            if activity[column] is not None
+        ]
+        uncensored_observations = [
+            (duration, activity[column])
+            for duration, column in UNCENSORED_OBSERVATION_COLUMNS
+            if activity[column] is not None
+        ]
+        model.update_based_on_observations(
+            censored_observations, uncensored_observations, method=method
+        )
+        timeline.append(activity["Activity ID"], activity["Activity Date"], model)
+
+    return timeline
+
+
+def get_posterior_timeline(
+    tau: float,
+    alpha: float,
+    stickiness: float,
+    root_path="./",
+    poll_strava=False,
+    method: str = "bfgs",
+) -> PosteriorTimeline:
+    """
+    Returns the posterior timeline for the given hyperparameters, extending the cached one with
+    any activities it hasn't processed. Duplicate recordings are left out, as in construct_dataframe.
+    If a new activity is dated before the last checkpoint, or a checkpointed one is no longer in the
+    spine, the timeline is replayed from there. The cache is rebuilt if it was computed with
+    different hyperparameters.
+    """
+    timeline_path = os.path.join(root_path, "database", "pacing_timeline.parquet")
+    skipped_path = os.path.join(
+        root_path, "database", "pacing_timeline_skipped.parquet"
+    )
+
+    timeline = PosteriorTimeline(tau=tau, alpha=alpha, stickiness=stickiness)
+    if os.path.exists(timeline_path):
+        cached = pl.read_parquet(timeline_path)
+        same_hyperparameters = cached.is_empty() or (
+            cached["tau"][0] == tau
+            and cached["alpha"][0] == alpha
+            and cached["stickiness"][0] == stickiness
+        )
+        if same_hyperparameters:
+            timeline = PosteriorTimeline.from_dataframe(cached, tau, alpha, stickiness)
+
+    # Activities without power, which never make it into the timeline
+    skipped = pl.DataFrame(schema={"Activity ID": pl.Int64})
+    if os.path.exists(skipped_path):
+        skipped = pl.read_parquet(skipped_path)
+
+    df = get_spine(root_path=root_path, poll_strava=poll_strava)
+    # Like construct_dataframe, a ride recorded twice is only one observation
+    df = drop_duplicates(df, get_duplicates(df, root_path=root_path))
+    processed = timeline.activity_ids.tolist() + skipped["Activity ID"].to_list()
+    new = df.filter(~pl.col("Activity ID").is_in(processed))
+    # Checkpoints of activities no longer in the spine, e.g. since found to be duplicates
+    gone = ~np.isin(timeline.activity_ids, df["Activity ID"].to_numpy())
+    if new.is_empty() and not gone.any():
+        return timeline
+
+    dfnpf = compute_observation_columns(new, root_path=root_path)
+    newly_skipped = new.join(dfnpf, on="Activity ID", how="anti")
+    if not newly_skipped.is_empty():
+        pl.concat([skipped, newly_skipped.select("Activity ID")]).write_parquet(
+            skipped_path
+        )
+    if dfnpf.is_empty() and not gone.any():
+        return timeline
+
+    # Roll back to just before the earliest new ride (synced late) or gone checkpoint,
+    # and replay the rest
+    previous_ids = timeline.activity_ids
+    rollback_dates = list(timeline.dates[gone])
+    if not dfnpf.is_empty():
+        rollback_dates.append(_to_datetime64(dfnpf["Activity Date"].min()))
+    earliest = min(rollback_dates)
+    if len(timeline) > 0 and earliest <= timeline.dates[-1]:
+        timeline.truncate(earliest)
+        replayed = df.filter(
+            pl.col("Activity ID").is_in(
+                np.setdiff1d(previous_ids, timeline.activity_ids).tolist()
+            )
+        )
+        dfnpf = pl.concat(
+            [dfnpf, compute_observation_columns(replayed, root_path=root_path)]
+        )
+
+    timeline = extend_posterior_timeline(timeline, dfnpf, method=method)
+    timeline.to_dataframe().write_parquet(timeline_path)
+
+    return timeline
@@ -0,0 +1,237 @@
+"""
+Docstring for power_duration_models
+
+This module puts alternative power-duration models next to the PacingModel form, and compares them on
+the same history.
+
+- Every model here is linear in two parameters, P(t) = theta_0 * f_0(t) + theta_1 * f_1(t) with t in minutes,
+  where the basis functions can depend on a few shape parameters (like tau and alpha for the PacingModel).
+  That is what lets them all share the batched Newton/Laplace update of BatchedLinearModel.
+- The forms are:
+    - PacingForm: A / (t + tau) + B * t^(-alpha), the form the PacingModel uses
+    - CriticalPowerForm: W' / t + CP
+    - ThreeParameterForm: W' / (t + k) + CP, the 3-parameter critical power model with
+      k = W' / (Pmax - CP) searched over as a shape parameter
+- A new form only needs a prior, a basis and a grid of shape parameters.
+- The harness scores every (shape, stickiness) point of every form with the same prequential loss as
+  the hyperparameter search, over one observation tensor shared with the worker pool, and tabulates the
+  best loss of each form against the worker seconds it took.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+import polars as pl
+from numpy.typing import NDArray
+
+from .hyperparameter_fit import (
+    ALPHA_RANGE,
+    BATCH_SIZE,
+    TAU_RANGE,
+    HyperparameterPool,
+    anaerobic_power,
+    cov,
+    prequential_loss,
+    watts_scaling_factor,
+)
+from .pacing_calculator import BatchedLinearModel
+
+STICKINESS_AXIS = np.geomspace(0.5, 200, 10)
+
+
+class PowerDurationForm(ABC):
+    name: str = ""
+    shape_names: Tuple[str, ...] = ()
+    prior_mean: NDArray[np.float64]
+    prior_covariance: NDArray[np.float64]
+    # Variance added to each parameter after every update
+    noise_floor: Tuple[float, float]
+
+    def shape_grid(self) -> NDArray[np.float64]:
+        """
+        Returns the (G, len(shape_names)) shape parameter points the harness searches over.
+        """
+        return np.empty((1, 0))
+
+    @abstractmethod
+    def basis(
+        self, durations: NDArray[np.float64], shapes: NDArray[np.float64]
+    ) -> NDArray[np.float64]:
+        """
+        Takes durations in minutes and (M, len(shape_names)) shapes, and returns the
+        (M,) + durations.shape + (2,) basis functions.
+        """
+
+
+class PacingForm(PowerDurationForm):
+    name = "pacing"
+    shape_names = ("tau", "alpha")
+    prior_mean = np.array([anaerobic_power, watts_scaling_factor], dtype=np.float64)
+    prior_covariance = cov
+    noise_floor = (100.0, 25.0)
+
+    def shape_grid(self) -> NDArray[np.float64]:
+        taus, alphas = np.meshgrid(TAU_RANGE[::5], ALPHA_RANGE[::5], indexing="ij")
+        return np.stack([taus.ravel(), alphas.ravel()], axis=-1)
+
+    def basis(self, durations, shapes):
+        extra_dims = (None,) * durations.ndim
+        tau = shapes[(slice(None), 0) + extra_dims]
+        alpha = shapes[(slice(None), 1) + extra_dims]
+        return np.stack(
+            [1.0 / (durations[None, ...] + tau), durations[None, ...] ** (-1 * alpha)],
+            axis=-1,
+        )
+
+
+class CriticalPowerForm(PowerDurationForm):
+    # W' in joules, hence the 60 with t in minutes
+    name = "critical power"
+    prior_mean = np.array([20000.0, 240.0])
+    prior_covariance = np.diag([8000.0**2, 40.0**2])
+    noise_floor = (500.0**2, 25.0)
+
+    def basis(self, durations, shapes):
+        j_w = np.broadcast_to(
+            1.0 / (60 * durations[None, ...]), (shapes.shape[0],) + durations.shape
+        )
+        return np.stack([j_w, np.ones_like(j_w)], axis=-1)
+
+
+class ThreeParameterForm(CriticalPowerForm):
+    name = "3-parameter"
+    shape_names = ("k",)
+
+    def shape_grid(self) -> NDArray[np.float64]:
+        return np.linspace(0.1, 2.0, 20)[:, None]  # minutes
+
+    def basis(self, durations, shapes):
+        extra_dims = (None,) * durations.ndim
+        k = shapes[(slice(None), 0) + extra_dims]
+        j_w = 1.0 / (60 * (durations[None, ...] + k))
+        return np.stack([j_w, np.ones_like(j_w)], axis=-1)
+
+
+FORMS = [PacingForm(), CriticalPowerForm(), ThreeParameterForm()]
+
+
+@dataclass
+class BatchedFormModel(BatchedLinearModel):
+    """
+    M models of the same form, one per (shape, stickiness) setting.
+    """
+
+    form: PowerDurationForm
+    shapes: NDArray[np.float64]  # (M, len(form.shape_names))
+
+    @classmethod
+    def from_prior(
+        cls,
+        form: PowerDurationForm,
+        shapes: NDArray[np.float64],
+        stickiness: NDArray[np.float64],
+    ) -> "BatchedFormModel":
+        m = shapes.shape[0]
+        return cls(
+            means=np.tile(form.prior_mean, (m, 1)).astype(np.float64),
+            covariances=np.tile(form.prior_covariance, (m, 1, 1)).astype(np.float64),
+            stickiness=np.asarray(stickiness, dtype=np.float64).copy(),
+            form=form,
+            shapes=np.asarray(shapes, dtype=np.float64),
+        )
+
+    def jacobian(self, durations: NDArray[np.float64]) -> NDArray[np.float64]:
+        return self.form.basis(durations, self.shapes)
+
+
+def get_form_loss(
+    observations: dict,
+    form: PowerDurationForm,
+    shapes: NDArray[np.float64],
+    stickinesses: NDArray[np.float64],
+    n_activities: int | None = None,
+) -> NDArray[np.float64]:
+    """
+    get_batched_hyperparameter_loss for any form: the loss of each (shape, stickiness) row.
+    """
+    model = BatchedFormModel.from_prior(form, shapes, stickinesses)
+    return prequential_loss(
+        model, observations, n_activities=n_activities, noise_floor=form.noise_floor
+    )
+
+
+def _timed_form_loss(observations, form, shapes, stickinesses):
+    start = time.perf_counter()
+    losses = get_form_loss(observations, form, shapes, stickinesses)
+    return losses, time.perf_counter() - start
+
+
+def compare_power_duration_models(
+    observations: dict,
+    forms: List[PowerDurationForm] | None = None,
+    stickiness_axis: NDArray[np.float64] = STICKINESS_AXIS,
+    max_workers: int | None = None,
+    pool: HyperparameterPool | None = None,
+) -> pl.DataFrame:
+    """
+    Grid searches every form's shape parameters and stickiness on the observation tensor (the output of
+    extract_observation_tensor), with the chunks of all forms in flight on the pool together.
+
+    Returns one row per form, best loss first, with its best parameters and the summed worker seconds
+    its evaluations took.
+    """
+    if forms is None:
+        forms = FORMS
+    if pool is None:
+        with HyperparameterPool(observations, max_workers=max_workers) as pool:
+            return compare_power_duration_models(
+                observations, forms, stickiness_axis, pool=pool
+            )
+
+    futures = []
+    points = []
+    for form in forms:
+        grid = form.shape_grid()
+        shapes = np.repeat(grid, len(stickiness_axis), axis=0)
+        stickinesses = np.tile(stickiness_axis, grid.shape[0])
+        points.append((shapes, stickinesses))
+        futures.append(
+            [
+                pool.submit(
+                    _timed_form_loss,
+                    form,
+                    shapes[b : b + BATCH_SIZE],
+                    stickinesses[b : b + BATCH_SIZE],
+                )
+                for b in range(0, shapes.shape[0], BATCH_SIZE)
+            ]
+        )
+
+    rows = []
+    for form, (shapes, stickinesses), form_futures in zip(forms, points, futures):
+        results = [f.result() for f in form_futures]
+        losses = np.concatenate([losses for losses, _ in results])
+        losses = np.where(np.isnan(losses), np.inf, losses)
+        best = int(np.argmin(losses))
+        rows.append(
+            (
+                form.name,
+                ", ".join(
+                    f"{name}={value:.4g}"
+                    for name, value in zip(form.shape_names, shapes[best])
+                ),
+                float(stickinesses[best]),
+                float(losses[best]),
+                len(losses),
+                sum(seconds for _, seconds in results),
+            )
+        )
+
+    return pl.DataFrame(
+        rows,
+        schema=["model", "shape", "stickiness", "loss", "evaluations", "seconds"],
+        orient="row",
+    ).sort("loss")
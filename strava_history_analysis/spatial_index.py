@@ -0,0 +1,276 @@
+"""
+Docstring for spatial_index
+
+This module indexes where every activity went, so that "which past rides cover the route I'm racing"
+is a lookup instead of a trawl through every GPS stream.
+
+- Positions come from position_lat/position_long (semicircles) in FIT files and latlng in API pulls.
+- Each track is simplified to a polyline with a point every ROUTE_SPACING meters or so, cached next to the
+  time series as cache/foo_fit_route.parquet when the cache is warmed.
+- The polyline is rasterized onto a fixed latitude/longitude grid of cells about CELL_SIZE meters tall,
+  and database/route_index.parquet holds the (cell, activity) pairs: an inverted index from cells to the
+  activities that passed through them, extended with just the unseen activities.
+- Before that, long straight stretches (a GPX route with only its turns in it, or a GPS dropout) are
+  filled in with points every ROUTE_SPACING meters, so no cell along them is skipped.
+- The overlap of an activity with a route is the fraction of the route's cells it passed through or
+  next to (the neighbours absorb GPS noise and tracks running along a cell boundary).
+"""
+
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import polars as pl
+from numpy.typing import NDArray
+
+from .database import get_spine
+from .geo import EARTH_RADIUS, along_track_distance
+from .time_series_parser import get_cache_path, get_time_series
+
+ROUTE_SPACING = 25.0  # meters between polyline points
+CELL_SIZE = 200.0  # meters, north to south
+CELL_DEGREES = np.degrees(CELL_SIZE / EARTH_RADIUS)
+SEMICIRCLES_TO_DEGREES = 180.0 / 2**31
+
+ROUTE_INDEX_SCHEMA = {"Cell": pl.Int64, "Activity ID": pl.Int64}
+
+
+def track_from_time_series(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Returns the latitude/longitude (in degrees) of every sample with a position fix, from either a
+    parsed FIT file or an API pull. Empty if the activity has no positions.
+    """
+    if "latlng" in df.columns:
+        positions = df.select(
+            pl.col("latlng").list.get(0, null_on_oob=True).alias("latitude"),
+            pl.col("latlng").list.get(1, null_on_oob=True).alias("longitude"),
+        )
+    elif "position_lat (semicircles)" in df.columns:
+        positions = df.select(
+            (pl.col("position_lat (semicircles)") * SEMICIRCLES_TO_DEGREES).alias(
+                "latitude"
+            ),
+            (pl.col("position_long (semicircles)") * SEMICIRCLES_TO_DEGREES).alias(
+                "longitude"
+            ),
+        )
+    else:
+        return pl.DataFrame(schema={"latitude": pl.Float64, "longitude": pl.Float64})
+
+    return positions.cast(pl.Float64).drop_nulls()
+
+
+def track_from_gpx(gpx_path: str) -> pl.DataFrame:
+    """
+    Returns the latitude/longitude of the track points (or failing that, route points) in a GPX file.
+    """
+    root = ET.parse(gpx_path).getroot()
+    points = root.findall(".//{*}trkpt") or root.findall(".//{*}rtept")
+    return pl.DataFrame(
+        {
+            "latitude": [float(p.get("lat")) for p in points],
+            "longitude": [float(p.get("lon")) for p in points],
+        },
+        schema={"latitude": pl.Float64, "longitude": pl.Float64},
+    )
+
+
+def simplify_track(track: pl.DataFrame, spacing: float = ROUTE_SPACING) -> pl.DataFrame:
+    """
+    Thins a track to its first point in every spacing meters of distance along it (plus its last point).
+    """
+    if track.shape[0] < 2:
+        return track
+    distance = along_track_distance(track["latitude"], track["longitude"])
+    _, keep = np.unique(np.floor(distance / spacing), return_index=True)
+    keep = np.union1d(keep, [track.shape[0] - 1])
+    return track[keep]
+
+
+def densify_track(track: pl.DataFrame, spacing: float = ROUTE_SPACING) -> pl.DataFrame:
+    """
+    Fills in points along every straight stretch of a track longer than spacing meters, so that
+    consecutive points are at most spacing meters apart and the track can't skip over a grid cell.
+    """
+    if track.shape[0] < 2:
+        return track
+    lat = track["latitude"].to_numpy()
+    lon = track["longitude"].to_numpy()
+    pieces = np.maximum(
+        np.ceil(np.diff(along_track_distance(lat, lon)) / spacing), 1
+    ).astype(np.int64)
+    # Stretch i is cut into pieces[i] steps, at fractions 0, 1 / pieces[i], ... of the way along it
+    stretch = np.repeat(np.arange(pieces.shape[0]), pieces)
+    fraction = (
+        np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    ) / pieces[stretch]
+    return pl.DataFrame(
+        {
+            "latitude": np.append(
+                lat[stretch] + fraction * (lat[stretch + 1] - lat[stretch]), lat[-1]
+            ),
+            "longitude": np.append(
+                lon[stretch] + fraction * (lon[stretch + 1] - lon[stretch]), lon[-1]
+            ),
+        },
+        schema={"latitude": pl.Float64, "longitude": pl.Float64},
+    )
+
+
+def route_cache_path(file_path: str, root_path: str = "./") -> str:
+    return get_cache_path(file_path, root_path).replace(".parquet", "_route.parquet")
+
+
+def get_route(file_path: str, root_path: str = "./") -> pl.DataFrame:
+    """
+    Returns the simplified polyline of an activity, using a parquet cache next to the time series cache.
+    """
+    cache_path = route_cache_path(file_path, root_path)
+    if os.path.exists(cache_path):
+        return pl.read_parquet(cache_path)
+
+    df = simplify_track(
+        track_from_time_series(
+            get_time_series(file_path=file_path, root_path=root_path)
+        )
+    )
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    df.write_parquet(cache_path)
+    return df
+
+
+def warm_route(file_path: str, root_path: str = "./") -> bool:
+    """
+    Makes sure the route cache of an activity exists, for warming the cache in worker processes.
+    Returns False if the activity has no positions.
+    """
+    return get_route(file_path, root_path=root_path).shape[0] > 0
+
+
+def _cell_coordinates(
+    track: pl.DataFrame,
+) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    rows = np.floor((track["latitude"].to_numpy() + 90) / CELL_DEGREES)
+    columns = np.floor((track["longitude"].to_numpy() + 180) / CELL_DEGREES)
+    return rows.astype(np.int64), columns.astype(np.int64)
+
+
+def track_cells(track: pl.DataFrame) -> NDArray[np.int64]:
+    """
+    Returns the sorted, distinct grid cells a track (or polyline) passes through, counting the ones
+    crossed between two points far apart.
+    """
+    rows, columns = _cell_coordinates(densify_track(track))
+    return np.unique((rows << 32) | columns)
+
+
+def build_route_index(
+    df: pl.DataFrame, root_path="./", cached: pl.DataFrame | None = None
+) -> pl.DataFrame:
+    """
+    Returns the (cell, activity) pairs of every activity in the spine `df`, only reading the routes of
+    activities missing from `cached`. Activities without positions get a single null cell, so they
+    aren't read again next time.
+    """
+    seen = set() if cached is None else set(cached["Activity ID"].to_list())
+
+    frames = [] if cached is None else [cached.select(list(ROUTE_INDEX_SCHEMA))]
+    for activity in df.select("Activity ID", "Filename").iter_rows(named=True):
+        if activity["Activity ID"] in seen:
+            continue
+        cells = track_cells(get_route(activity["Filename"], root_path=root_path))
+        frames.append(
+            pl.DataFrame(
+                {
+                    "Cell": cells if cells.shape[0] > 0 else [None],
+                    "Activity ID": activity["Activity ID"],
+                },
+                schema=ROUTE_INDEX_SCHEMA,
+            )
+        )
+
+    if not frames:
+        return pl.DataFrame(schema=ROUTE_INDEX_SCHEMA)
+    return pl.concat(frames).sort("Cell")
+
+
+def get_route_index(root_path="./", poll_strava=False) -> pl.DataFrame:
+    """
+    Returns the route index, extending the cached one with any activities the spine has that it doesn't.
+    """
+    index_path = os.path.join(root_path, "database", "route_index.parquet")
+    df = get_spine(root_path=root_path, poll_strava=poll_strava)
+
+    cached = None
+    if os.path.exists(index_path):
+        cached = pl.read_parquet(index_path)
+
+    index = build_route_index(df, root_path=root_path, cached=cached)
+    if cached is None or index.shape[0] != cached.shape[0]:
+        index.write_parquet(index_path)
+    return index
+
+
+def route_overlap(route: pl.DataFrame, index: pl.DataFrame) -> pl.DataFrame:
+    """
+    Returns the Activity ID and Overlap (the fraction of the route's cells the activity passed through
+    or next to) of every activity in the index that shares a cell with the route, best first.
+    """
+    route_cells = track_cells(simplify_track(route))
+    if route_cells.shape[0] == 0:
+        raise ValueError("The route has no positions")
+
+    rows, columns = route_cells >> 32, route_cells & 0xFFFFFFFF
+    offsets = np.array([-1, 0, 1])
+    # Every route cell, paired with itself and its 8 neighbours
+    neighbourhood = pl.DataFrame(
+        {
+            "Route cell": np.repeat(route_cells, 9),
+            "Cell": (
+                ((rows[:, None] + offsets[None, :]) << 32)[:, :, None]
+                | (columns[:, None] + offsets[None, :])[:, None, :]
+            ).ravel(),
+        }
+    )
+
+    return (
+        index.join(neighbourhood, on="Cell", how="inner")
+        .group_by("Activity ID")
+        .agg((pl.col("Route cell").n_unique() / route_cells.shape[0]).alias("Overlap"))
+        .sort("Overlap", "Activity ID", descending=[True, False])
+    )
+
+
+def search_route(
+    route: pl.DataFrame,
+    min_overlap: float = 0.8,
+    root_path="./",
+    index: pl.DataFrame | None = None,
+    spine: pl.DataFrame | None = None,
+) -> pl.DataFrame:
+    """
+    Returns the activities that cover at least min_overlap of the route (a latitude/longitude track, e.g.
+    from track_from_gpx), with their spine metadata and Overlap, best first.
+    """
+    if spine is None:
+        spine = get_spine(root_path=root_path, poll_strava=False)
+    if index is None:
+        index = get_route_index(root_path=root_path)
+
+    return (
+        route_overlap(route, index)
+        .filter(pl.col("Overlap") >= min_overlap)
+        .join(
+            spine.select(
+                "Activity ID",
+                "Activity Date",
+                "Activity Type",
+                "Activity Name",
+                "Activity Gear",
+                "Filename",
+            ),
+            on="Activity ID",
+            how="inner",
+        )
+        .sort("Overlap", "Activity Date", descending=True)
+    )
@@ -21,6 +21,16 @@ def compute_peak_average_power(duration_seconds, filename, root_path) -> np.floa
     return compute_power_functional(f, filename, root_path)
 
 
+def compute_top_k_efforts(
+    durations_seconds: List[int], filename, root_path, k: int = 3
+) -> pl.DataFrame:
+    ts_df = general_adapter(
+        ["power", "heartrate"],
+        get_time_series(file_path=filename, root_path=root_path),
+    )
+    return top_k_efforts(ts_df, durations_seconds, k=k)
+
+
 def compute_average_power(filename, root_path) -> np.float64:
     return compute_power_functional(average_power(), filename, root_path)
 
@@ -50,12 +60,35 @@ def compute_power_functional(functional, filename, root_path) -> np.float64:
 FIELD_NAME_MAPPINGS = {
     "power": ("power (watts)", "watts"),
     "heartrate": ("heart_rate (bpm)", "heartrate"),
+    "cadence": ("cadence (rpm)", "cadence"),
+    "speed": ("enhanced_speed (m/s)", "velocity_smooth"),
+    "distance": ("distance (m)", "distance"),
+    "altitude": ("enhanced_altitude (m)", "altitude"),
 }
 
+# Dropouts in power/HR/cadence/speed are treated as zeros, but cumulative or positional
+# streams need to carry the last seen value forward instead.
+FORWARD_FILLED_FIELDS = {"distance", "altitude"}
+
+
+def _field_selector(f: str, source_name: str, columns: List[str], allow_missing: bool):
+    if allow_missing and source_name not in columns:
+        return pl.lit(None, dtype=pl.Float64).alias(f)
+
+    selector = pl.col(source_name).cast(pl.Float64)
+    if f in FORWARD_FILLED_FIELDS:
+        selector = selector.forward_fill().backward_fill()
+    else:
+        selector = selector.fill_null(strategy="zero")
+    return selector.alias(f)
+
 
 ## The various field adapters go in here
 def fit_adapter(
-    fields: List[str], df: pl.DataFrame, moving_speed_threshold: float = 1.5
+    fields: List[str],
+    df: pl.DataFrame,
+    moving_speed_threshold: float = 1.5,
+    allow_missing: bool = False,
 ):
     speed = df.get_column(
         "speed (m/s)", default=pl.repeat(0.0, df.shape[0], dtype=pl.Float64)
@@ -76,10 +109,7 @@ def fit_adapter(
     )
     for f in fields:
         selectors.append(
-            pl.col(FIELD_NAME_MAPPINGS[f][0])
-            .cast(pl.Float64)
-            .fill_null(strategy="zero")
-            .alias(f)
+            _field_selector(f, FIELD_NAME_MAPPINGS[f][0], df.columns, allow_missing)
         )
 
     selectors.append((fIsMoving).alias("fIsMoving"))
@@ -87,7 +117,9 @@ def fit_adapter(
     return df.select(selectors)
 
 
-def strava_api_adapter(fields: List[str], df: pl.DataFrame):
+def strava_api_adapter(
+    fields: List[str], df: pl.DataFrame, allow_missing: bool = False
+):
     selectors = []
     selectors.append(
         (pl.duration(seconds=(pl.col("time") - pl.col("time").first()))).alias(
@@ -97,10 +129,7 @@ def strava_api_adapter(fields: List[str], df: pl.DataFrame):
 
     for f in fields:
         selectors.append(
-            pl.col(FIELD_NAME_MAPPINGS[f][1])
-            .cast(pl.Float64)
-            .fill_null(strategy="zero")
-            .alias(f)
+            _field_selector(f, FIELD_NAME_MAPPINGS[f][1], df.columns, allow_missing)
         )
 
     selectors.append(
@@ -162,6 +191,29 @@ def general_hr_adapter(df: pl.DataFrame, moving_speed_threshold=1.5) -> pl.DataF
         return fit_hr_adapter(df, moving_speed_threshold=moving_speed_threshold)
 
 
+def general_adapter(
+    fields: List[str], df: pl.DataFrame, moving_speed_threshold=1.5
+) -> pl.DataFrame:
+    """
+    Adapts a single loaded time series into every requested canonical field at once,
+    so analyses that need e.g. power and HR together (decoupling, efficiency factor)
+    don't have to load and adapt the file twice and join.
+
+    Unlike the single field adapters, a stream missing from the source comes back as
+    a null column instead of raising ColumnNotFoundError.
+    """
+    if "moving" in df:
+        # Comes from strava api pull
+        return strava_api_adapter(fields, df, allow_missing=True)
+    else:
+        return fit_adapter(
+            fields,
+            df,
+            moving_speed_threshold=moving_speed_threshold,
+            allow_missing=True,
+        )
+
+
 # TODO: Make this more general
 def fill_duration_gaps(df: pl.DataFrame) -> pl.DataFrame:
     """
@@ -225,3 +277,95 @@ def average_power() -> pl.Expr:
 def peak_rolling_hr(duration_seconds: int) -> pl.Expr:
     n_second_average = pl.col("heartrate").rolling_mean(duration_seconds)
     return n_second_average.max().alias(f"Peak {duration_seconds}s HR")
+
+
+def _non_overlapping_top_k(
+    window_means: np.ndarray, duration_seconds: int, k: int, chunk_size: int = 4096
+) -> List[int]:
+    # Window starts are sorted by power once, and then walked in that order, taking any start
+    # that isn't within duration_seconds of a start already taken. Each pick blocks out the
+    # starts it overlaps, and blocked starts are skipped a whole chunk at a time.
+    order = np.argsort(-window_means, kind="stable")
+    blocked = np.zeros(window_means.shape[0], dtype=bool)
+    chosen = []
+    for chunk_start in range(0, order.shape[0], chunk_size):
+        chunk = order[chunk_start : chunk_start + chunk_size]
+        for start in chunk[~blocked[chunk]]:
+            if blocked[start]:
+                continue
+            chosen.append(int(start))
+            if len(chosen) == k:
+                return chosen
+            blocked[max(0, start - duration_seconds + 1) : start + duration_seconds] = (
+                True
+            )
+    return chosen
+
+
+def top_k_efforts(
+    df: pl.DataFrame, durations_seconds: List[int], k: int = 3
+) -> pl.DataFrame:
+    """
+    Takes a dataframe with duration, power, and (optionally) heartrate columns, e.g. the output of
+    general_adapter(["power", "heartrate"], ...), and returns the k best non-overlapping windows
+    for each of the durations, with their start offset, average power and average HR.
+
+    Like peak_average_power, this treats each row as one second, and dropouts (null samples) as zeros.
+    A ride without any power gives no rows. Each row of the output can be used as a censored
+    (duration, power) observation for the PacingModel.
+    """
+    power = df.get_column("power").cast(pl.Float64)
+    if power.null_count() == power.shape[0]:
+        power = power.clear()
+    # A single NaN would carry through the prefix sums into every later window
+    power = power.fill_nan(None).fill_null(0.0).to_numpy()
+    power_prefix = np.concatenate([[0.0], np.cumsum(power)])
+    if "heartrate" in df and df["heartrate"].null_count() < df.shape[0]:
+        heartrate = (
+            df.get_column("heartrate")
+            .cast(pl.Float64)
+            .fill_nan(None)
+            .fill_null(0.0)
+            .to_numpy()
+        )
+    else:
+        heartrate = np.full(power.shape[0], np.nan)
+    hr_prefix = np.concatenate([[0.0], np.cumsum(heartrate)])
+
+    rows = {
+        "Duration": [],
+        "Rank": [],
+        "Start offset": [],
+        "Average power": [],
+        "Average heartrate": [],
+    }
+    offsets = df.get_column("duration")
+    for duration_seconds in durations_seconds:
+        if duration_seconds > power.shape[0]:
+            continue
+        window_means = (
+            power_prefix[duration_seconds:] - power_prefix[:-duration_seconds]
+        ) / duration_seconds
+        starts = np.array(
+            _non_overlapping_top_k(window_means, duration_seconds, k), dtype=np.int64
+        )
+        hr_means = (
+            hr_prefix[starts + duration_seconds] - hr_prefix[starts]
+        ) / duration_seconds
+
+        rows["Duration"].extend([duration_seconds] * starts.shape[0])
+        rows["Rank"].extend(range(1, starts.shape[0] + 1))
+        rows["Start offset"].extend(offsets.gather(starts).to_list())
+        rows["Average power"].extend(window_means[starts].tolist())
+        rows["Average heartrate"].extend(hr_means.tolist())
+
+    return pl.DataFrame(
+        rows,
+        schema={
+            "Duration": pl.Int64,
+            "Rank": pl.Int64,
+            "Start offset": offsets.dtype,
+            "Average power": pl.Float64,
+            "Average heartrate": pl.Float64,
+        },
+    ).with_columns(pl.col("Average heartrate").fill_nan(None))
@@ -84,16 +84,7 @@ def parse_strava_series(series_file_path: str) -> pl.DataFrame:
     return pl.DataFrame(dataframe)
 
 
-def get_time_series(file_path: str, root_path: str = "./") -> pl.DataFrame:
-    """
-    Returns the time series data for an activity, using a parquet cache to avoid re-parsing.
-
-    :param file_path: Relative path to the source file (e.g., "fit_files/123.fit")
-    :param root_path: Root directory of the project
-    :return: Parsed time series as a DataFrame
-    """
-    full_source_path = os.path.join(root_path, file_path)
-
+def get_cache_path(file_path: str, root_path: str = "./") -> str:
     # Derive cache path: fit_files/foo.fit -> cache/foo_fit.parquet
     #                    fit_files/foo.json -> cache/foo_json.parquet
     if file_path.endswith(".fit"):
@@ -105,7 +96,19 @@ def get_time_series(file_path: str, root_path: str = "./") -> pl.DataFrame:
             ".json", "_json.parquet"
         )
 
-    cache_path = os.path.join(root_path, cache_relative)
+    return os.path.join(root_path, cache_relative)
+
+
+def get_time_series(file_path: str, root_path: str = "./") -> pl.DataFrame:
+    """
+    Returns the time series data for an activity, using a parquet cache to avoid re-parsing.
+
+    :param file_path: Relative path to the source file (e.g., "fit_files/123.fit")
+    :param root_path: Root directory of the project
+    :return: Parsed time series as a DataFrame
+    """
+    full_source_path = os.path.join(root_path, file_path)
+    cache_path = get_cache_path(file_path, root_path)
 
     if os.path.exists(cache_path):
         return pl.read_parquet(cache_path)
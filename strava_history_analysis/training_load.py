@@ -0,0 +1,204 @@
+"""
+Docstring for training_load
+
+This module builds the fitness/fatigue timeline (CTL/ATL/TSB) from per-activity training stress.
+
+- Training stress (TSS) for an activity is computed from its normalized power and moving time, relative to an FTP.
+- The normalized power is cached per activity, so a change of FTP only rescales the cached values.
+- CTL and ATL are exponentially weighted sums of daily TSS, with 42 and 7 day time constants respectively,
+  and TSB (form) is yesterday's CTL minus yesterday's ATL.
+- Both tables are persisted next to the spine, and only the delta is computed when new rides sync.
+"""
+
+import os
+from datetime import timedelta
+
+import numpy as np
+import polars as pl
+from scipy.signal import lfilter
+
+from .database import get_spine
+from .time_series_functions import compute_normalized_power
+
+CTL_TIME_CONSTANT = 42  # days
+ATL_TIME_CONSTANT = 7  # days
+
+ACTIVITY_STRESS_SCHEMA = {
+    "Activity ID": pl.Int64,
+    "Activity Date": pl.Datetime("us", "UTC"),
+    "Moving Time": pl.Int64,
+    "Normalized power": pl.Float64,
+    "FTP": pl.Float64,
+    "TSS": pl.Float64,
+}
+
+
+def training_stress(ftp: float) -> pl.Expr:
+    # TSS = seconds * NP * IF / (FTP * 3600) * 100, with IF = NP / FTP
+    return (
+        (pl.col("Moving Time") * pl.col("Normalized power") ** 2 / ftp**2 / 36)
+        .fill_null(0.0)
+        .fill_nan(0.0)
+        .alias("TSS")
+    )
+
+
+def compute_activity_training_stress(
+    df: pl.DataFrame,
+    ftp: float,
+    root_path="./",
+    cached: pl.DataFrame | None = None,
+) -> pl.DataFrame:
+    """
+    Returns one row per activity in the spine `df` with its normalized power and TSS.
+
+    Normalized power is only computed (from the time series) for activities missing from `cached`.
+    Cached rows whose FTP differs from `ftp` are rescaled from their stored normalized power.
+    """
+    if cached is None:
+        cached = pl.DataFrame(schema=ACTIVITY_STRESS_SCHEMA)
+
+    unseen = df.join(cached.select("Activity ID"), on="Activity ID", how="anti")
+    new_rows = unseen.select(
+        pl.col("Activity ID"),
+        pl.col("Activity Date"),
+        pl.col("Moving Time"),
+        pl.col("Filename")
+        .map_elements(
+            lambda f: compute_normalized_power(f, root_path),
+            return_dtype=pl.Float64,
+        )
+        .alias("Normalized power"),
+    )
+
+    return (
+        pl.concat(
+            [cached.select(new_rows.columns), new_rows],
+            how="vertical_relaxed",
+        )
+        .with_columns(pl.lit(ftp, dtype=pl.Float64).alias("FTP"), training_stress(ftp))
+        .select(list(ACTIVITY_STRESS_SCHEMA))
+        .sort("Activity Date")
+    )
+
+
+def _exponentially_weighted_sum(
+    daily_tss: np.ndarray, time_constant: float, initial: float
+) -> np.ndarray:
+    # y_t = k * y_{t-1} + (1 - k) * x_t, evaluated as a single IIR filter pass
+    k = np.exp(-1.0 / time_constant)
+    result, _ = lfilter([1.0 - k], [1.0, -k], daily_tss, zi=[k * initial])
+    return result
+
+
+def daily_training_load(
+    activity_stress: pl.DataFrame,
+    previous: pl.DataFrame | None = None,
+    until=None,
+) -> pl.DataFrame:
+    """
+    Builds the daily Date/TSS/CTL/ATL/TSB table from per-activity TSS.
+
+    If `previous` (an earlier output of this function) is passed, its rows before the first day that
+    needs recomputing are kept as is, and the filters are resumed from its state on the day before.
+    That day is the day after its last row, or the earliest day with an activity it hasn't seen
+    (so a late-synced old ride still gets folded in).
+    """
+    daily = (
+        activity_stress.group_by(pl.col("Activity Date").dt.date().alias("Date"))
+        .agg(pl.col("TSS").sum(), pl.col("Activity ID").count().alias("Activities"))
+        .sort("Date")
+    )
+    if daily.is_empty():
+        return pl.DataFrame(
+            schema={
+                "Date": pl.Date,
+                "TSS": pl.Float64,
+                "Activities": pl.UInt32,
+                "CTL": pl.Float64,
+                "ATL": pl.Float64,
+                "TSB": pl.Float64,
+            }
+        )
+
+    last_day = daily["Date"].max()
+    if until is not None:
+        last_day = max(last_day, until)
+
+    start = daily["Date"].min()
+    kept = None
+    ctl0, atl0 = 0.0, 0.0
+    if previous is not None and not previous.is_empty():
+        start = previous["Date"].max() + timedelta(days=1)
+        changed = daily.join(
+            previous.select("Date", "TSS", "Activities"),
+            on=["Date", "TSS", "Activities"],
+            how="anti",
+        ).filter(pl.col("Date") <= previous["Date"].max())
+        if not changed.is_empty():
+            start = changed["Date"].min()
+        kept = previous.filter(pl.col("Date") < start)
+        if not kept.is_empty():
+            ctl0, atl0 = kept["CTL"][-1], kept["ATL"][-1]
+
+    if start > last_day:
+        return previous
+
+    timeline = (
+        pl.DataFrame({"Date": pl.date_range(start, last_day, "1d", eager=True)})
+        .join(daily, on="Date", how="left")
+        .with_columns(
+            pl.col("TSS").fill_null(0.0),
+            pl.col("Activities").fill_null(0).cast(pl.UInt32),
+        )
+    )
+
+    tss = timeline["TSS"].to_numpy()
+    ctl = _exponentially_weighted_sum(tss, CTL_TIME_CONSTANT, ctl0)
+    atl = _exponentially_weighted_sum(tss, ATL_TIME_CONSTANT, atl0)
+    tsb = np.concatenate([[ctl0], ctl[:-1]]) - np.concatenate([[atl0], atl[:-1]])
+
+    timeline = timeline.with_columns(
+        pl.Series("CTL", ctl),
+        pl.Series("ATL", atl),
+        pl.Series("TSB", tsb),
+    )
+
+    if kept is None:
+        return timeline
+    return pl.concat([kept, timeline])
+
+
+def get_training_load(ftp: float, root_path="./", poll_strava=False, until=None):
+    """
+    Returns (activity_stress, daily_load), extending the cached tables in the database directory
+    with whatever activities the spine has that they don't.
+    """
+    activity_stress_path = os.path.join(
+        root_path, "database", "activity_training_stress.parquet"
+    )
+    daily_load_path = os.path.join(root_path, "database", "training_load.parquet")
+
+    df = get_spine(root_path=root_path, poll_strava=poll_strava)
+
+    cached_stress = None
+    previous_load = None
+    if os.path.exists(activity_stress_path):
+        cached_stress = pl.read_parquet(activity_stress_path)
+    if os.path.exists(daily_load_path):
+        previous_load = pl.read_parquet(daily_load_path)
+    if cached_stress is not None and (cached_stress["FTP"] != ftp).any():
+        # Every TSS changes with the FTP, so the timeline has to be rebuilt
+        previous_load = None
+
+    activity_stress = compute_activity_training_stress(
+        df, ftp, root_path=root_path, cached=cached_stress
+    )
+    daily_load = daily_training_load(
+        activity_stress, previous=previous_load, until=until
+    )
+
+    activity_stress.write_parquet(activity_stress_path)
+    daily_load.write_parquet(daily_load_path)
+
+    return activity_stress, daily_load
@@ -0,0 +1,336 @@
+"""
+Docstring for work_queue
+
+This module runs the hyperparameter search as a work queue in a shared directory, so that workers on any
+machine that can see the directory (NFS, a synced folder, or just local disk) can join in.
+
+- The driver writes the observation tensor and one file per chunk of (tau, alpha, stickiness) points
+  into the queue directory, and then collects results as they show up.
+- A worker claims a chunk by creating claims/<chunk> exclusively (O_CREAT | O_EXCL, which is atomic on
+  local filesystems and NFSv3+), evaluates it with get_batched_hyperparameter_loss, writes
+  results/<chunk>.npy through a temporary file and a rename, and drops the claim.
+- While it evaluates, a worker touches its claim every few seconds. A claim that hasn't been touched
+  for lease_seconds belongs to a dead worker: the next worker renames it away (only one rename can win)
+  and claims the chunk itself. Results are only ever written whole, so a chunk evaluated twice is harmless.
+- create_queue starts a fresh run: it clears out the chunks, claims and results of any earlier run in the
+  directory, and writes a new run id. A worker stops as soon as the run id it started with changes, so a
+  straggler from the earlier run can't file its results under the new run's chunks.
+- Workers can be started by hand with `python -m strava_history_analysis.work_queue <queue_dir>`, and
+  distributed_grid_search can start a few local ones too.
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Iterator, Tuple
+
+import numpy as np
+import polars as pl
+
+from .hyperparameter_fit import (
+    ALPHA_RANGE,
+    BATCH_SIZE,
+    STICKINESS_RANGE,
+    TAU_RANGE,
+    get_batched_hyperparameter_loss,
+)
+
+LEASE_SECONDS = 60.0
+
+
+def _paths(queue_dir: str) -> dict:
+    return {
+        name: os.path.join(queue_dir, name) for name in ["tasks", "claims", "results"]
+    }
+
+
+def _read_run_id(queue_dir: str) -> str | None:
+    try:
+        with open(os.path.join(queue_dir, "run")) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _atomic_save(path: str, array: np.ndarray):
+    temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, "wb") as f:
+        np.save(f, array)
+    os.replace(temporary_path, path)
+
+
+def create_queue(
+    queue_dir: str,
+    observations: dict,
+    taus: np.ndarray,
+    alphas: np.ndarray,
+    stickinesses: np.ndarray,
+    chunk_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Writes the observations (the output of extract_observation_tensor) and the points, in chunks of
+    chunk_size, into queue_dir, replacing whatever an earlier run left there. Returns the number of chunks.
+    """
+    paths = _paths(queue_dir)
+    os.makedirs(queue_dir, exist_ok=True)
+    # Retire the earlier run's workers first, then clear out its files
+    temporary_path = os.path.join(queue_dir, f"run.{uuid.uuid4().hex}.tmp")
+    with open(temporary_path, "w") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(temporary_path, os.path.join(queue_dir, "run"))
+    for path in paths.values():
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    temporary_path = os.path.join(queue_dir, f"observations.{uuid.uuid4().hex}.npz")
+    np.savez(temporary_path, **observations)
+    os.replace(temporary_path, os.path.join(queue_dir, "observations.npz"))
+
+    points = np.stack([taus, alphas, stickinesses], axis=-1).astype(np.float64)
+    n_chunks = 0
+    for b in range(0, points.shape[0], chunk_size):
+        _atomic_save(
+            os.path.join(paths["tasks"], f"{n_chunks:06d}.npy"),
+            points[b : b + chunk_size],
+        )
+        n_chunks += 1
+    return n_chunks
+
+
+def _try_claim(claim_path: str, worker_id: str, lease_seconds: float) -> bool:
+    try:
+        fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            stale = time.time() - os.stat(claim_path).st_mtime > lease_seconds
+        except FileNotFoundError:
+            stale = False
+        if not stale:
+            return False
+        # Rename the dead worker's claim out of the way; of several workers racing here
+        # only one rename succeeds, and the rest see FileNotFoundError
+        stale_path = f"{claim_path}.stale.{uuid.uuid4().hex}"
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            return False
+        os.remove(stale_path)
+        return _try_claim(claim_path, worker_id, lease_seconds)
+
+    with os.fdopen(fd, "w") as f:
+        f.write(worker_id)
+    return True
+
+
+def _release_claim(claim_path: str, worker_id: str):
+    # If our lease ran out and another worker took the chunk over, the claim is theirs now
+    try:
+        with open(claim_path) as f:
+            if f.read() == worker_id:
+                os.remove(claim_path)
+    except FileNotFoundError:
+        pass
+
+
+def _heartbeat(claim_path: str, stop: threading.Event, interval: float):
+    while not stop.wait(interval):
+        try:
+            os.utime(claim_path)
+        except FileNotFoundError:
+            return
+
+
+def run_worker(
+    queue_dir: str,
+    worker_id: str | None = None,
+    lease_seconds: float = LEASE_SECONDS,
+    poll_seconds: float = 1.0,
+) -> int:
+    """
+    Claims and evaluates chunks until every chunk in the queue has a result, waiting on chunks other
+    workers hold in case their leases run out. Returns the number of chunks this worker evaluated.
+    """
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    paths = _paths(queue_dir)
+    run_id = _read_run_id(queue_dir)
+    with np.load(os.path.join(queue_dir, "observations.npz")) as data:
+        observations = {key: data[key] for key in data.files}
+
+    evaluated = 0
+    while True:
+        if _read_run_id(queue_dir) != run_id:
+            return evaluated
+        pending = [
+            chunk
+            for chunk in sorted(os.listdir(paths["tasks"]))
+            if not os.path.exists(os.path.join(paths["results"], chunk))
+        ]
+        if not pending:
+            return evaluated
+
+        claimed = None
+        for chunk in pending:
+            claim_path = os.path.join(paths["claims"], chunk)
+            if _try_claim(claim_path, worker_id, lease_seconds):
+                claimed = chunk
+                break
+        if claimed is None:
+            time.sleep(poll_seconds)
+            continue
+
+        claim_path = os.path.join(paths["claims"], claimed)
+        result_path = os.path.join(paths["results"], claimed)
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat,
+            args=(claim_path, stop, lease_seconds / 4),
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            # The chunk may have been finished by a worker whose claim we took over
+            if not os.path.exists(result_path):
+                points = np.load(os.path.join(paths["tasks"], claimed))
+                losses = get_batched_hyperparameter_loss(
+                    observations, points[:, 0], points[:, 1], points[:, 2]
+                )
+                if _read_run_id(queue_dir) != run_id:
+                    return evaluated
+                _atomic_save(result_path, losses)
+                evaluated += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+            _release_claim(claim_path, worker_id)
+
+
+def iter_results(
+    queue_dir: str, poll_seconds: float = 1.0, timeout: float | None = None
+) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Yields (chunk, points, losses) for every chunk as its result appears, until all chunks are done.
+    Raises TimeoutError if that takes longer than timeout seconds.
+    """
+    paths = _paths(queue_dir)
+    chunks = sorted(os.listdir(paths["tasks"]))
+    seen = set()
+    start = time.perf_counter()
+    while len(seen) < len(chunks):
+        done = set(os.listdir(paths["results"])) - seen
+        for chunk in sorted(done.intersection(chunks)):
+            seen.add(chunk)
+            yield (
+                chunk,
+                np.load(os.path.join(paths["tasks"], chunk)),
+                np.load(os.path.join(paths["results"], chunk)),
+            )
+        if len(seen) < len(chunks):
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError(
+                    f"{len(chunks) - len(seen)} chunks in {queue_dir} still pending"
+                )
+            time.sleep(poll_seconds)
+
+
+def start_local_workers(
+    queue_dir: str, n_workers: int, lease_seconds: float = LEASE_SECONDS
+) -> list:
+    """
+    Starts n_workers worker processes on this machine and returns their Popen handles.
+    """
+    return [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "strava_history_analysis.work_queue",
+                queue_dir,
+                "--lease-seconds",
+                str(lease_seconds),
+            ]
+        )
+        for _ in range(n_workers)
+    ]
+
+
+def distributed_grid_search(
+    queue_dir: str,
+    observations: dict,
+    tau_axis: np.ndarray = TAU_RANGE,
+    alpha_axis: np.ndarray = ALPHA_RANGE,
+    stickiness_axis: np.ndarray = STICKINESS_RANGE,
+    n_local_workers: int = 0,
+    lease_seconds: float = LEASE_SECONDS,
+    timeout: float | None = None,
+):
+    """
+    Queues the full grid over the axes, optionally starts some local workers, and aggregates the results
+    as they arrive (workers elsewhere can join at any time). Returns (tau, alpha, stickiness, loss) of the
+    best point, along with a DataFrame of every point's loss.
+    """
+    taus, alphas, stickinesses = (
+        a.ravel()
+        for a in np.meshgrid(tau_axis, alpha_axis, stickiness_axis, indexing="ij")
+    )
+    n_chunks = create_queue(queue_dir, observations, taus, alphas, stickinesses)
+    workers = start_local_workers(queue_dir, n_local_workers, lease_seconds)
+
+    best = (None, None, None, np.inf)
+    frames = []
+    finished = False
+    try:
+        for i, (chunk, points, losses) in enumerate(
+            iter_results(queue_dir, timeout=timeout)
+        ):
+            losses = np.where(np.isnan(losses), np.inf, losses)
+            j = int(np.argmin(losses))
+            if losses[j] < best[3]:
+                best = (*map(float, points[j]), float(losses[j]))
+            frames.append(
+                pl.DataFrame(
+                    {
+                        "tau": points[:, 0],
+                        "alpha": points[:, 1],
+                        "stickiness": points[:, 2],
+                        "loss": losses,
+                    }
+                )
+            )
+            print(f"chunk {chunk} done ({i + 1}/{n_chunks}), best loss {best[3]}")
+        finished = True
+    finally:
+        for worker in workers:
+            if not finished:
+                worker.terminate()
+            worker.wait()
+
+    return (*best, pl.concat(frames))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate hyperparameter chunks from a shared queue directory"
+    )
+    parser.add_argument("queue_dir")
+    parser.add_argument("--worker-id", default=None)
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    parser.add_argument("--poll-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+    evaluated = run_worker(
+        args.queue_dir,
+        worker_id=args.worker_id,
+        lease_seconds=args.lease_seconds,
+        poll_seconds=args.poll_seconds,
+    )
+    print(f"evaluated {evaluated} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import polars as pl
+
+from strava_history_analysis.duplicates import (
+    drop_duplicates,
+    find_duplicates,
+    get_duplicates,
+)
+from strava_history_analysis.time_series_parser import get_cache_path
+
+START = datetime(2024, 6, 1, 8, tzinfo=timezone.utc)
+
+
+def write_recording(root_path, filename, start, heartrate, power=None):
+    n = heartrate.shape[0]
+    columns = {
+        "timestamp (None)": [start + timedelta(seconds=s) for s in range(n)],
+        "heart_rate (bpm)": heartrate,
+    }
+    if power is not None:
+        columns["power (watts)"] = power
+    cache_path = get_cache_path(filename, str(root_path))
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    pl.DataFrame(columns).write_parquet(cache_path)
+
+
+def watch_and_head_unit(root_path):
+    # The head unit records power and has the bike as gear; the watch only records HR,
+    # and was started two minutes earlier (so it has more moving time)
+    rng = np.random.default_rng(0)
+    n = 3600
+    heartrate = 130 + 15 * np.sin(np.arange(n + 120) / 300.0)
+    write_recording(
+        root_path,
+        "fit_files/activities/1.fit",
+        START,
+        heartrate[120:] + rng.normal(0, 1, n),
+        power=200 + rng.normal(0, 20, n),
+    )
+    write_recording(
+        root_path,
+        "fit_files/activities/2.fit",
+        START - timedelta(seconds=120),
+        heartrate + rng.normal(0, 2, n + 120),
+    )
+    return pl.DataFrame(
+        {
+            "Activity ID": [1, 2],
+            "Activity Date": [START, START - timedelta(seconds=120)],
+            "Activity Gear": ["Bike", None],
+            "Elapsed Time": [3600, 3720],
+            "Moving Time": [3600, 3700],
+            "Distance": [100000.0, 101000.0],
+            "Filename": ["fit_files/activities/1.fit", "fit_files/activities/2.fit"],
+        }
+    )
+
+
+def test_watch_and_head_unit_keeps_the_power_recording(tmp_path):
+    spine = watch_and_head_unit(tmp_path)
+    duplicates = find_duplicates(spine, root_path=str(tmp_path))
+
+    assert duplicates["Confirmed"].to_list() == [True]
+    assert drop_duplicates(spine, duplicates)["Activity ID"].to_list() == [1]
+
+
+def test_gear_breaks_ties_before_moving_time():
+    spine = pl.DataFrame(
+        {
+            "Activity ID": [1, 2],
+            "Activity Gear": ["Bike", None],
+            "Moving Time": [3600, 3700],
+        }
+    )
+    duplicates = pl.DataFrame(
+        {
+            "Activity ID": [1],
+            "Duplicate ID": [2],
+            "Confirmed": [True],
+            "Activity has power": [False],
+            "Duplicate has power": [False],
+        }
+    )
+    assert drop_duplicates(spine, duplicates)["Activity ID"].to_list() == [1]
+
+    without_gear = spine.with_columns(
+        pl.lit(None, dtype=pl.String).alias("Activity Gear")
+    )
+    assert drop_duplicates(without_gear, duplicates)["Activity ID"].to_list() == [2]
+
+
+def test_the_same_activity_twice_is_kept_once(tmp_path):
+    # The same ride from the CSV dump and an API pull, next to a second recording of it
+    spine = watch_and_head_unit(tmp_path)
+    repeated = pl.concat([spine.head(1), spine])
+    duplicates = find_duplicates(repeated, root_path=str(tmp_path))
+
+    assert duplicates.select("Activity ID", "Duplicate ID").rows() == [(2, 1)]
+    assert drop_duplicates(repeated, duplicates)["Activity ID"].to_list() == [1]
+
+    alone = pl.concat([spine.head(1), spine.head(1)])
+    assert find_duplicates(alone, root_path=str(tmp_path)).is_empty()
+    self_pair = duplicates.with_columns(pl.col("Activity ID").alias("Duplicate ID"))
+    assert drop_duplicates(alone, self_pair)["Activity ID"].to_list() == [1]
+
+
+def test_get_duplicates_only_checks_new_pairs(tmp_path):
+    spine = watch_and_head_unit(tmp_path)
+    first = get_duplicates(spine, root_path=str(tmp_path))
+
+    # With the fingerprints gone, a recheck couldn't confirm the pair any more
+    for path in (tmp_path / "cache").rglob("*.parquet"):
+        path.unlink()
+
+    assert get_duplicates(spine, root_path=str(tmp_path)).equals(first)
+    assert first["Confirmed"].to_list() == [True]
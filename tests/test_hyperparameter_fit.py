@@ -0,0 +1,41 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from strava_history_analysis.hyperparameter_fit import (
+    STICKINESS_RANGE,
+    extract_observation_tensor,
+    get_batched_hyperparameter_loss,
+    get_hyperparameter_loss,
+)
+
+
+def synthetic_dfnpf(n=60, seed=0):
+    # The observation columns of compute_observation_columns, for a rider with a steady P(t)
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(200, 250, n)
+    columns = {"Moving Time": rng.integers(3600, 5 * 3600, n)}
+    for minutes in [5, 10, 20, 60, 120]:
+        columns[f"Peak {minutes}m average power"] = base * minutes**-0.05 * rng.uniform(
+            0.8, 1.05, n
+        ) + 300 / (minutes + 0.5)
+    columns["Peak 1h normalized power"] = base * 0.95 * rng.uniform(0.9, 1.05, n)
+    columns["Peak 2h normalized power"] = [
+        None if i % 7 == 0 else p for i, p in enumerate(base * 0.9)
+    ]
+    columns["Normalized power"] = base * 0.85 * rng.uniform(0.9, 1.05, n)
+    return pl.DataFrame(columns)
+
+
+@pytest.mark.parametrize("stickiness", STICKINESS_RANGE[::11])
+def test_batched_loss_matches_the_scalar_newton_loss(stickiness):
+    dfnpf = synthetic_dfnpf()
+    batched = get_batched_hyperparameter_loss(
+        extract_observation_tensor(dfnpf),
+        np.array([0.5]),
+        np.array([0.055]),
+        np.array([stickiness]),
+    )[0]
+    scalar = get_hyperparameter_loss(dfnpf, 0.5, 0.055, stickiness, method="newton")
+
+    assert batched == pytest.approx(scalar, rel=1e-6)
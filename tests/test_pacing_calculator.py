@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from scipy.optimize import minimize
+
+from strava_history_analysis.pacing_calculator import PacingModel
+
+CENSORED_DURATIONS = [5, 10, 20, 60, 120]
+UNCENSORED_DURATIONS = [60, 120]
+
+
+def synthetic_history(n=20, seed=0):
+    # (censored, uncensored) observation lists of n rides by a rider with P(t) ~ 300 / (t + 0.5) + 230 t^-0.05
+    rng = np.random.default_rng(seed)
+    history = []
+    for base in rng.uniform(200, 250, n):
+        powers = {
+            d: base * d**-0.05 * rng.uniform(0.8, 1.05) + 300 / (d + 0.5)
+            for d in CENSORED_DURATIONS
+        }
+        history.append(
+            (
+                [(d, powers[d]) for d in CENSORED_DURATIONS],
+                [(d, powers[d] * rng.uniform(0.9, 1.0)) for d in UNCENSORED_DURATIONS],
+            )
+        )
+    return history
+
+
+def reference_posterior(model, censored, uncensored):
+    # The mode from a tightly converged BFGS run, and the covariance from a finite difference
+    # hessian of the gradient there
+    args = model._posterior_args(censored, uncensored)
+    result = minimize(
+        model._neg_log_posterior,
+        x0=args[0],
+        args=args,
+        jac=True,
+        method="BFGS",
+        options={"gtol": 1e-10, "maxiter": 10_000},
+    )
+    step = 1e-4 * (1.0 + np.abs(result.x))
+    hessian = np.empty((2, 2))
+    for i in range(2):
+        e = np.zeros(2)
+        e[i] = step[i]
+        hessian[:, i] = (
+            model._neg_log_posterior(result.x + e, *args)[1]
+            - model._neg_log_posterior(result.x - e, *args)[1]
+        ) / (2 * step[i])
+    hessian = (hessian + hessian.T) / 2
+    return result.x, np.linalg.inv(hessian)
+
+
+@pytest.mark.parametrize("stickiness", [1.0, 5.0, 20.0, 58.0, 200.0])
+def test_newton_update_matches_the_converged_posterior(stickiness):
+    model = PacingModel(
+        anaerobic_work=373,
+        watts_scaling_factor=224,
+        covariance_matrix=np.diag([100.0**2, 30.0**2]),
+        tau=0.5,
+        alpha=0.055,
+        stickiness=stickiness,
+    )
+    for censored, uncensored in synthetic_history():
+        mean, covariance = reference_posterior(model, censored, uncensored)
+        model.update_based_on_observations(censored, uncensored, method="newton")
+
+        np.testing.assert_allclose(
+            [model.anaerobic_work, model.watts_scaling_factor], mean, rtol=1e-6
+        )
+        np.testing.assert_allclose(
+            model.covariance_matrix - np.diag([100.0, 25.0]), covariance, rtol=1e-4
+        )
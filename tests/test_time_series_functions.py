@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+import numpy as np
+import polars as pl
+
+from strava_history_analysis.time_series_functions import top_k_efforts
+
+
+def adapted(power, heartrate=None):
+    n = len(power)
+    columns = {
+        "duration": pl.Series([timedelta(seconds=s) for s in range(n)]),
+        "power": pl.Series(power, dtype=pl.Float64),
+    }
+    if heartrate is not None:
+        columns["heartrate"] = pl.Series(heartrate, dtype=pl.Float64)
+    return pl.DataFrame(columns)
+
+
+def test_top_k_efforts_treats_dropouts_as_zeros():
+    power = [200.0] * 900
+    power[100:110] = [None] * 10
+    efforts = top_k_efforts(adapted(power, [140.0] * 900), [60, 900], k=2)
+
+    assert efforts["Average power"].null_count() == 0
+    assert not efforts["Average power"].is_nan().any()
+    # Minutes after the dropout are unaffected, and the whole ride counts it as ten seconds of zeros
+    minutes = efforts.filter(pl.col("Duration") == 60)["Average power"].to_list()
+    assert minutes == [200.0, 200.0]
+    whole_ride = efforts.filter(pl.col("Duration") == 900)["Average power"].item()
+    assert np.isclose(whole_ride, 200.0 * 890 / 900)
+
+
+def test_top_k_efforts_without_power_is_empty():
+    efforts = top_k_efforts(adapted([None] * 600, [140.0] * 600), [60], k=3)
+    assert efforts.is_empty()